@@ -1,178 +1,958 @@
-from flask import Flask, request, send_file, jsonify, render_template
+# Cold-start import time is reported as securecloud_startup_seconds{phase="import"}
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, render_template
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
-from Crypto.Cipher import AES
 import os
 import json
+import logging
 import base64
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+import hashlib
+import hmac
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+import bisect
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import io
-import pickle
+import admission
+import container
+import chunking
+import drive_client
+import replication
+import metadata_store
+import cloud_cache
+import blob_cache
+import cloud_fetch
+import metrics
+import key_store
+import rekey
+import storage
 
 app = Flask(__name__)
 UPLOAD_FOLDER = 'encrypted_files'
-KEY = b'ThisIsASecretKey'  # 16 bytes key for AES-128
+KEY = b'ThisIsASecretKey'  # 16 bytes key for AES-128 (key 0 in the keyring)
+
+# Content IDs for deduplication are keyed hashes of the plaintext; they
+# stay derived from KEY so they do not change when keys are rotated
+DEDUPE_KEY = hashlib.sha256(b'securecloud-dedupe:' + KEY).digest()
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+
+# Resumable Drive uploads are sent in chunks of this size (must be a
+# multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = int(os.environ.get('SECURECLOUD_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+# Compression before encryption: 'auto' samples each file's first block
+# and uses zstd (if installed) or zlib unless it already looks compressed;
+# 'none', 'zlib' or 'zstd' force a codec
+COMPRESSION = os.environ.get('SECURECLOUD_COMPRESSION', 'auto')
+
+# AEAD cipher for new files: 'eax', 'gcm' or 'chacha20-poly1305'. Each
+# file names its cipher in the header, so files written with another
+# setting stay readable (python benchmark.py --ciphers compares them)
+CIPHER = os.environ.get('SECURECLOUD_CIPHER', 'eax').lower()
+container.cipher_id(CIPHER)
+
+# Delta sync: uploads of at least DELTA_MIN_SIZE bytes are split into
+# content-defined chunks of about DELTA_CHUNK_SIZE bytes, and only chunks
+# that are not stored yet are encrypted and replicated. Off by default (0):
+# the chunker runs in Python at a few MB/s and holds the GIL while it does,
+# so it only pays off for large files that are re-uploaded with small edits
+DELTA_MIN_SIZE = int(os.environ.get('SECURECLOUD_DELTA_MIN_SIZE', 0))
+DELTA_CHUNK_SIZE = int(os.environ.get('SECURECLOUD_DELTA_CHUNK_SIZE', chunking.DEFAULT_CHUNK_SIZE))
+
+# Batch uploads encrypt on a shared thread pool (PyCryptodome releases
+# the GIL while encrypting); archive members up to BATCH_INLINE_LIMIT
+# bytes are buffered so the archive stream can move on to the next one
+BATCH_WORKERS = int(os.environ.get('SECURECLOUD_BATCH_WORKERS', os.cpu_count() or 4))
+BATCH_INLINE_LIMIT = 8 * 1024 * 1024
+ARCHIVE_MIMETYPES = {
+    'application/x-tar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip'
+}
+
+# The cached Drive listing is refreshed from the changes feed in the
+# background; /files pulls deltas itself once it is older than this
+CLOUD_LISTING_MAX_STALENESS = float(os.environ.get('SECURECLOUD_CLOUD_LISTING_MAX_STALENESS', 30))
+CLOUD_LISTING_REFRESH_INTERVAL = float(os.environ.get('SECURECLOUD_CLOUD_LISTING_REFRESH_INTERVAL', 10))
+
+# Cloud-only blobs are cached on local disk after their first download,
+# up to this many bytes in total (least recently used are evicted first)
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('SECURECLOUD_BLOB_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Drive downloads are split into parts of this size and fetched with
+# concurrent Range requests
+DOWNLOAD_PART_SIZE = int(os.environ.get('SECURECLOUD_DOWNLOAD_PART_SIZE', 8 * 1024 * 1024))
+DOWNLOAD_WORKERS = int(os.environ.get('SECURECLOUD_DOWNLOAD_WORKERS', 4))
+
+# Hot tier: blobs are encrypted into these directories (os.pathsep
+# separated, e.g. one per disk); each new blob goes to the one with the
+# most free space
+BLOB_VOLUMES = [v for v in os.environ.get('SECURECLOUD_BLOB_VOLUMES', BLOB_FOLDER).split(os.pathsep) if v]
+
+# Replica tier that uploads are copied to and cloud-only files are
+# fetched from: 'drive' (Google Drive), 's3' (AWS S3 or an S3-compatible
+# store such as MinIO, needs boto3) or 'local' (directories, e.g. a NAS
+# mount). S3 credentials come from the usual AWS_* variables
+STORAGE_BACKEND = os.environ.get('SECURECLOUD_STORAGE_BACKEND', 'drive').lower()
+S3_BUCKET = os.environ.get('SECURECLOUD_S3_BUCKET')
+S3_PREFIX = os.environ.get('SECURECLOUD_S3_PREFIX', '')
+S3_ENDPOINT = os.environ.get('SECURECLOUD_S3_ENDPOINT')
+S3_REGION = os.environ.get('SECURECLOUD_S3_REGION')
+STORAGE_LOCAL_VOLUMES = [v for v in os.environ.get('SECURECLOUD_STORAGE_LOCAL_VOLUMES',
+                                                   os.path.join(UPLOAD_FOLDER, 'replica')).split(os.pathsep) if v]
+
+# Log verbosity. The per-request trace is logged at DEBUG and successful
+# operations at INFO, so the hot path is quiet at the default WARNING
+LOG_LEVEL = os.environ.get('SECURECLOUD_LOG_LEVEL', 'WARNING').upper()
+log = logging.getLogger('securecloud')
+
+# Re-encryption after a key rotation runs on this many threads, in
+# batches of REKEY_BATCH_SIZE blobs, at most this many bytes per second
+# (0 for no limit)
+REKEY_WORKERS = int(os.environ.get('SECURECLOUD_REKEY_WORKERS', 2))
+REKEY_BATCH_SIZE = int(os.environ.get('SECURECLOUD_REKEY_BATCH_SIZE', 32))
+REKEY_MAX_BYTES_PER_SECOND = int(os.environ.get('SECURECLOUD_REKEY_MAX_BYTES_PER_SECOND', 32 * 1024 * 1024))
+
+# Admission control: requests over these limits are turned away at once
+# with 413, 429 or 503 and a Retry-After header instead of slowing down
+# everything else (0 disables a limit). Uploads are capped at
+# UPLOAD_MAX_BYTES, other request bodies at MAX_REQUEST_BYTES; uploads in
+# progress may add up to INFLIGHT_UPLOAD_BYTES. Uploads without a
+# Content-Length start by counting UNKNOWN_LENGTH_RESERVE_BYTES and are
+# counted as the rest of the body arrives
+UPLOAD_MAX_BYTES = int(os.environ.get('SECURECLOUD_UPLOAD_MAX_BYTES', 16 * 1024 * 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get('SECURECLOUD_MAX_REQUEST_BYTES', 1024 * 1024))
+INFLIGHT_UPLOAD_BYTES = int(os.environ.get('SECURECLOUD_INFLIGHT_UPLOAD_BYTES', 8 * 1024 * 1024 * 1024))
+UNKNOWN_LENGTH_RESERVE_BYTES = int(os.environ.get('SECURECLOUD_UNKNOWN_LENGTH_RESERVE_BYTES', 64 * 1024 * 1024))
+
+# Per-client (remote address) limits on uploads, downloads and listings:
+# requests per second and bytes per second, each with a burst allowance.
+# Behind a reverse proxy every request has the proxy's address, so all
+# clients share one bucket unless TRUSTED_PROXIES is set to the number of
+# proxies in front of the app, whose X-Forwarded-For entries are trusted
+CLIENT_REQUESTS_PER_SECOND = float(os.environ.get('SECURECLOUD_CLIENT_REQUESTS_PER_SECOND', 0))
+CLIENT_REQUEST_BURST = float(os.environ.get('SECURECLOUD_CLIENT_REQUEST_BURST', 0)) or None
+CLIENT_BYTES_PER_SECOND = int(os.environ.get('SECURECLOUD_CLIENT_BYTES_PER_SECOND', 0))
+CLIENT_BYTE_BURST = int(os.environ.get('SECURECLOUD_CLIENT_BYTE_BURST', 0)) or None
+TRUSTED_PROXIES = int(os.environ.get('SECURECLOUD_TRUSTED_PROXIES', 0))
 
-# Google Drive API setup
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-CREDENTIALS_FILE = 'credentials.json'
-TOKEN_FILE = 'token.pickle'
+# At most DRIVE_MAX_CONCURRENCY Drive calls run at once and the rest
+# queue; requests that need Drive get a 503 once DRIVE_MAX_QUEUE calls
+# are waiting
+DRIVE_MAX_CONCURRENCY = int(os.environ.get('SECURECLOUD_DRIVE_MAX_CONCURRENCY', 8))
+DRIVE_MAX_QUEUE = int(os.environ.get('SECURECLOUD_DRIVE_MAX_QUEUE', 64))
+
+# The Werkzeug debugger allows code execution; only enable it locally
+DEBUG = os.environ.get('SECURECLOUD_DEBUG', '0') == '1'
+
+# Warm start: load the cipher code and the storage client (for Drive,
+# the Google client stack and service) in startup(), before the process
+# takes traffic, instead of on the first request that needs them
+PREWARM = os.environ.get('SECURECLOUD_PREWARM', '0') == '1'
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Also cuts off bodies sent without a Content-Length
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_MAX_BYTES, MAX_REQUEST_BYTES) \
+    if UPLOAD_MAX_BYTES and MAX_REQUEST_BYTES else None
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='encrypt')
+
+# Indexed file metadata; existing .meta.json sidecars are imported at startup
+metadata_index = metadata_store.MetadataStore(UPLOAD_FOLDER)
+
+# Encryption keys by ID; new blobs use the active key
+keyring = key_store.KeyRing(key_store.KEYRING_FILE, legacy_key=KEY,
+                            retire_check=lambda key_id: key_still_needed(key_id))
+
+# Hot-tier blob volumes
+blob_store = storage.LocalBackend(BLOB_VOLUMES)
 
 def get_google_drive_service():
-    """Get Google Drive service instance"""
-    creds = None
-    
-    # Load existing token
-    if os.path.exists(TOKEN_FILE):
-        try:
-            with open(TOKEN_FILE, 'rb') as token:
-                creds = pickle.load(token)
-        except Exception as e:
-            print(f"Failed to load token.pickle: {str(e)}")
-            creds = None
-    
-    # If no valid credentials, get new ones
-    if not creds or not creds.valid:
-        try:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                if os.path.exists(CREDENTIALS_FILE):
-                    print("OAuth redirect URI used: http://localhost:8081")
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        CREDENTIALS_FILE, 
-                        SCOPES,
-                        redirect_uri='http://localhost:8081'
-                    )
-                    creds = flow.run_local_server(port=8081, prompt='consent')
-                else:
-                    print("Credentials file not found.")
-                    return None
-        except Exception as e:
-            print(f"OAuth setup failed: {str(e)}")
-            print("Please run: python setup_cloud.py")
-            return None
-        
-        # Save credentials
-        try:
-            with open(TOKEN_FILE, 'wb') as token:
-                pickle.dump(creds, token)
-        except Exception as e:
-            print(f"Failed to save token.pickle: {str(e)}")
-    
-    try:
-        service = build('drive', 'v3', credentials=creds)
-        print("Google Drive service initialized successfully.")
-        return service
-    except Exception as e:
-        print(f"Failed to build Google Drive service: {str(e)}")
-        return None
+    """Get the shared Google Drive service instance"""
+    return drive_client.get_service()
 
 # AES encryption
 def encrypt_file(file_data, key):
-    cipher = AES.new(key, AES.MODE_EAX)
-    ciphertext, tag = cipher.encrypt_and_digest(file_data)
-    return cipher.nonce + tag + ciphertext
+    return container.encrypt_bytes(file_data, key, cipher=CIPHER)
+
+class HashingReader:
+    """Wrap a readable stream and hash the bytes as they are read.
+
+    Tracks a plain SHA-256 (the stored checksum) and a keyed HMAC used
+    as the content ID for deduplication, so blob names on disk and on
+    Drive do not reveal plaintext hashes.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+        self.content_hash = hmac.new(DEDUPE_KEY, digestmod=hashlib.sha256)
+        self.size = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.content_hash.update(data)
+        self.size += len(data)
+        self.seconds += time.perf_counter() - started
+        return data
+
+    def drain(self, chunk_size=1024 * 1024):
+        while self.read(chunk_size):
+            pass
+        return self
+
+class ChunkStream:
+    """Readable stream over an iterator of byte chunks"""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+class TimedWriter:
+    """Wrap a writable file and total the time spent in write()"""
+    def __init__(self, f):
+        self.f = f
+        self.seconds = 0.0
+
+    def write(self, data):
+        started = time.perf_counter()
+        written = self.f.write(data)
+        self.seconds += time.perf_counter() - started
+        return written
+
+# Streaming AES encryption straight to disk
+def store_content(stream, keys):
+    """Encrypt a stream into a content-addressed blob, reusing an identical stored blob.
+
+    Seekable streams (Werkzeug spools multipart parts to disk) are hashed
+    first so duplicates skip encryption and disk writes entirely; other
+    streams are hashed while encrypting and the duplicate ciphertext is
+    discarded. New blobs are encrypted with the keyring's active key.
+    Returns a dict with size, checksum, content_id, local_path and, for
+    duplicates, the existing row and a hold on its blob.
+    """
+    if hasattr(stream, 'seekable') and stream.seekable():
+        start = stream.tell()
+        hashed = HashingReader(stream).drain()
+        metrics.observe_stage('hash', hashed.seconds)
+        existing, held = find_stored_content(hashed.content_hash.hexdigest())
+        if existing:
+            return stored_result(hashed, existing, held={existing['local_path']: held})
+        stream.seek(start)
+
+    # Unique partial name so concurrent uploads never collide
+    key_id, key = keys.active()
+    fd, partial_path = blob_store.new_partial()
+    reader = HashingReader(stream)
+    try:
+        # Reads, writes and the encryption in between are timed separately
+        started = time.perf_counter()
+        with os.fdopen(fd, 'wb') as f:
+            writer = TimedWriter(f)
+            _, codec = container.encrypt_stream(reader, writer, key, compression=COMPRESSION,
+                                                cipher=CIPHER, key_id=key_id)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage('read', reader.seconds)
+        metrics.observe_stage('encrypt', max(elapsed - reader.seconds - writer.seconds, 0.0))
+        existing, held = find_stored_content(reader.content_hash.hexdigest())
+        if existing:
+            metrics.observe_stage('local_write', writer.seconds)
+            return stored_result(reader, existing, held={existing['local_path']: held})
+        started = time.perf_counter()
+        local_path = blob_store.commit(partial_path, reader.content_hash.hexdigest() + '.enc')
+        metrics.observe_stage('local_write', writer.seconds + time.perf_counter() - started)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    result = stored_result(reader, None, local_path, key_id)
+    result['new_blobs'] = [local_path]
+    result['compression'] = container.CODEC_NAMES[codec]
+    result['cipher'] = CIPHER
+    return result
+
+def store_file(stream, keys, size_hint=None):
+    """Store an upload as one blob or, from DELTA_MIN_SIZE bytes, as chunks"""
+    if DELTA_MIN_SIZE and size_hint is not None and size_hint >= DELTA_MIN_SIZE:
+        return store_chunked(stream, keys)
+    return store_content(stream, keys)
+
+def store_chunked(stream, keys):
+    """Split a stream into content-defined chunks and encrypt only the chunks not stored yet.
+
+    Each chunk is its own content-addressed blob, named by a keyed hash
+    of its plaintext, so re-uploading a modified file only encrypts,
+    writes and replicates the chunks around the changes. Returns the
+    store_content() fields plus the chunk manifest, the chunk blobs
+    written by this call and how many chunks and bytes were new. Stored
+    chunks are only reused while they are on local disk, where they can
+    be held until the upload is indexed.
+    """
+    key_id, key = keys.active()
+    reader = HashingReader(stream)
+    manifest = []
+    written = {}
+    held = {}
+    new_blobs = []
+    new_chunks = new_bytes = 0
+    hash_seconds = encrypt_seconds = write_seconds = 0.0
+    offset = 0
+    chunks = chunking.iter_chunks(reader, DEDUPE_KEY, DELTA_CHUNK_SIZE)
+    while True:
+        # Finding the boundary and hashing the chunk; reads are timed by the reader
+        started = time.perf_counter()
+        data = next(chunks, None)
+        if data is None:
+            break
+        content_id = hmac.new(DEDUPE_KEY, data, hashlib.sha256).hexdigest()
+        hash_seconds += time.perf_counter() - started
+        local_path, chunk_key_id = written.get(content_id, (None, None))
+        if local_path is None:
+            existing = metadata_index.get_chunk(content_id)
+            hold = blob_store.hold(existing['local_path']) if existing and existing['local_path'] else None
+            if hold:
+                local_path, chunk_key_id = existing['local_path'], existing['key_id']
+                held[content_id] = hold
+            else:
+                fd, partial_path = blob_store.new_partial()
+                try:
+                    started = time.perf_counter()
+                    with os.fdopen(fd, 'wb') as f:
+                        writer = TimedWriter(f)
+                        container.encrypt_stream(io.BytesIO(data), writer, key, compression=COMPRESSION,
+                                                 cipher=CIPHER, key_id=key_id)
+                    encrypt_seconds += time.perf_counter() - started - writer.seconds
+                    started = time.perf_counter()
+                    local_path = blob_store.commit(partial_path, content_id + '.chunk.enc')
+                    write_seconds += writer.seconds + time.perf_counter() - started
+                finally:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+                chunk_key_id = key_id
+                new_blobs.append(local_path)
+                new_chunks += 1
+                new_bytes += len(data)
+            written[content_id] = local_path, chunk_key_id
+        manifest.append((content_id, offset, len(data), local_path, chunk_key_id))
+        offset += len(data)
+
+    metrics.observe_stage('read', reader.seconds)
+    metrics.observe_stage('hash', max(hash_seconds - reader.seconds, 0.0))
+    metrics.observe_stage('encrypt', encrypt_seconds)
+    metrics.observe_stage('local_write', write_seconds)
+    result = stored_result(reader, None, held=held)
+    result.update(manifest=manifest, new_blobs=new_blobs, new_chunks=new_chunks, new_bytes=new_bytes)
+    return result
+
+def find_stored_content(content_id):
+    """Return (row, hold) for a local blob with this content ID, or (None, None)"""
+    existing = metadata_index.find_by_content(content_id)
+    if existing:
+        held = blob_store.hold(existing['local_path'])
+        if held:
+            return existing, held
+    return None, None
+
+def stored_result(reader, existing, local_path=None, key_id=None, held=None):
+    return {
+        'size': reader.size,
+        'checksum': reader.hash.hexdigest(),
+        'content_id': reader.content_hash.hexdigest(),
+        'local_path': existing['local_path'] if existing else local_path,
+        'key_id': existing['key_id'] if existing else key_id,
+        'existing': existing,
+        'held': held or {}
+    }
+
+# Deduplicated uploads hard-link the blobs they reuse until they are
+# indexed. If another upload releases such a blob first (its last file was
+# replaced or deleted), the index refuses the reference and the held copy
+# is stored again under a new name, which the release cannot reach
+def restore_released(stored, released):
+    """Store the held copies of reused blobs that were released before the upload was indexed"""
+    for reused in released:
+        hold = stored['held'].pop(reused)
+        if 'manifest' in stored:
+            local_path = blob_store.commit(hold, storage.new_object_id(reused + '.chunk.enc'))
+            stored['manifest'] = [(content_id, offset, size, local_path if content_id == reused else path, key_id)
+                                  for content_id, offset, size, path, key_id in stored['manifest']]
+        else:
+            local_path = blob_store.commit(hold, storage.new_object_id(stored['content_id'] + '.enc'))
+            stored.update(local_path=local_path, existing=None)
+        stored.setdefault('new_blobs', []).append(local_path)
+        log.info(f"♻️ Reused blob was released before indexing, stored again as {local_path}")
+
+def release_holds(stored):
+    for hold in stored['held'].values():
+        try:
+            os.remove(hold)
+        except FileNotFoundError:
+            pass
+    stored['held'] = {}
+
+def replication_plan(stored):
+    """Return (cloud_id, replication_state, needs_upload) for freshly stored content"""
+    existing = stored['existing']
+    if existing and existing['replication_state'] in (metadata_store.STATE_REPLICATED,
+                                                      metadata_store.STATE_PENDING):
+        return existing['cloud_id'], existing['replication_state'], False
+    return None, metadata_store.STATE_PENDING, True
+
+def release_blobs(paths):
+    """Delete blobs that no file references any more"""
+    for path in paths:
+        try:
+            os.remove(path)
+            log.info(f"🧹 Removed unreferenced blob: {path}")
+        except FileNotFoundError:
+            pass
+
+def discard_new_blobs(stored):
+    """Delete the blobs an upload wrote when indexing it failed, unless another file now uses them"""
+    release_blobs([path for path in stored.get('new_blobs', ())
+                   if not metadata_index.is_referenced(path)])
 
 # AES decryption
 def decrypt_file(encrypted_data, key):
+    if container.is_container(encrypted_data):
+        return container.decrypt_bytes(encrypted_data, key)
+    # Legacy single-shot EAX blob: nonce | tag | ciphertext
+    from Crypto.Cipher import AES
     nonce = encrypted_data[:16]
     tag = encrypted_data[16:32]
     ciphertext = encrypted_data[32:]
     cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
     return cipher.decrypt_and_verify(ciphertext, tag)
 
+# Metadata index
+def save_metadata(local_path, cloud_id):
+    """Record the Drive file ID for an encrypted blob"""
+    metadata_index.set_cloud_id(local_path, cloud_id)
+    log.debug(f"📝 Metadata saved: {local_path} (Cloud ID: {cloud_id})")
+
+# Resumable upload session state, kept next to the metadata sidecar
+def upload_state_path(filename):
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename + '.upload.json')
+
+def load_upload_state(filename, encrypted_path):
+    """Return the saved resumable session for this exact .enc file, if any"""
+    state_path = upload_state_path(filename)
+    if not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except Exception:
+        return None
+    stat = os.stat(encrypted_path)
+    # A re-upload replaces the .enc file; its old session is useless
+    if state.get('size') != stat.st_size or state.get('mtime') != stat.st_mtime:
+        return None
+    return state
+
+def save_upload_state(filename, encrypted_path, resumable_uri, offset):
+    stat = os.stat(encrypted_path)
+    state = {
+        'resumable_uri': resumable_uri,
+        'offset': offset,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    }
+    state_path = upload_state_path(filename)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def clear_upload_state(filename):
+    try:
+        os.remove(upload_state_path(filename))
+    except FileNotFoundError:
+        pass
+
+def query_upload_session(http, resumable_uri, total_size):
+    """Ask Drive how much of a resumable session it has committed.
+
+    Returns (offset, file_id); file_id is set if the upload already
+    finished, offset is None if the session has expired.
+    """
+    resp, content = http.request(resumable_uri, 'PUT', headers={
+        'Content-Range': f'bytes */{total_size}',
+        'Content-Length': '0'
+    })
+    if resp.status in (200, 201):
+        return total_size, json.loads(content).get('id')
+    if resp.status == 308:
+        committed = resp.get('range')
+        return (int(committed.rsplit('-', 1)[1]) + 1 if committed else 0), None
+    return None, None
+
 # Upload to cloud storage
-def upload_to_cloud(file_data, filename):
-    """Upload encrypted file to Google Drive"""
-    print(f"☁️ Starting cloud upload for: {filename}")
-    print(f"📊 File size: {len(file_data)} bytes")
+def upload_to_cloud(encrypted_path, filename):
+    """Upload encrypted file to Google Drive in resumable chunks streamed from disk"""
+    total_size = os.path.getsize(encrypted_path)
+    log.debug(f"☁️ Starting cloud upload for: {filename} ({total_size} bytes)")
     
     try:
-        print("🔐 Initializing Google Drive service...")
-        service = get_google_drive_service()
+        from googleapiclient.http import MediaFileUpload
+        with metrics.stage('drive_init'):
+            service = get_google_drive_service()
         if not service:
-            print("❌ Google Drive service initialization failed")
+            log.warning("❌ Google Drive service initialization failed")
             return None, "Google Drive not configured"
         
-        print("✅ Google Drive service initialized successfully")
-        
         # Create file metadata
         file_metadata = {
             'name': filename + '.enc',
             'parents': []  # Upload to root folder
         }
-        print(f"📝 File metadata created: {file_metadata['name']}")
-        
-        # Create media upload
-        print("📤 Creating media upload object...")
-        media = MediaIoBaseUpload(
-            io.BytesIO(file_data),
+        media = MediaFileUpload(
+            encrypted_path,
             mimetype='application/octet-stream',
+            chunksize=UPLOAD_CHUNK_SIZE,
             resumable=True
         )
-        
-        # Upload file
-        print("🚀 Starting file upload to Google Drive...")
+        request = service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id'
+        )
+
+        # Continue an interrupted session from the last committed byte
+        state = load_upload_state(filename, encrypted_path)
+        if state:
+            offset, cloud_id = query_upload_session(request.http, state['resumable_uri'], total_size)
+            if cloud_id:
+                clear_upload_state(filename)
+                log.info(f"✅ Cloud upload already completed earlier! File ID: {cloud_id}")
+                return cloud_id, None
+            if offset is not None:
+                request.resumable_uri = state['resumable_uri']
+                request.resumable_progress = offset
+                log.info(f"🔁 Resuming cloud upload at byte {offset}")
+            else:
+                clear_upload_state(filename)
+
         try:
-            file = service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id'
-            ).execute()
-            
-            cloud_id = file.get('id')
-            print(f"✅ Cloud upload successful! File ID: {cloud_id}")
-            print(f"🔗 Google Drive URL: https://drive.google.com/file/d/{cloud_id}/view")
-            return cloud_id, None
+            started = time.perf_counter()
+            sent_from = request.resumable_progress or 0
+            with metrics.TRANSFERS_IN_FLIGHT.track(operation='cloud_upload'):
+                response = None
+                while response is None:
+                    status, response = request.next_chunk(num_retries=3)
+                    if status:
+                        save_upload_state(filename, encrypted_path,
+                                          request.resumable_uri, request.resumable_progress)
+            elapsed = time.perf_counter() - started
+            metrics.observe_stage('drive_upload', elapsed)
+            metrics.record_transfer('cloud_upload', total_size - sent_from, elapsed)
         except Exception as e:
-            print(f"❌ Cloud upload failed: {str(e)}")
+            log.warning(f"❌ Cloud upload failed: {str(e)}")
             return None, str(e)
+
+        clear_upload_state(filename)
+        cloud_id = response.get('id')
+        log.info(f"✅ Cloud upload successful! File ID: {cloud_id}")
+        return cloud_id, None
     except Exception as e:
-        print(f"❌ Error initializing Google Drive service: {str(e)}")
+        log.warning(f"❌ Error initializing Google Drive service: {str(e)}")
         return None, str(e)
 
 # Download from cloud storage
-def download_from_cloud(file_id):
-    """Download encrypted file from Google Drive"""
+cloud_downloader = cloud_fetch.RangedDownloader(
+    http_fn=drive_client.get_http,
+    part_size=DOWNLOAD_PART_SIZE,
+    workers=DOWNLOAD_WORKERS
+)
+
+def download_from_cloud(file_id, dest_path):
+    """Download an encrypted file from Google Drive to dest_path, returning (size, error)"""
     try:
         service = get_google_drive_service()
         if not service:
             return None, "Google Drive not configured"
         
-        # Download file
-        request = service.files().get_media(fileId=file_id)
-        file_data = request.execute()
-        
-        return file_data, None
+        # Parts are fetched in parallel straight into a preallocated file
+        size = int(service.files().get(fileId=file_id, fields='size').execute()['size'])
+        media_uri = service.files().get_media(fileId=file_id).uri
+        started = time.perf_counter()
+        with metrics.TRANSFERS_IN_FLIGHT.track(operation='cloud_download'):
+            size, error = cloud_downloader.download(media_uri, size, dest_path)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage('drive_download', elapsed)
+        if not error:
+            metrics.record_transfer('cloud_download', size, elapsed)
+        return size, error
+    except Exception as e:
+        return None, str(e)
+
+def read_cloud_range(file_id, start=0, end=None):
+    """Stream bytes start..end (inclusive) of a Drive file as Range requests; returns (chunks, error)"""
+    try:
+        service = get_google_drive_service()
+        if not service:
+            return None, "Google Drive not configured"
+        size = int(service.files().get(fileId=file_id, fields='size').execute()['size'])
+        media_uri = service.files().get_media(fileId=file_id).uri
     except Exception as e:
         return None, str(e)
+    if end is None or end >= size:
+        end = size - 1
+    return cloud_downloader.iter_range(media_uri, start, end, size), None
 
 # List files from cloud
-def list_cloud_files():
-    """List all encrypted files from Google Drive"""
+def list_cloud_files(prefix=None):
+    """List all encrypted files from Google Drive, following every result page"""
     try:
         service = get_google_drive_service()
         if not service:
             return [], "Google Drive not configured"
         
-        # List files
-        results = service.files().list(
-            pageSize=50,
-            fields="nextPageToken, files(id, name, createdTime)"
-        ).execute()
-        
-        files = results.get('files', [])
-        return files, None
+        # Only our own uploads, filtered server-side
+        query = "trashed = false and mimeType = 'application/octet-stream'"
+        if prefix:
+            escaped = prefix.replace('\\', '\\\\').replace("'", "\\'")
+            query += f" and name contains '{escaped}'"
+
+        files = []
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=query,
+                pageSize=1000,
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name, createdTime, size, md5Checksum)"
+            ).execute()
+            files.extend(f for f in results.get('files', []) if f['name'].endswith('.enc'))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files, None
     except Exception as e:
         return [], str(e)
 
+# Delete from cloud storage
+def delete_from_cloud(file_id):
+    """Delete a file from Google Drive, returning an error string or None"""
+    try:
+        service = get_google_drive_service()
+        if not service:
+            return "Google Drive not configured"
+        service.files().delete(fileId=file_id).execute()
+        return None
+    except Exception as e:
+        return str(e)
+
+# Concurrent Drive calls, shared by requests and background workers
+drive_calls = admission.ConcurrencyLimit(DRIVE_MAX_CONCURRENCY, DRIVE_MAX_QUEUE)
+
+# Replica storage tier
+def create_cloud_storage():
+    """Build the replica tier backend selected by SECURECLOUD_STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'drive':
+        return storage.DriveBackend(
+            upload_fn=lambda path, name: upload_to_cloud(path, name[:-len('.enc')]),
+            fetch_fn=download_from_cloud,
+            range_fn=read_cloud_range,
+            list_fn=list_cloud_files,
+            delete_fn=delete_from_cloud,
+            limiter=drive_calls
+        )
+    if STORAGE_BACKEND == 's3':
+        return storage.S3Backend(S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT, region=S3_REGION,
+                                 part_size=DOWNLOAD_PART_SIZE, workers=DOWNLOAD_WORKERS)
+    if STORAGE_BACKEND == 'local':
+        return storage.LocalBackend(STORAGE_LOCAL_VOLUMES)
+    raise ValueError(f"Unknown storage backend {STORAGE_BACKEND!r}, expected 'drive', 's3' or 'local'")
+
+cloud_storage = create_cloud_storage()
+
+# Local cache of blobs fetched from the replica tier
+cloud_blobs = blob_cache.BlobCache(
+    UPLOAD_FOLDER,
+    fetch_fn=lambda cloud_id, dest_path: cloud_storage.fetch(cloud_id, dest_path),
+    max_bytes=BLOB_CACHE_MAX_BYTES
+)
+
+# Cached replica listing; Drive keeps it current from the changes feed,
+# other backends are re-listed on every refresh
+cloud_listing = cloud_cache.CloudListingCache(
+    UPLOAD_FOLDER,
+    list_fn=lambda: cloud_storage.list(),
+    service_fn=(lambda: get_google_drive_service()) if STORAGE_BACKEND == 'drive' else None,
+    max_staleness=CLOUD_LISTING_MAX_STALENESS,
+    refresh_interval=CLOUD_LISTING_REFRESH_INTERVAL
+)
+
+def replication_completed(job, cloud_id):
+    save_metadata(job['local_path'], cloud_id)
+    cloud_listing.record_upload(cloud_id, job['filename'] + '.enc')
+
+# Background replication of encrypted files to the replica tier
+replication_queue = replication.ReplicationQueue(
+    UPLOAD_FOLDER,
+    upload_fn=lambda local_path, filename: cloud_storage.put_file(filename + '.enc', local_path),
+    on_complete=replication_completed,
+    on_failure=lambda job: metadata_index.set_replication_state(job['local_path'], metadata_store.STATE_FAILED)
+)
+
+# Re-encryption of stored blobs after a key rotation
+def reencrypt_blob(blob, key_id):
+    """Re-encrypt one stored blob under key_id, locally and on Drive; returns (migrated, error).
+
+    The new ciphertext is uploaded to Drive before the local blob is
+    replaced, so a failure leaves the old copies in place, still
+    readable with the old key. Blobs stored only in the cloud are
+    fetched through the blob cache and replaced on Drive.
+    """
+    local_path = blob['local_path']
+    cloud_id = blob['cloud_id']
+    f, blob_size = blob_store.open_path(local_path)
+    is_local = f is not None
+    if not is_local:
+        if not cloud_id:
+            return False, "Blob not found locally or in cloud"
+        f, blob_size, error = cloud_blobs.open(cloud_id)
+        if f is None:
+            return False, error
+
+    # Same volume as the blob, so it can be replaced atomically
+    fd, partial_path = blob_store.new_partial(near=local_path if is_local else None)
+    os.close(fd)
+    try:
+        with f:
+            if container.blob_key_id(f) == key_id:
+                metadata_index.set_key_id(local_path, key_id, cloud_id)
+                return False, None
+            size, reader = open_plaintext_stream(f, blob_size, keyring)
+            plaintext = HashingReader(ChunkStream(reader(0, size - 1)))
+            with open(partial_path, 'wb') as out:
+                container.encrypt_stream(plaintext, out, keyring.get(key_id), compression=COMPRESSION,
+                                         cipher=CIPHER, key_id=key_id)
+        if blob['content_id'] and plaintext.content_hash.hexdigest() != blob['content_id']:
+            return False, "Decrypted content does not match its content ID"
+        if is_local:
+            referenced = metadata_index.is_referenced(local_path)
+        else:
+            referenced = metadata_index.is_cloud_referenced(cloud_id)
+        if not referenced:
+            return False, None  # Deleted while we worked on it
+
+        if cloud_id and (blob['replication_state'] == metadata_store.STATE_REPLICATED or not is_local):
+            new_cloud_id, error = cloud_storage.put_file(blob['name'] + '.enc', partial_path)
+            if error:
+                return False, error
+            metadata_index.replace_cloud_id(cloud_id, new_cloud_id)
+            cloud_listing.record_upload(new_cloud_id, blob['name'] + '.enc')
+            cloud_blobs.discard(cloud_id)
+            error = cloud_storage.delete(cloud_id)
+            if error:
+                log.warning(f"⚠️ Re-encrypted {blob['blob_id']} but could not delete old replica {cloud_id}: {error}")
+            cloud_id = new_cloud_id
+
+        # Replace the local copy (if there is one); open readers keep the old file
+        if is_local and os.path.exists(local_path):
+            os.replace(partial_path, local_path)
+        metadata_index.set_key_id(local_path, key_id, cloud_id)
+        log.info(f"🔑 Re-encrypted {blob['blob_id']} with key {key_id}")
+        return True, None
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+reencryption = rekey.ReencryptionJob(
+    UPLOAD_FOLDER,
+    list_fn=lambda after, limit: metadata_index.list_blobs(after, limit, cloud_only=True),
+    migrate_fn=reencrypt_blob,
+    workers=REKEY_WORKERS,
+    batch_size=REKEY_BATCH_SIZE,
+    max_bytes_per_second=REKEY_MAX_BYTES_PER_SECOND
+)
+
+def key_still_needed(key_id):
+    """Why key_id cannot be retired yet, or None.
+
+    Blobs whose key is not in the index yet (written before it was
+    recorded) are read from their local header once; blobs only in the
+    cloud get their key recorded when a re-encryption pass visits them.
+    """
+    state = reencryption.status()
+    if state['status'] in (rekey.STATUS_RUNNING, rekey.STATUS_PAUSED):
+        return f"Re-encryption to key {state['key_id']} has not finished ({state['status']})"
+    unknown = 0
+    for local_path in metadata_index.blobs_without_key_id():
+        f, _ = blob_store.open_path(local_path) if local_path else (None, None)
+        if f is None:
+            unknown += 1
+            continue
+        with f:
+            metadata_index.set_key_id(local_path, container.blob_key_id(f))
+    in_use = metadata_index.count_blobs_with_key(key_id)
+    if in_use:
+        return f"{in_use} stored blobs are still encrypted with key {key_id}; run POST /rekey until it completes"
+    if unknown:
+        return f"{unknown} blobs stored only in the cloud have no recorded key; run POST /rekey until it completes"
+    return None
+
+# Application startup
+_startup_lock = threading.Lock()
+_started = False
+
+def startup(start_background=True):
+    """Create storage folders, import legacy metadata and start background workers (idempotent).
+
+    Runs in each server process after it is forked, never at import time,
+    so worker processes do not inherit threads, sockets or open databases.
+    """
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        started = time.perf_counter()
+        configure_logging()
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        blob_store.ensure_volumes()
+        if isinstance(cloud_storage, storage.LocalBackend):
+            cloud_storage.ensure_volumes()
+        metadata_index.import_sidecars()
+        cloud_blobs.load()
+        if start_background:
+            replication_queue.start()
+            cloud_listing.start()
+            reencryption.resume()
+        metrics.STARTUP_SECONDS.set(time.perf_counter() - started, phase='startup')
+        if PREWARM:
+            prewarm()
+        _started = True
+
+def prewarm():
+    """Load everything the first upload or cloud fetch would otherwise wait for"""
+    started = time.perf_counter()
+    # Cipher code is imported on first use; sealing an empty buffer loads it
+    container.encrypt_bytes(b'', KEY, cipher=CIPHER)
+    if STORAGE_BACKEND == 'drive':
+        ready = drive_client.prewarm()
+    elif STORAGE_BACKEND == 's3':
+        ready = cloud_storage.client() is not None
+    else:
+        ready = True
+    elapsed = time.perf_counter() - started
+    metrics.STARTUP_SECONDS.set(elapsed, phase='prewarm')
+    log.info(f"🔥 Prewarmed in {elapsed * 1000:.0f} ms (storage {'ready' if ready else 'not configured'})")
+
+def configure_logging():
+    if not logging.root.handlers:
+        logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    log.setLevel(LOG_LEVEL)
+
+def create_app():
+    """WSGI entry point for gunicorn and other servers: gunicorn 'File_transfer:create_app()'"""
+    startup()
+    return app
+
+# Requests are timed until their body has been sent, not until the view returns
+app.wsgi_app = metrics.WSGIMetrics(app.wsgi_app)
+# Behind TRUSTED_PROXIES proxies the client address (for per-client
+# limits) comes from X-Forwarded-For
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Servers that import `app` directly still get a started process
+@app.before_request
+def ensure_started():
+    startup()
+    metrics.WSGIMetrics.mark(request.environ, request.endpoint)
+
+# Admission control for uploads, downloads and listings
+admission_control = admission.AdmissionController(
+    route_max_bytes={'upload_file': UPLOAD_MAX_BYTES, 'upload_batch': UPLOAD_MAX_BYTES},
+    default_max_bytes=MAX_REQUEST_BYTES,
+    budget=admission.ByteBudget(INFLIGHT_UPLOAD_BYTES),
+    clients=admission.ClientLimits(CLIENT_REQUESTS_PER_SECOND, CLIENT_REQUEST_BURST,
+                                   CLIENT_BYTES_PER_SECOND, CLIENT_BYTE_BURST),
+    limited_routes=('upload_file', 'upload_batch', 'download_file', 'list_files'),
+    upload_routes=('upload_file', 'upload_batch'),
+    unknown_length_reserve=UNKNOWN_LENGTH_RESERVE_BYTES
+)
+ADMISSION_ENVIRON_KEY = 'securecloud.admission'
+
+class MeteredInput:
+    """A WSGI input stream that reports the bytes read from it to an admission Reservation"""
+    def __init__(self, stream, reservation):
+        self._stream = stream
+        self._reservation = reservation
+
+    def _count(self, data):
+        self._reservation.received(len(data))
+        return data
+
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self._count(line) for line in self._stream.readlines(*args)]
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+def record_rejection(endpoint, e):
+    """Count a request turned away by admission control; returns the JSON error body"""
+    metrics.ADMISSION_REJECTIONS.inc(endpoint=endpoint or 'unknown', reason=e.reason)
+    log.debug(f"🚦 Rejected {endpoint} request ({e.reason}): {e.message}")
+    return {'error': e.message, 'reason': e.reason}
+
+@app.before_request
+def admit_request():
+    try:
+        reservation = admission_control.admit(request.endpoint, request.remote_addr, request.content_length)
+    except admission.Rejected as e:
+        return jsonify(record_rejection(request.endpoint, e)), e.status, e.headers()
+    request.environ[ADMISSION_ENVIRON_KEY] = reservation
+    # Bodies of unknown length are counted against the byte budget as they are read
+    if reservation is not None and reservation.metered:
+        request.environ['wsgi.input'] = MeteredInput(request.environ['wsgi.input'], reservation)
+
+@app.after_request
+def charge_download(response):
+    # Downloads are charged to the client's bandwidth once their size is known
+    if request.endpoint == 'download_file' and response.status_code in (200, 206) and response.content_length:
+        admission_control.clients.charge(request.remote_addr, response.content_length)
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    admission_control.release(request.environ.pop(ADMISSION_ENVIRON_KEY, None))
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'Request body too large', 'reason': 'too_large'}), 413
+
 @app.route('/')
 def index():
     return render_template('fullinterface.html')
@@ -180,165 +960,642 @@ def index():
 # Upload endpoint
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    print("\n" + "="*60)
-    print("📁 NEW FILE UPLOAD REQUEST")
-    print("="*60)
-    
-    if 'file' not in request.files:
-        print("❌ No file part in request")
-        return jsonify({'error': 'No file part'}), 400
-    file = request.files['file']
-    if file.filename == '':
-        print("❌ No selected file")
-        return jsonify({'error': 'No selected file'}), 400
-
-    filename = secure_filename(file.filename)
-    print(f"📄 Original filename: {file.filename}")
-    print(f"🔒 Secure filename: {filename}")
-    
-    file_data = file.read()
-    print(f"📊 Original file size: {len(file_data)} bytes")
-    
-    print("🔐 Encrypting file with AES-128...")
-    encrypted_data = encrypt_file(file_data, KEY)
-    print(f"🔒 Encrypted file size: {len(encrypted_data)} bytes")
-
-    # Save locally
-    encrypted_path = os.path.join(app.config['UPLOAD_FOLDER'], filename + '.enc')
-    print(f"💾 Saving encrypted file locally: {encrypted_path}")
-    with open(encrypted_path, 'wb') as f:
-        f.write(encrypted_data)
-    print("✅ Local storage completed")
-
-    # Upload to cloud
-    print("\n☁️ Starting cloud upload process...")
-    cloud_file_id, cloud_error = upload_to_cloud(encrypted_data, filename)
-    
-    if cloud_file_id:
-        # Save metadata
-        metadata = {
-            'filename': filename,
-            'cloud_id': cloud_file_id,
-            'local_path': encrypted_path
-        }
-        metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], filename + '.meta.json')
-        print(f"📝 Saving metadata: {metadata_path}")
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f)
-        
-        print("✅ METADATA SAVED SUCCESSFULLY")
-        print(f"📋 Cloud ID: {cloud_file_id}")
-        print(f"📁 Encrypted filename: {filename}.enc")
-        print("🎉 UPLOAD COMPLETED SUCCESSFULLY (Local + Cloud)")
-        print("="*60 + "\n")
-        
-        return jsonify({
-            'message': 'File uploaded and encrypted successfully (Local + Cloud)',
-            'filename': filename + '.enc',
-            'cloud_id': cloud_file_id
-        }), 200
+    started = time.perf_counter()
+    log.debug("📁 New file upload request")
+
+    # Multipart form uploads are spooled to disk by Werkzeug; raw bodies
+    # (e.g. PUT-style clients) are read directly from request.stream.
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            log.debug("❌ No file part in request")
+            return jsonify({'error': 'No file part'}), 400
+        file = request.files['file']
+        if file.filename == '':
+            log.debug("❌ No selected file")
+            return jsonify({'error': 'No selected file'}), 400
+        original_filename = file.filename
+        source_stream = file.stream
     else:
-        print("⚠️ CLOUD UPLOAD FAILED - Local storage only")
-        print(f"❌ Cloud error: {cloud_error}")
-        print("="*60 + "\n")
-        
-        return jsonify({
-            'message': 'File uploaded locally only (Cloud upload failed)',
-            'filename': filename + '.enc',
-            'cloud_error': cloud_error
-        }), 200
+        original_filename = request.args.get('filename', '')
+        if original_filename == '':
+            log.debug("❌ No filename for raw upload")
+            return jsonify({'error': 'No selected file'}), 400
+        source_stream = request.stream
+
+    filename = secure_filename(original_filename)
+    log.debug(f"📄 Original filename: {original_filename} (secure filename: {filename})")
+    if filename == '':
+        return jsonify({'error': 'Invalid filename'}), 400
+
+    # Encrypt segment by segment straight to disk, unless the content is already stored
+    stored = store_file(source_stream, keyring, request.content_length)
+    result = complete_upload(filename, stored)
+    metrics.record_transfer('upload', stored['size'], time.perf_counter() - started)
+    return jsonify(result), 200
+
+# Index an upload and queue it for cloud replication
+def complete_upload(filename, stored):
+    """Index freshly stored content, queue its replication and build the upload response"""
+    if 'manifest' in stored:
+        return complete_chunked_upload(filename, stored)
+    try:
+        while True:
+            cloud_id, replication_state, needs_upload = replication_plan(stored)
+            try:
+                with metrics.stage('metadata_write'):
+                    orphaned = metadata_index.record_upload(
+                        filename, stored['size'], stored['local_path'], stored['checksum'],
+                        stored['content_id'], cloud_id, replication_state, stored['key_id'],
+                        reused=list(stored['held']))
+                break
+            except metadata_store.BlobReleased as e:
+                restore_released(stored, e.released)
+    except Exception:
+        discard_new_blobs(stored)
+        raise
+    finally:
+        release_holds(stored)
+    release_blobs(orphaned)
+    if stored['existing']:
+        log.debug(f"♻️ Identical content already stored as {stored['existing']['name']}, skipped encryption")
+    log.info(f"✅ Stored {filename} ({stored['size']} bytes)")
+
+    result = {
+        'message': 'File uploaded and encrypted successfully (cloud replication pending)',
+        'filename': filename + '.enc',
+        'deduplicated': stored['existing'] is not None,
+        'replication': replication_state
+    }
+    if cloud_id:
+        result['cloud_id'] = cloud_id
+    if 'compression' in stored:
+        result['compression'] = stored['compression']
+        result['cipher'] = stored['cipher']
+    if replication_state == metadata_store.STATE_REPLICATED:
+        result['message'] = 'File uploaded successfully (identical content already stored Local + Cloud)'
+
+    # Hand the cloud upload to the background replication workers
+    if needs_upload:
+        result['replication_job'] = replication_queue.enqueue(filename, stored['local_path'])
+        log.debug(f"☁️ Cloud replication queued (job {result['replication_job']})")
+    return result
+
+def complete_chunked_upload(filename, stored):
+    """Index a file stored as chunks and queue replication of its new chunks"""
+    try:
+        while True:
+            try:
+                with metrics.stage('metadata_write'):
+                    orphaned, to_replicate = metadata_index.record_chunked_upload(
+                        filename, stored['size'], stored['checksum'], stored['content_id'], stored['manifest'],
+                        reused=list(stored['held']))
+                break
+            except metadata_store.BlobReleased as e:
+                restore_released(stored, e.released)
+    except Exception:
+        discard_new_blobs(stored)
+        raise
+    finally:
+        release_holds(stored)
+    release_blobs(orphaned)
+    # Chunks are replicated under their own names, shared by every file that contains them
+    for content_id, local_path in to_replicate:
+        replication_queue.enqueue(metadata_store.CHUNK_NAME_PREFIX + content_id, local_path)
+    log.info(f"✅ Stored {filename} ({stored['size']} bytes, {stored['new_chunks']} of "
+             f"{len(stored['manifest'])} chunks new)")
+
+    return {
+        'message': 'File uploaded and encrypted successfully (cloud replication pending)'
+                   if to_replicate else 'File uploaded successfully (all chunks already stored)',
+        'filename': filename + '.enc',
+        'deduplicated': stored['new_chunks'] == 0,
+        'replication': metadata_store.STATE_PENDING if to_replicate else metadata_store.STATE_REPLICATED,
+        'chunks': len(stored['manifest']),
+        'new_chunks': stored['new_chunks'],
+        'new_bytes': stored['new_bytes'],
+        'queued_chunks': len(to_replicate)
+    }
+
+# Batch upload helpers
+def archive_kind(file):
+    """Return 'tar', 'zip' or None for an uploaded file part"""
+    if file.mimetype in ARCHIVE_MIMETYPES:
+        return ARCHIVE_MIMETYPES[file.mimetype]
+    name = (file.filename or '').lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar', '.tar.gz', '.tgz')):
+        return 'tar'
+    return None
+
+def iter_archive_members(stream, kind):
+    """Yield (member name, opener, inline) for every regular file in an archive.
+
+    Tar archives are read as a forward-only stream, so a member must be
+    consumed before the next one is yielded: small members are buffered
+    into memory, large ones are flagged inline and must be encrypted
+    before iteration continues. Zip archives need a seekable stream
+    (Werkzeug spools multipart parts to disk) and their members can be
+    opened independently.
+    """
+    if kind == 'zip':
+        archive = zipfile.ZipFile(stream)
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, (lambda info=info: archive.open(info)), False
+        return
+
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            member_stream = archive.extractfile(member)
+            if member.size <= BATCH_INLINE_LIMIT:
+                data = member_stream.read()
+                yield member.name, (lambda data=data: io.BytesIO(data)), False
+            else:
+                yield member.name, (lambda member_stream=member_stream: member_stream), True
+
+def encrypt_batch_item(filename, open_stream):
+    """Encrypt (or deduplicate) one batch member, returning (name, stored)"""
+    stream = open_stream()
+    try:
+        return filename, store_content(stream, keyring)
+    finally:
+        stream.close()
+
+# Batch upload endpoint
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Upload many files at once.
+
+    Accepts multipart 'files' parts (tar/zip parts are unpacked) or a raw
+    tar/zip request body. Files are encrypted concurrently on
+    batch_executor, recorded in the index in a single transaction and
+    queued for replication; the response has one result per file.
+    """
+    sources = []
+    if request.mimetype == 'multipart/form-data':
+        for file in request.files.getlist('files') + request.files.getlist('file'):
+            if file.filename == '':
+                continue
+            kind = archive_kind(file)
+            if kind:
+                sources.append(iter_archive_members(file.stream, kind))
+            else:
+                sources.append([(file.filename, lambda file=file: file.stream, False)])
+    elif request.mimetype in ARCHIVE_MIMETYPES:
+        kind = ARCHIVE_MIMETYPES[request.mimetype]
+        stream = request.stream
+        if kind == 'zip':
+            # zipfile has to seek to the central directory at the end
+            stream = tempfile.TemporaryFile()
+            shutil.copyfileobj(request.stream, stream)
+            stream.seek(0)
+        sources.append(iter_archive_members(stream, kind))
+    else:
+        return jsonify({'error': 'Expected multipart files or a tar/zip body'}), 400
+
+    results = []
+    pending = []
+    seen = set()
+    try:
+        for source in sources:
+            for original_filename, open_stream, inline in source:
+                filename = secure_filename(original_filename)
+                result = {'original_filename': original_filename, 'filename': filename + '.enc'}
+                results.append(result)
+                if filename == '':
+                    result.update(status='error', error='Invalid filename')
+                    continue
+                if filename in seen:
+                    result.update(status='error', error='Duplicate name in batch')
+                    continue
+                seen.add(filename)
+                if inline:
+                    # Large tar members must be consumed before the archive advances
+                    try:
+                        pending.append((result, encrypt_batch_item(filename, open_stream)))
+                    except Exception as e:
+                        result.update(status='error', error=str(e))
+                else:
+                    pending.append((result, batch_executor.submit(encrypt_batch_item, filename, open_stream)))
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        results.append({'status': 'error', 'error': f'Invalid archive: {str(e)}'})
+
+    stored = []
+    for result, uploaded in pending:
+        try:
+            if not isinstance(uploaded, tuple):
+                uploaded = uploaded.result()
+        except Exception as e:
+            result.update(status='error', error=str(e))
+            continue
+        filename, content = uploaded
+        stored.append((result, filename, content))
+
+    if stored:
+        try:
+            while True:
+                plans = [replication_plan(content) for _, _, content in stored]
+                try:
+                    with metrics.stage('metadata_write'):
+                        orphaned = metadata_index.record_uploads([
+                            (filename, content['size'], content['local_path'], content['checksum'],
+                             content['content_id'], cloud_id, replication_state, content['key_id'])
+                            for (_, filename, content), (cloud_id, replication_state, _) in zip(stored, plans)
+                        ], reused=[path for _, _, content in stored for path in content['held']])
+                    break
+                except metadata_store.BlobReleased as e:
+                    for _, _, content in stored:
+                        restore_released(content, e.released & set(content['held']))
+        except Exception:
+            for _, _, content in stored:
+                discard_new_blobs(content)
+            raise
+        finally:
+            for _, _, content in stored:
+                release_holds(content)
+        release_blobs(orphaned)
+        # Identical files within one batch share a blob and a single upload
+        queued = {}
+        for (result, filename, content), (cloud_id, replication_state, needs_upload) in zip(stored, plans):
+            result.update(status='ok', size=content['size'], checksum=content['checksum'],
+                          deduplicated=content['existing'] is not None, replication=replication_state)
+            if needs_upload and content['local_path'] not in queued:
+                queued[content['local_path']] = replication_queue.enqueue(filename, content['local_path'])
+            if content['local_path'] in queued:
+                result['replication_job'] = queued[content['local_path']]
+
+    log.info(f"📦 Batch upload: {len(stored)} stored, {len(results) - len(stored)} failed")
+    return jsonify({
+        'stored': len(stored),
+        'failed': len(results) - len(stored),
+        'files': results
+    }), 200 if stored or not results else 400
+
+# Streaming decryption helpers
+def open_plaintext_stream(f, blob_size, keys):
+    """Return (plaintext_size, reader) for an open .enc blob.
+
+    reader(start, end) yields decrypted bytes for the inclusive range.
+    The key is looked up in the keyring by the ID in the blob header.
+    Chunked containers only decrypt (and decompress) the covering
+    segments; legacy single-shot blobs have a single tag and must be
+    decrypted whole.
+    """
+    reader = container.open_reader(f, blob_size)
+    if reader is not None:
+        key = keys.get(reader.header.key_id)
+        return reader.plaintext_size, lambda start, end: reader.iter_decrypt(key, start, end)
+
+    f.seek(0)
+    plaintext = decrypt_file(f.read(), keys.get(key_store.LEGACY_KEY_ID))
+    return len(plaintext), lambda start, end: iter([plaintext[start:end + 1]])
+
+def open_chunk(chunk):
+    """Open a chunk blob, locally or through the blob cache; returns (f, blob_size, error)"""
+    f, blob_size = blob_store.open_path(chunk['local_path'])
+    if f is not None:
+        return f, blob_size, None
+    if not chunk['cloud_id']:
+        return None, None, "Chunk not found locally or in cloud"
+    return cloud_blobs.open(chunk['cloud_id'])
+
+def open_chunked_stream(manifest, keys):
+    """Return (plaintext_size, reader) for a file stored as chunks.
+
+    Like open_plaintext_stream(): reader(start, end) yields decrypted
+    bytes for the inclusive range, opening and decrypting only the
+    chunks it covers, one at a time.
+    """
+    size = manifest[-1]['offset'] + manifest[-1]['size'] if manifest else 0
+    offsets = [chunk['offset'] for chunk in manifest]
+
+    def reader(start, end):
+        for index in range(max(bisect.bisect_right(offsets, start) - 1, 0), len(manifest)):
+            chunk = manifest[index]
+            if chunk['offset'] > end:
+                break
+            f, blob_size, error = open_chunk(chunk)
+            if f is None:
+                raise IOError(f"Chunk {index} unavailable: {error}")
+            with f:
+                _, chunk_reader = open_plaintext_stream(f, blob_size, keys)
+                yield from chunk_reader(max(start - chunk['offset'], 0),
+                                        min(end - chunk['offset'], chunk['size'] - 1))
+    return size, reader
+
+def timed_download(first_chunk, chunks, decrypt_seconds):
+    """Yield decrypted chunks, recording decrypt and send time once the stream ends"""
+    started = time.perf_counter() - decrypt_seconds
+    send_seconds = 0.0
+    sent = 0
+    chunk = first_chunk
+    try:
+        while chunk is not None:
+            yielded = time.perf_counter()
+            yield chunk
+            resumed = time.perf_counter()
+            send_seconds += resumed - yielded
+            sent += len(chunk)
+            chunk = next(chunks, None)
+            decrypt_seconds += time.perf_counter() - resumed
+    finally:
+        metrics.observe_stage('decrypt', decrypt_seconds)
+        metrics.observe_stage('send', send_seconds)
+        metrics.record_transfer('download', sent, time.perf_counter() - started)
+
+def stream_and_close(chunks, f):
+    """Yield from chunks, closing the underlying blob once the response is done"""
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        if f is not None:
+            f.close()
 
 # Download endpoint
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], filename.replace('.enc', '.meta.json'))
-    
-    # Try local file first
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            encrypted_data = f.read()
-    elif os.path.exists(metadata_path):
-        # Try cloud download
-        with open(metadata_path, 'r') as f:
-            metadata = json.load(f)
-        
-        cloud_data, cloud_error = download_from_cloud(metadata['cloud_id'])
-        if cloud_data:
-            encrypted_data = cloud_data
-        else:
-            return jsonify({'error': 'File not found locally or in cloud', 'cloud_error': cloud_error}), 404
-    else:
+    name = filename[:-len('.enc')] if filename.endswith('.enc') else filename
+    metadata = metadata_index.get(name)
+    if metadata is None:
         return jsonify({'error': 'File not found'}), 404
+    cached_id = None
+    f = None
 
+    if metadata['chunk_count'] is not None:
+        # Chunked files open each chunk blob as the range reaches it
+        size, reader = open_chunked_stream(metadata_index.get_manifest(name), keyring)
+    else:
+        # Try the local blob first
+        f, blob_size = blob_store.open_path(metadata['local_path'])
+        if f is None and metadata['cloud_id']:
+            # Cloud-only: served from the local blob cache, fetched on a miss
+            cached_id = metadata['cloud_id']
+            cached = cloud_blobs.open_cached(cached_id)
+            if cached:
+                f, blob_size = cached
+            else:
+                try:
+                    drive_calls.check()
+                except admission.Rejected as e:
+                    return jsonify(record_rejection(request.endpoint, e)), e.status, e.headers()
+                f, blob_size, cloud_error = cloud_blobs.open(cached_id)
+            if f is None:
+                return jsonify({'error': 'File not found locally or in cloud', 'cloud_error': cloud_error}), 404
+        elif f is None:
+            return jsonify({'error': 'File not found'}), 404
+
+        try:
+            size, reader = open_plaintext_stream(f, blob_size, keyring)
+        except Exception as e:
+            f.close()
+            if cached_id:
+                cloud_blobs.discard(cached_id)
+            return jsonify({'error': 'Decryption failed', 'details': str(e)}), 500
+
+    # Resolve an optional single byte range
+    status = 200
+    start, end = 0, size - 1
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            if f is not None:
+                f.close()
+            return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+        start, end = byte_range[0], byte_range[1] - 1
+        status = 206
+
+    # Decrypt the first segment eagerly so authentication errors still
+    # produce a proper error response rather than a truncated body.
+    chunks = reader(start, end)
+    decrypt_started = time.perf_counter()
     try:
-        decrypted_data = decrypt_file(encrypted_data, KEY)
+        first_chunk = next(chunks, b'')
     except Exception as e:
+        if f is not None:
+            f.close()
+        if cached_id:
+            cloud_blobs.discard(cached_id)
         return jsonify({'error': 'Decryption failed', 'details': str(e)}), 500
+    body = timed_download(first_chunk, chunks, time.perf_counter() - decrypt_started)
 
     decrypted_filename = filename.replace('.enc', '')
-    decrypted_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_' + decrypted_filename)
-    with open(decrypted_path, 'wb') as f:
-        f.write(decrypted_data)
+    response = Response(stream_and_close(body, f), status=status,
+                        mimetype='application/octet-stream', direct_passthrough=True)
+    response.headers['Content-Length'] = str(max(end - start + 1, 0))
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers.set('Content-Disposition', 'attachment', filename=decrypted_filename)
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+# Storage and deduplication statistics
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats():
+    return jsonify(dict(metadata_index.storage_stats(),
+                        backends={'blobs': blob_store.status(), 'replica': cloud_storage.status()}))
+
+# Replication queue status
+@app.route('/replication/status', methods=['GET'])
+def replication_status():
+    return jsonify(replication_queue.status())
+
+# Key rotation
+@app.route('/rekey', methods=['POST'])
+def start_reencryption():
+    """Start (or resume) re-encrypting every stored blob with the active key"""
+    status, error = reencryption.start(keyring.active_id())
+    if error:
+        return jsonify({'error': error, 'rekey': status, 'keys': keyring.status()}), 409
+    return jsonify({'rekey': status, 'keys': keyring.status()}), 202
+
+@app.route('/rekey/pause', methods=['POST'])
+def pause_reencryption():
+    return jsonify({'rekey': reencryption.pause(), 'keys': keyring.status()})
+
+@app.route('/rekey/status', methods=['GET'])
+def reencryption_status():
+    return jsonify({'rekey': reencryption.status(), 'keys': keyring.status()})
+
+# Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Cloud blob cache counters
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(cloud_blobs.status())
+
+# Drive client counters
+@app.route('/drive/stats', methods=['GET'])
+def drive_stats():
+    return jsonify(dict(drive_client.get_stats(), cloud_listing=cloud_listing.status(),
+                        downloads=cloud_downloader.get_stats(), calls=drive_calls.status()))
+
+# Admission control limits and counters
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(dict(admission_control.status(), drive_calls=drive_calls.status()))
 
-    return send_file(decrypted_path, as_attachment=True, download_name=decrypted_filename)
+# File listing helpers
+FILES_DEFAULT_LIMIT = 100
+FILES_MAX_LIMIT = 1000
+FILES_SORT_KEYS = ('name', 'created', 'size')
+
+def parse_drive_time(value):
+    """Convert a Drive RFC 3339 timestamp to epoch seconds"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def listed_cloud_files(cloud_files, prefix, substring):
+    """Drive files that belong in a /files listing, by name"""
+    by_name = {}
+    for file in cloud_files:
+        # Chunk blobs are listed through the files made of them
+        if file['name'].startswith(metadata_store.CHUNK_NAME_PREFIX) or not file['name'].startswith(prefix):
+            continue
+        if substring and substring not in file['name'].lower():
+            continue
+        by_name[file['name']] = file
+    return by_name
+
+def indexed_file_info(metadata, cloud_file):
+    """Listing entry for an indexed file, joined with its Drive file if it has one"""
+    file_info = {
+        'name': metadata['name'] + '.enc',
+        'source': 'local' if metadata['local_path'] or metadata['chunk_count'] is not None else 'cloud',
+        'size': metadata['size'],
+        'created_at': metadata['created_at']
+    }
+    if metadata['chunk_count'] is not None:
+        file_info['chunks'] = metadata['chunk_count']
+    if metadata['cloud_id']:
+        file_info['cloud_id'] = metadata['cloud_id']
+        if metadata['local_path']:
+            file_info['source'] = 'both'
+    if cloud_file is not None:
+        file_info['id'] = cloud_file['id']
+        file_info.setdefault('cloud_id', cloud_file['id'])
+        if file_info['source'] == 'local':
+            file_info['source'] = 'both'
+    return file_info
+
+def cloud_only_files(cloud_files, sort, descending, after, until, limit):
+    """Up to limit Drive files the index does not know, in listing order.
+
+    Only sort keys past after and up to until (either may be None) are
+    considered; index lookups are batched as the candidates are walked.
+    """
+    candidates = []
+    for file in cloud_files.values():
+        file_info = {
+            'name': file['name'],
+            'source': 'cloud',
+            'id': file['id'],
+            'cloud_id': file['id'],
+            'size': None,
+            'created_at': parse_drive_time(file.get('createdTime'))
+        }
+        key = file_sort_key(file_info, sort)
+        if descending:
+            key_in_range = (after is None or key < after) and (until is None or key >= until)
+        else:
+            key_in_range = (after is None or key > after) and (until is None or key <= until)
+        if key_in_range:
+            candidates.append(file_info)
+    candidates.sort(key=lambda f: file_sort_key(f, sort), reverse=descending)
+
+    files = []
+    for start in range(0, len(candidates), limit):
+        batch = candidates[start:start + limit]
+        indexed = metadata_index.existing_names(
+            f['name'][:-len('.enc')] for f in batch if f['name'].endswith('.enc'))
+        for file_info in batch:
+            if not (file_info['name'].endswith('.enc') and file_info['name'][:-len('.enc')] in indexed):
+                files.append(file_info)
+                if len(files) == limit:
+                    return files
+    return files
+
+def file_sort_key(file_info, sort):
+    """Total ordering used for sorting and keyset cursors"""
+    if sort == 'created':
+        return (file_info['created_at'] or 0, file_info['name'])
+    if sort == 'size':
+        return (file_info['size'] if file_info['size'] is not None else -1, file_info['name'])
+    return (file_info['name'], '')
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_cursor(cursor):
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+
+def query_files(args):
+    """Return (page, next_cursor, error) for a /files query string mapping"""
+    try:
+        limit = min(max(int(args.get('limit', FILES_DEFAULT_LIMIT)), 1), FILES_MAX_LIMIT)
+    except ValueError:
+        return None, None, 'Invalid limit'
+    prefix = args.get('prefix', '')
+    substring = args.get('q', '').lower()
+    sort = args.get('sort', 'name')
+    descending = args.get('order', 'asc') == 'desc'
+    if sort not in FILES_SORT_KEYS:
+        return None, None, f"Invalid sort, expected one of {', '.join(FILES_SORT_KEYS)}"
+    cursor = None
+    if args.get('cursor'):
+        try:
+            cursor = decode_cursor(args['cursor'])
+        except Exception:
+            return None, None, 'Invalid cursor'
+
+    cloud_files, cloud_error = cloud_listing.get_files(prefix or None)
+    if cloud_error:
+        log.warning(f"Error fetching cloud files: {cloud_error}")
+        # Serve indexed files only if cloud fetch fails
+    cloud_files = listed_cloud_files(cloud_files, prefix, substring)
+
+    # The index serves the page past the cursor; only its names are joined with Drive
+    indexed = [indexed_file_info(metadata, cloud_files.get(metadata['name'] + '.enc'))
+               for metadata in metadata_index.list_files(prefix, substring, sort, descending,
+                                                         cursor, limit + 1)]
+    # A full page bounds the key range Drive-only files can still take a place in
+    until = file_sort_key(indexed[-1], sort) if len(indexed) > limit else None
+    cloud_only = cloud_only_files(cloud_files, sort, descending, cursor, until, limit + 1)
+
+    files = list(heapq.merge(indexed, cloud_only, key=lambda f: file_sort_key(f, sort), reverse=descending))
+    page = files[:limit]
+    next_cursor = encode_cursor(file_sort_key(page[-1], sort)) if len(files) > limit else None
+    return page, next_cursor, None
 
 # List files endpoint
 @app.route('/files', methods=['GET'])
 def list_files():
-    files = []
-    cloud_file_names = set()
-    
-    # Get local files and check for metadata
-    local_files = os.listdir(app.config['UPLOAD_FOLDER'])
-    for file in local_files:
-        if file.endswith('.enc'):
-            # Check if there's metadata for this file
-            metadata_path = os.path.join(app.config['UPLOAD_FOLDER'], file.replace('.enc', '.meta.json'))
-            cloud_id = None
-            if os.path.exists(metadata_path):
-                try:
-                    with open(metadata_path, 'r') as f:
-                        metadata = json.load(f)
-                        cloud_id = metadata.get('cloud_id')
-                except:
-                    pass
-            
-            file_info = {'name': file, 'source': 'local'}
-            if cloud_id:
-                file_info['cloud_id'] = cloud_id
-                file_info['source'] = 'both'
-            files.append(file_info)
-    
-    # Get cloud files
-    cloud_files, cloud_error = list_cloud_files()
-    if cloud_error:
-        print(f"Error fetching cloud files: {cloud_error}")
-        # Return local files only if cloud fetch fails
-        return jsonify(files)
-    else:
-        for file in cloud_files:
-            if file['name'].endswith('.enc'):
-                cloud_file_names.add(file['name'])
-                # Check if this file is also local
-                local_exists = any(f['name'] == file['name'] for f in files)
-                source = 'both' if local_exists else 'cloud'
-                files.append({
-                    'name': file['name'], 
-                    'source': source, 
-                    'id': file['id'],
-                    'cloud_id': file['id']
-                })
-    
-    # Remove duplicates if any (local and cloud files with same name)
-    unique_files = []
-    seen_names = set()
-    for f in files:
-        if f['name'] not in seen_names:
-            unique_files.append(f)
-            seen_names.add(f['name'])
-    
-    return jsonify(unique_files)
+    """List files, paginated with an opaque cursor.
+
+    Query parameters: limit, cursor, prefix (name prefix), q (substring
+    filter), sort (name|created|size) and order (asc|desc). The next
+    page's cursor is returned in the X-Next-Cursor header.
+    """
+    page, next_cursor, error = query_files(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    response = jsonify(page)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+metrics.STARTUP_SECONDS.set(time.perf_counter() - _import_started, phase='import')
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server. With the debug reloader only the child process
+    # serves requests, so only it should pick up persisted replication jobs.
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        startup()
+    app.run(debug=DEBUG, host='0.0.0.0', port=int(os.environ.get('SECURECLOUD_PORT', 5000)), threaded=True)
@@ -0,0 +1,364 @@
+"""
+Admission control for SecureCloud
+
+Turns away work the server cannot take on right now with a fast error
+and a Retry-After header, instead of letting it queue up behind the
+requests already running and slow all of them down:
+
+- a body size cap per route (413)
+- a global budget of upload bytes in flight (503)
+- per-client token buckets for requests per second and bytes per second (429)
+- a cap on concurrent outbound Drive calls; extra calls wait for a slot,
+  and requests that would need Drive are turned away (503) once too
+  many calls are already waiting
+
+The checks are plain objects so the Flask and ASGI front ends can share
+them; each front end maps a Rejected exception to its own response.
+"""
+
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Seconds a client is told to wait when the server as a whole is busy
+BUSY_RETRY_AFTER = 1.0
+# Seconds between checks for a free slot while a coroutine waits in acquire_async()
+ASYNC_POLL_INTERVAL = 0.01
+MAX_TRACKED_CLIENTS = 10000
+# Upload bytes reserved up front for a body sent without a Content-Length
+UNKNOWN_LENGTH_RESERVE = 64 * 1024 * 1024
+
+
+class Rejected(Exception):
+    """A request that must not be admitted; status is 413, 429 or 503"""
+    def __init__(self, status, reason, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+    def headers(self):
+        if self.retry_after is None:
+            return {}
+        return {'Retry-After': str(max(math.ceil(self.retry_after), 1))}
+
+
+class TokenBucket:
+    """Refills at rate tokens per second, holding at most burst.
+
+    take() admits a request whenever the bucket is not in debt and then
+    charges its full cost, which may overdraw it: one large transfer gets
+    through and the client's next request waits until the debt is repaid.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+
+    def take(self, amount=1):
+        """Charge amount tokens; returns 0 if admitted, else the seconds until it would be"""
+        self._refill(time.monotonic())
+        if self.tokens < 0 or (amount <= self.burst and self.tokens < amount):
+            return (min(amount, self.burst) - self.tokens) / self.rate
+        self.tokens -= amount
+        return 0
+
+    def charge(self, amount):
+        """Charge tokens for work that has already been admitted"""
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+
+class ClientLimits:
+    """A request-rate and a bandwidth bucket per client; a rate of 0 disables that limit"""
+    def __init__(self, requests_per_second=0, request_burst=None, bytes_per_second=0, byte_burst=None,
+                 max_clients=MAX_TRACKED_CLIENTS):
+        self.requests_per_second = requests_per_second
+        self.request_burst = request_burst or max(requests_per_second * 2, 1)
+        self.bytes_per_second = bytes_per_second
+        self.byte_burst = byte_burst or bytes_per_second
+        self.max_clients = max_clients
+        self._clients = OrderedDict()   # client -> (request bucket, byte bucket), least recent first
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_second or self.bytes_per_second)
+
+    def _buckets(self, client):
+        buckets = self._clients.get(client)
+        if buckets is None:
+            buckets = (TokenBucket(self.requests_per_second, self.request_burst) if self.requests_per_second else None,
+                       TokenBucket(self.bytes_per_second, self.byte_burst) if self.bytes_per_second else None)
+            self._clients[client] = buckets
+            # Forget the least recently seen clients; a returning client starts with full buckets
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return buckets
+
+    def admit(self, client, size=0):
+        """Charge one request and size bytes, or raise Rejected"""
+        if not self.enabled:
+            return
+        with self._lock:
+            requests, transfer = self._buckets(client)
+            if requests is not None:
+                wait = requests.take(1)
+                if wait:
+                    raise Rejected(429, 'request_rate', 'Too many requests', wait)
+            if transfer is not None:
+                wait = transfer.take(size)
+                if wait:
+                    # The request was not admitted, so it does not count against the rate
+                    if requests is not None:
+                        requests.tokens += 1
+                    raise Rejected(429, 'bandwidth', 'Bandwidth limit exceeded', wait)
+
+    def charge(self, client, size):
+        """Charge bytes sent or received by an admitted request, once their count is known"""
+        if not self.bytes_per_second or not size:
+            return
+        with self._lock:
+            self._buckets(client)[1].charge(size)
+
+    def status(self):
+        with self._lock:
+            return {
+                'requests_per_second': self.requests_per_second,
+                'bytes_per_second': self.bytes_per_second,
+                'tracked_clients': len(self._clients)
+            }
+
+
+class ByteBudget:
+    """Bytes of request bodies being processed at once, across all requests; 0 disables it"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'rejected': 0, 'peak_bytes': 0}
+
+    def acquire(self, size):
+        """Reserve size bytes or raise Rejected; release() them when the request is done"""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            # A request on its own is always admitted, however large, so it cannot starve
+            if self.in_flight and self.in_flight + size > self.max_bytes:
+                self._stats['rejected'] += 1
+                raise Rejected(503, 'byte_budget', 'Server busy with other uploads', BUSY_RETRY_AFTER)
+            self.in_flight += size
+            self._stats['admitted'] += 1
+            self._stats['peak_bytes'] = max(self._stats['peak_bytes'], self.in_flight)
+
+    def release(self, size):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            self.in_flight -= size
+
+    def grow(self, size):
+        """Charge bytes for a request that has already been admitted"""
+        if not self.max_bytes:
+            return
+        with self._lock:
+            self.in_flight += size
+            self._stats['peak_bytes'] = max(self._stats['peak_bytes'], self.in_flight)
+
+    def status(self):
+        with self._lock:
+            return dict(self._stats, max_bytes=self.max_bytes, in_flight_bytes=self.in_flight)
+
+
+class Reservation:
+    """Upload bytes one admitted request holds against the byte budget.
+
+    A body without a Content-Length starts with a bounded reservation;
+    the front end calls received() as the body is read and the
+    reservation grows with it, so the budget counts the bytes actually in
+    flight instead of the route's cap.
+    """
+    def __init__(self, budget, client, size, content_length):
+        self.budget = budget
+        self.client = client
+        self.size = size
+        self.content_length = content_length
+        self.received_bytes = 0
+
+    @property
+    def metered(self):
+        return self.content_length is None
+
+    def received(self, count):
+        self.received_bytes += count
+        if self.received_bytes > self.size:
+            self.budget.grow(self.received_bytes - self.size)
+            self.size = self.received_bytes
+
+
+class ConcurrencyLimit:
+    """At most limit callers inside the block at once; the others wait for a slot.
+
+    Background work (replication, listing refreshes) simply queues.
+    Request handlers call check() first, so they are turned away once
+    max_queue callers are already waiting instead of joining the queue.
+    """
+    def __init__(self, limit, max_queue):
+        self.limit = limit
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._stats = {'calls': 0, 'queued': 0, 'rejected': 0, 'wait_seconds': 0.0}
+
+    def acquire(self):
+        """Take a slot, waiting for one if all are in use"""
+        if self._slots is None:
+            return
+        if not self._slots.acquire(blocking=False):
+            started = self._start_waiting()
+            try:
+                self._slots.acquire()
+            finally:
+                self._stop_waiting(started)
+        self._enter()
+
+    async def acquire_async(self, poll_interval=ASYNC_POLL_INTERVAL):
+        """acquire() for coroutines: waits for a slot without blocking a thread.
+
+        Threads release slots without a way to wake an event loop, so a
+        waiting coroutine checks for a free slot every poll_interval seconds.
+        """
+        if self._slots is None:
+            return
+        if not self._slots.acquire(blocking=False):
+            started = self._start_waiting()
+            try:
+                while not self._slots.acquire(blocking=False):
+                    await asyncio.sleep(poll_interval)
+            finally:
+                self._stop_waiting(started)
+        self._enter()
+
+    def _start_waiting(self):
+        with self._lock:
+            self._waiting += 1
+            self._stats['queued'] += 1
+        return time.perf_counter()
+
+    def _stop_waiting(self, started):
+        with self._lock:
+            self._waiting -= 1
+            self._stats['wait_seconds'] += time.perf_counter() - started
+
+    def _enter(self):
+        with self._lock:
+            self._active += 1
+            self._stats['calls'] += 1
+
+    def release(self):
+        if self._slots is None:
+            return
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def check(self):
+        """Raise Rejected if a new caller would join a full queue"""
+        if self._slots is None:
+            return
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise Rejected(503, 'drive_queue', 'Too many cloud requests queued', BUSY_RETRY_AFTER)
+
+    def status(self):
+        with self._lock:
+            return dict(self._stats, limit=self.limit, max_queue=self.max_queue,
+                        active=self._active, waiting=self._waiting,
+                        wait_seconds=round(self._stats['wait_seconds'], 3))
+
+
+class AdmissionController:
+    """Size caps, the upload byte budget and per-client limits for a set of routes.
+
+    route_max_bytes maps a route (endpoint name) to its body size cap;
+    routes not in it are capped at default_max_bytes. Only routes in
+    limited_routes are rate limited and only upload_routes count against
+    the byte budget. Per-client limits are keyed on whatever client the
+    front end passes in (the remote address).
+    """
+    def __init__(self, route_max_bytes, default_max_bytes, budget, clients, limited_routes, upload_routes,
+                 unknown_length_reserve=UNKNOWN_LENGTH_RESERVE):
+        self.route_max_bytes = route_max_bytes
+        self.default_max_bytes = default_max_bytes
+        self.budget = budget
+        self.clients = clients
+        self.limited_routes = set(limited_routes)
+        self.upload_routes = set(upload_routes)
+        self.unknown_length_reserve = unknown_length_reserve
+
+    def max_bytes(self, route):
+        return self.route_max_bytes.get(route, self.default_max_bytes)
+
+    def admit(self, route, client, content_length):
+        """Admit a request or raise Rejected; returns what to release() when it is done.
+
+        Upload routes get a Reservation, other routes None. Bodies without a Content-Length reserve
+        unknown_length_reserve bytes (at most the route's cap) up front and
+        must be metered with Reservation.received() as they are read.
+        """
+        limit = self.max_bytes(route)
+        if limit and content_length is not None and content_length > limit:
+            raise Rejected(413, 'too_large', f'Request body larger than {limit} bytes')
+        reservation = None
+        if route in self.upload_routes:
+            if content_length is not None:
+                size = content_length
+            else:
+                size = min(self.unknown_length_reserve, limit) if limit else self.unknown_length_reserve
+            self.budget.acquire(size)
+            reservation = Reservation(self.budget, client, size, content_length)
+        # The client's buckets are only charged once the budget has room, so
+        # a request turned away as busy does not leave the client in debt
+        if route in self.limited_routes:
+            try:
+                self.clients.admit(client, content_length or 0)
+            except Rejected:
+                self.release(reservation)
+                raise
+        return reservation
+
+    def release(self, reservation):
+        if reservation is None:
+            return
+        self.budget.release(reservation.size)
+        # Bodies of unknown length are charged to the client's bandwidth once read
+        if reservation.metered:
+            self.clients.charge(reservation.client, reservation.received_bytes)
+
+    def status(self):
+        return {
+            'route_max_bytes': dict(self.route_max_bytes),
+            'default_max_bytes': self.default_max_bytes,
+            'byte_budget': self.budget.status(),
+            'clients': self.clients.status()
+        }
@@ -0,0 +1,344 @@
+"""
+Asyncio front end for SecureCloud
+
+Serves /upload, /download/<filename> and /files from an ASGI app. Slow
+clients and Google Drive fetches then wait on the event loop instead of
+each holding a server thread for the whole transfer. Request bodies are
+read incrementally and spooled to disk. Encryption, decryption and
+SQLite calls run on a thread pool, and cloud-only blobs are fetched from
+Drive with httpx (other storage backends fetch on the thread pool).
+The three routes go through the same admission control as the Flask
+app. Every other route is served by the Flask app, mounted underneath.
+
+    uvicorn async_app:app --host 0.0.0.0 --port 5000 --workers 2
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_range_header
+from werkzeug.utils import secure_filename
+
+import File_transfer as core
+import admission
+import cloud_fetch
+import drive_client
+import metrics
+
+# Blocking work (encryption, decryption, disk and SQLite) runs here
+EXECUTOR_WORKERS = int(os.environ.get('SECURECLOUD_ASYNC_EXECUTOR_WORKERS', (os.cpu_count() or 4) * 2))
+SPOOL_MEMORY_LIMIT = 1024 * 1024
+
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='async-blocking')
+downloader = cloud_fetch.AsyncRangedDownloader(part_size=core.DOWNLOAD_PART_SIZE, workers=core.DOWNLOAD_WORKERS)
+http_client = None
+_fetches = {}  # cloud id -> future resolved with the error (or None) of an in-flight fetch
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    await run_blocking(core.startup)
+    http_client = httpx.AsyncClient(timeout=drive_client.HTTP_TIMEOUT,
+                                    limits=httpx.Limits(max_connections=100))
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+# Admission control
+def client_address(request):
+    """The client's address; behind core.TRUSTED_PROXIES proxies it is read from X-Forwarded-For, as ProxyFix does"""
+    client = request.client.host if request.client else None
+    forwarded = ','.join(request.headers.getlist('x-forwarded-for'))
+    if core.TRUSTED_PROXIES and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        if len(hops) >= core.TRUSTED_PROXIES:
+            client = hops[-core.TRUSTED_PROXIES]
+    return client
+
+def metered(receive, reservation):
+    """Wrap an ASGI receive callable so body bytes are counted against the byte budget as they arrive"""
+    async def receive_metered():
+        message = await receive()
+        if message['type'] == 'http.request':
+            reservation.received(len(message.get('body', b'')))
+        return message
+    return receive_metered
+
+def admitted(endpoint, handler):
+    """Wrap a route handler in the Flask app's admission control, under its endpoint name"""
+    @functools.wraps(handler)
+    async def admit(request):
+        content_length = request.headers.get('content-length')
+        client = client_address(request)
+        reservation = None
+        try:
+            reservation = core.admission_control.admit(
+                endpoint, client, int(content_length) if content_length and content_length.isdigit() else None)
+            # Bodies of unknown length are counted against the byte budget as they are read
+            if reservation is not None and reservation.metered:
+                request = Request(request.scope, metered(request.receive, reservation))
+            response = await handler(request)
+        except admission.Rejected as e:
+            return JSONResponse(core.record_rejection('async_' + endpoint, e), status_code=e.status,
+                                headers=e.headers())
+        finally:
+            core.admission_control.release(reservation)
+        # Downloads are charged to the client's bandwidth once their size is known
+        if endpoint == 'download_file' and response.status_code in (200, 206):
+            core.admission_control.clients.charge(client, int(response.headers.get('content-length', 0)))
+        return response
+    return admit
+
+# Upload endpoint
+async def spool_body(request):
+    """Read a raw request body incrementally into a temporary file, up to the upload size cap"""
+    limit = core.admission_control.max_bytes('upload_file')
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if limit and size > limit:
+            spool.close()
+            raise admission.Rejected(413, 'too_large', f'Request body larger than {limit} bytes')
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+async def upload_file(request):
+    started = time.perf_counter()
+    core.log.debug("📁 New file upload request (async)")
+
+    # Multipart parts are parsed as they arrive and spooled to disk by
+    # Starlette; raw bodies are spooled here
+    form = None
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        form = await request.form()
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            await form.close()
+            core.log.debug("❌ No file part in request")
+            return JSONResponse({'error': 'No file part'}, status_code=400)
+        if not file.filename:
+            await form.close()
+            core.log.debug("❌ No selected file")
+            return JSONResponse({'error': 'No selected file'}, status_code=400)
+        original_filename = file.filename
+        source_stream = file.file
+    else:
+        original_filename = request.query_params.get('filename', '')
+        if original_filename == '':
+            core.log.debug("❌ No filename for raw upload")
+            return JSONResponse({'error': 'No selected file'}, status_code=400)
+        source_stream = await spool_body(request)
+
+    try:
+        filename = secure_filename(original_filename)
+        core.log.debug(f"📄 Original filename: {original_filename} (secure filename: {filename})")
+        if filename == '':
+            return JSONResponse({'error': 'Invalid filename'}, status_code=400)
+
+        content_length = request.headers.get('content-length')
+        stored = await run_blocking(core.store_file, source_stream, core.keyring,
+                                    int(content_length) if content_length else None)
+        result = await run_blocking(core.complete_upload, filename, stored)
+        metrics.record_transfer('upload', stored['size'], time.perf_counter() - started)
+        return JSONResponse(result)
+    finally:
+        if form is not None:
+            await form.close()
+        else:
+            source_stream.close()
+
+# Cloud fetches
+async def fetch_to_cache(cloud_id):
+    """Download a blob from Drive with httpx into the blob cache; returns (file, size, error)"""
+    # Raises Rejected when too many Drive calls are already queued
+    core.drive_calls.check()
+    if core.STORAGE_BACKEND != 'drive':
+        return await run_blocking(core.cloud_blobs.open, cloud_id)
+    token = await run_blocking(drive_client.get_access_token)
+    if token is None:
+        return None, 0, "Google Drive not configured"
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # The fetch takes one of the Drive call slots shared with the Flask app
+    await core.drive_calls.acquire_async()
+    partial_path = None
+    try:
+        partial_path = await run_blocking(core.cloud_blobs.new_partial)
+        resp = await http_client.get(drive_client.files_url() + cloud_id, params={'fields': 'size'}, headers=headers)
+        resp.raise_for_status()
+        size = int(resp.json()['size'])
+        started = time.perf_counter()
+        with metrics.TRANSFERS_IN_FLIGHT.track(operation='cloud_download'):
+            _, error = await downloader.download(http_client, f'{drive_client.files_url()}{cloud_id}?alt=media',
+                                                 size, partial_path, headers)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage('drive_download', elapsed)
+        core.cloud_blobs.record_miss(error)
+        if error:
+            return None, 0, error
+        metrics.record_transfer('cloud_download', size, elapsed)
+        f, size = await run_blocking(core.cloud_blobs.adopt, cloud_id, partial_path)
+        core.log.info(f"📥 Cached {cloud_id} from cloud ({size} bytes)")
+        return f, size, None
+    except Exception as e:
+        core.cloud_blobs.record_miss(str(e))
+        return None, 0, str(e)
+    finally:
+        core.drive_calls.release()
+        if partial_path and os.path.exists(partial_path):
+            os.remove(partial_path)
+
+async def open_cloud_blob(cloud_id):
+    """Return (file, size, error) for a cloud-only blob; concurrent misses share one fetch"""
+    cached = await run_blocking(core.cloud_blobs.open_cached, cloud_id)
+    if cached:
+        return cached[0], cached[1], None
+
+    pending = _fetches.get(cloud_id)
+    if pending is not None:
+        error = await asyncio.shield(pending)
+        if error:
+            return None, 0, error
+        cached = await run_blocking(core.cloud_blobs.open_cached, cloud_id)
+        return (cached[0], cached[1], None) if cached else (None, 0, 'Cached blob was evicted')
+
+    pending = asyncio.get_running_loop().create_future()
+    _fetches[cloud_id] = pending
+    error = 'Fetch cancelled'
+    try:
+        f, size, error = await fetch_to_cache(cloud_id)
+        return f, size, error
+    finally:
+        del _fetches[cloud_id]
+        pending.set_result(error)
+
+# Download endpoint
+async def download_file(request):
+    filename = request.path_params['filename']
+    name = filename[:-len('.enc')] if filename.endswith('.enc') else filename
+    metadata = await run_blocking(core.metadata_index.get, name)
+    if metadata is None:
+        return JSONResponse({'error': 'File not found'}, status_code=404)
+    cached_id = None
+    f = None
+
+    def fail(e):
+        if f is not None:
+            f.close()
+        if cached_id:
+            core.cloud_blobs.discard(cached_id)
+        return JSONResponse({'error': 'Decryption failed', 'details': str(e)}, status_code=500)
+
+    if metadata['chunk_count'] is not None:
+        # Chunked files open each chunk blob as the range reaches it
+        manifest = await run_blocking(core.metadata_index.get_manifest, name)
+        size, reader = core.open_chunked_stream(manifest, core.keyring)
+    else:
+        # Try the local blob first
+        f, blob_size = await run_blocking(core.blob_store.open_path, metadata['local_path'])
+        if f is None and metadata['cloud_id']:
+            cached_id = metadata['cloud_id']
+            f, blob_size, cloud_error = await open_cloud_blob(cached_id)
+            if f is None:
+                return JSONResponse({'error': 'File not found locally or in cloud', 'cloud_error': cloud_error},
+                                    status_code=404)
+        elif f is None:
+            return JSONResponse({'error': 'File not found'}, status_code=404)
+
+        try:
+            size, reader = await run_blocking(core.open_plaintext_stream, f, blob_size, core.keyring)
+        except Exception as e:
+            return fail(e)
+
+    # Resolve an optional single byte range; malformed headers are ignored
+    status = 200
+    start, end = 0, size - 1
+    byte_ranges = parse_range_header(request.headers.get('range'))
+    if byte_ranges is not None:
+        byte_range = byte_ranges.range_for_length(size)
+        if byte_range is None:
+            if f is not None:
+                f.close()
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{size}'})
+        start, end = byte_range[0], byte_range[1] - 1
+        status = 206
+
+    # Decrypt the first segment before committing to a response status
+    chunks = reader(start, end)
+    started = time.perf_counter()
+    try:
+        first_chunk = await run_blocking(next, chunks, b'')
+    except Exception as e:
+        return fail(e)
+    decrypt_seconds = time.perf_counter() - started
+
+    async def generate():
+        # Same decrypt/send split as File_transfer.timed_download
+        nonlocal decrypt_seconds
+        send_seconds, sent = 0.0, 0
+        chunk = first_chunk
+        try:
+            while chunk is not None:
+                yielded = time.perf_counter()
+                yield chunk
+                resumed = time.perf_counter()
+                send_seconds += resumed - yielded
+                sent += len(chunk)
+                chunk = await run_blocking(next, chunks, None)
+                decrypt_seconds += time.perf_counter() - resumed
+        finally:
+            if f is not None:
+                f.close()
+            metrics.observe_stage('decrypt', decrypt_seconds)
+            metrics.observe_stage('send', send_seconds)
+            metrics.record_transfer('download', sent, time.perf_counter() - started)
+
+    headers = Headers()
+    headers.set('Content-Disposition', 'attachment', filename=filename.replace('.enc', ''))
+    headers['Content-Length'] = str(max(end - start + 1, 0))
+    headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return StreamingResponse(generate(), status_code=status, media_type='application/octet-stream',
+                             headers=dict(headers))
+
+# List files endpoint
+async def list_files(request):
+    page, next_cursor, error = await run_blocking(core.query_files, request.query_params)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+    return JSONResponse(page, headers=headers)
+
+routes = [
+    Route('/upload', admitted('upload_file', upload_file), methods=['POST']),
+    Route('/download/{filename}', admitted('download_file', download_file), methods=['GET']),
+    Route('/files', admitted('list_files', list_files), methods=['GET']),
+    # Everything else (web UI, batch uploads, stats, /metrics) is the Flask app
+    Mount('/', app=WSGIMiddleware(core.app)),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(metrics.ASGIMetrics, routes=routes)],
+    lifespan=lifespan
+)
@@ -0,0 +1,662 @@
+"""
+Offline benchmark harness for SecureCloud
+
+Starts a local Google Drive stand-in (fake_drive.py), runs the app
+against it as a real server process and drives it over HTTP:
+
+- upload and download throughput and latency percentiles for each file
+  size and concurrency level, including downloads of files that are only
+  on the (fake) Drive, cold and from the blob cache
+- replication throughput to Drive
+- /files latency against the number of stored files
+- cold-start time: importing File_transfer in a fresh interpreter, and
+  starting the server until it answers its first request
+- peak RSS of the server and of the harness
+
+Results are written as JSON so runs on different commits can be compared:
+
+    python benchmark.py --sizes 1KB,1MB,64MB --concurrency 1,4,16 --output before.json
+    python benchmark.py ... --output after.json --compare before.json
+
+--ciphers instead runs an in-process micro-benchmark of the container
+encryption and decryption speed of each AEAD cipher on this host.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import hashlib
+import time
+import shutil
+import socket
+import tarfile
+import tempfile
+import argparse
+import platform
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from Crypto.Cipher import AES
+
+import container
+from fake_drive import FakeDrive
+
+APPS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_VERSION = 1
+BLOCK_SIZE = 1024 * 1024
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+# Payloads are an AES-CTR keystream keyed by the payload's tag: random,
+# so uploads are not compressed, and never repeating, so neither whole
+# files nor delta chunks are deduplicated within or across payloads
+_ZEROS = bytes(BLOCK_SIZE)
+
+
+def parse_size(text):
+    match = re.match(r'^\s*(\d+)\s*([KMG]?B)?\s*$', text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f'Invalid size: {text}')
+    return int(match.group(1)) * UNITS[match.group(2) or 'B']
+
+
+def format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return f'{size}B'
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def size_list(text):
+    return [parse_size(value) for value in text.split(',') if value]
+
+
+def payload(size, tag):
+    """Yield size bytes of incompressible, non-repeating data unique to tag"""
+    keystream = AES.new(hashlib.sha256(tag.encode()).digest(), AES.MODE_CTR, nonce=b'')
+    remaining = size
+    while remaining > 0:
+        chunk = keystream.encrypt(_ZEROS[:min(BLOCK_SIZE, remaining)])
+        yield chunk
+        remaining -= len(chunk)
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 6)
+
+    return {'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': round(ordered[-1], 6),
+            'mean': round(sum(ordered) / len(ordered), 6), 'count': len(ordered)}
+
+
+# Memory
+def _child_pids(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _peak_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def process_tree_peak_rss(pid):
+    """Sum of peak RSS (bytes) over a process and its children; None where /proc is unavailable"""
+    total, pids = 0, [pid]
+    while pids:
+        current = pids.pop()
+        peak = _peak_rss_kb(current)
+        if peak is None:
+            if current == pid:
+                return None
+            continue
+        total += peak * 1024
+        pids.extend(_child_pids(current))
+    return total
+
+
+def harness_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Environment: fake Drive plus an app server in a scratch folder
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class BenchEnvironment:
+    def __init__(self, server, workers, drive_latency, keep=False):
+        self.server = server
+        self.workers = workers
+        self.drive_latency = drive_latency
+        self.keep = keep
+        self.workdir = tempfile.mkdtemp(prefix='securecloud-bench-')
+        self.app_dir = os.path.join(self.workdir, 'app')
+        os.makedirs(self.app_dir)
+        self.port = _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.drive = None
+        self.process = None
+        self.ready_seconds = None
+        self._log = None
+
+    def _command(self):
+        if self.server == 'gunicorn':
+            return [sys.executable, '-m', 'gunicorn', '-c', os.path.join(APPS_DIR, 'gunicorn.conf.py')]
+        if self.server == 'async':
+            return [sys.executable, '-m', 'uvicorn', 'async_app:app', '--host', '127.0.0.1',
+                    '--port', str(self.port), '--workers', str(self.workers), '--log-level', 'warning']
+        return [sys.executable, os.path.join(APPS_DIR, 'File_transfer.py')]
+
+    def start(self):
+        self.drive = FakeDrive(os.path.join(self.workdir, 'drive'), latency=self.drive_latency).start()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [APPS_DIR, env.get('PYTHONPATH')]))
+        env['SECURECLOUD_DRIVE_ENDPOINT'] = self.drive.url
+        env['SECURECLOUD_PORT'] = str(self.port)
+        env['SECURECLOUD_BIND'] = f'127.0.0.1:{self.port}'
+        env['SECURECLOUD_WORKERS'] = str(self.workers)
+        env.setdefault('SECURECLOUD_LOG_LEVEL', 'WARNING')
+        # Large enough that cached cloud downloads are not skewed by eviction
+        env.setdefault('SECURECLOUD_BLOB_CACHE_MAX_BYTES', str(1024 ** 4))
+
+        self._log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        started = time.perf_counter()
+        self.process = subprocess.Popen(self._command(), cwd=self.app_dir, env=env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if httpx.get(self.url + '/storage/stats', timeout=2).status_code == 200:
+                    self.ready_seconds = time.perf_counter() - started
+                    return self
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'Server did not start; see {self._log.name}:\n{self.server_log()}')
+
+    def server_log(self, lines=30):
+        try:
+            with open(os.path.join(self.workdir, 'server.log'), 'rb') as f:
+                return b'\n'.join(f.read().splitlines()[-lines:]).decode(errors='replace')
+        except OSError:
+            return ''
+
+    def peak_rss(self):
+        return process_tree_peak_rss(self.process.pid) if self.process else None
+
+    def wait_for_replication(self, timeout):
+        """Wait until no replication jobs are queued; returns seconds waited or None on timeout"""
+        queue_dir = os.path.join(self.app_dir, 'encrypted_files', '.replication')
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            pending = [name for name in os.listdir(queue_dir) if name.endswith('.json')] \
+                if os.path.isdir(queue_dir) else []
+            if not pending:
+                return time.perf_counter() - started
+            time.sleep(0.05)
+        return None
+
+    def drop_local_blobs(self):
+        """Delete local blobs so downloads have to come from the fake Drive"""
+        blob_dir = os.path.join(self.app_dir, 'encrypted_files', 'blobs')
+        for name in os.listdir(blob_dir):
+            if name.endswith('.enc'):
+                os.remove(os.path.join(blob_dir, name))
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log:
+            self._log.close()
+        if self.drive:
+            self.drive.stop()
+        if not self.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Workloads
+_local = threading.local()
+
+
+def _client():
+    # One keep-alive connection per harness thread
+    client = getattr(_local, 'client', None)
+    if client is None:
+        client = _local.client = httpx.Client(timeout=None)
+    return client
+
+
+def _upload(base_url, name, size):
+    started = time.perf_counter()
+    resp = _client().post(f'{base_url}/upload', params={'filename': name},
+                          content=payload(size, name), headers={'Content-Length': str(size)})
+    elapsed = time.perf_counter() - started
+    return elapsed, None if resp.status_code == 200 else f'HTTP {resp.status_code}: {resp.text[:200]}'
+
+
+def _download(base_url, name, size):
+    started = time.perf_counter()
+    received = 0
+    with _client().stream('GET', f'{base_url}/download/{name}') as resp:
+        for chunk in resp.iter_bytes(BLOCK_SIZE):
+            received += len(chunk)
+        status = resp.status_code
+    elapsed = time.perf_counter() - started
+    if status != 200:
+        return elapsed, f'HTTP {status}'
+    return elapsed, None if received == size else f'Short body: {received} of {size} bytes'
+
+
+def run_case(operation, fn, base_url, names, size, concurrency):
+    """Run fn over names with the given concurrency; returns one result record"""
+    def timed(name):
+        try:
+            return fn(base_url, name, size)
+        except Exception as e:
+            return None, str(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, names))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, error in outcomes if not error]
+    errors = [error for _, error in outcomes if error]
+    moved = size * len(latencies)
+    return {
+        'operation': operation,
+        'size': size,
+        'concurrency': concurrency,
+        'requests': len(names),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'bytes': moved,
+        'wall_seconds': round(wall, 6),
+        'throughput_bytes_per_second': round(moved / wall, 1) if wall > 0 else None,
+        'latency_seconds': percentiles(latencies),
+    }
+
+
+def _print_case(result):
+    latency = result['latency_seconds'] or {}
+    throughput = (result['throughput_bytes_per_second'] or 0) / UNITS['MB']
+    print(f"  {result['operation']:<22} {format_size(result['size']):>6} x{result['concurrency']:<3} "
+          f"{throughput:10.1f} MiB/s  p50 {latency.get('p50', 0) * 1000:9.1f} ms  "
+          f"p99 {latency.get('p99', 0) * 1000:9.1f} ms  errors {result['errors']}")
+
+
+def bench_transfers(args):
+    """Upload, download, replicate and fetch back from Drive every size/concurrency case"""
+    results, replication = [], []
+    with BenchEnvironment(args.server, args.workers, args.drive_latency_ms / 1000, args.keep) as env:
+        cases = []
+        first_upload = time.perf_counter()
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                count = max(args.requests, concurrency)
+                names = [f'bench-{format_size(size)}-c{concurrency}-{i}.bin' for i in range(count)]
+                cases.append((size, concurrency, names))
+
+                for result in (run_case('upload', _upload, env.url, names, size, concurrency),
+                               run_case('download', _download, env.url, names, size, concurrency)):
+                    _print_case(result)
+                    results.append(result)
+
+        # Replication runs alongside the uploads, so it is timed from the
+        # first upload until every file is on Drive
+        stored = sum(size * len(names) for size, _, names in cases)
+        tail = env.wait_for_replication(args.replication_timeout)
+        seconds = time.perf_counter() - first_upload if tail is not None else None
+        replication.append({
+            'files': sum(len(names) for _, _, names in cases),
+            'bytes': stored,
+            'seconds': round(seconds, 6) if seconds is not None else None,
+            'seconds_after_last_download': round(tail, 6) if tail is not None else None,
+            'throughput_bytes_per_second': round(stored / seconds, 1) if seconds else None,
+            'timed_out': tail is None,
+        })
+        print(f"  replication finished {seconds:.2f}s after the first upload" if seconds is not None
+              else "  replication did not drain; skipping cloud downloads")
+
+        if tail is not None:
+            env.drop_local_blobs()
+            for size, concurrency, names in cases:
+                for operation in ('cloud_download_cold', 'cloud_download_cached'):
+                    result = run_case(operation, _download, env.url, names, size, concurrency)
+                    _print_case(result)
+                    results.append(result)
+
+        peak_rss = env.peak_rss()
+        if any(result['errors'] for result in results):
+            print(env.server_log())
+    return results, replication, peak_rss
+
+
+def _batch_tar(start, count):
+    buffer = tempfile.SpooledTemporaryFile(max_size=64 * UNITS['MB'])
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for i in range(start, start + count):
+            data = f'securecloud listing benchmark file {i}\n'.encode()
+            info = tarfile.TarInfo(f'list-{i:07d}.txt')
+            info.size = len(data)
+            tar.addfile(info, fileobj=io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def bench_listing(args):
+    """Latency of /files (first page and full listing) as the number of stored files grows"""
+    results = []
+    with BenchEnvironment(args.server, args.workers, args.drive_latency_ms / 1000, args.keep) as env:
+        client = httpx.Client(base_url=env.url, timeout=None)
+        stored = 0
+        for target in sorted(args.listing):
+            # Populate through the batch endpoint, then let replication settle
+            while stored < target:
+                count = min(args.listing_batch, target - stored)
+                with _batch_tar(stored, count) as body:
+                    resp = client.post('/upload/batch', content=body.read(),
+                                       headers={'Content-Type': 'application/x-tar'})
+                if resp.status_code not in (200, 207):
+                    raise RuntimeError(f'Batch upload failed: HTTP {resp.status_code}: {resp.text[:200]}')
+                stored += count
+            env.wait_for_replication(args.replication_timeout)
+
+            page_latencies = []
+            for _ in range(args.listing_requests):
+                started = time.perf_counter()
+                resp = client.get('/files', params={'limit': args.page_size})
+                page_latencies.append(time.perf_counter() - started)
+                resp.raise_for_status()
+
+            full_latencies = []
+            for _ in range(max(1, args.listing_requests // 10)):
+                started = time.perf_counter()
+                cursor, listed = None, 0
+                while True:
+                    params = {'limit': args.page_size, **({'cursor': cursor} if cursor else {})}
+                    resp = client.get('/files', params=params)
+                    resp.raise_for_status()
+                    listed += len(resp.json())
+                    cursor = resp.headers.get('X-Next-Cursor')
+                    if not cursor:
+                        break
+                full_latencies.append(time.perf_counter() - started)
+
+            result = {'files': stored, 'listed': listed, 'page_size': args.page_size,
+                      'page_latency_seconds': percentiles(page_latencies),
+                      'full_listing_seconds': percentiles(full_latencies)}
+            print(f"  /files with {stored:>8} files: page p50 {result['page_latency_seconds']['p50'] * 1000:8.1f} ms"
+                  f"  full listing p50 {result['full_listing_seconds']['p50'] * 1000:9.1f} ms")
+            results.append(result)
+        client.close()
+        peak_rss = env.peak_rss()
+    return results, peak_rss
+
+
+# Startup
+_IMPORT_SCRIPT = ('import time; started = time.perf_counter(); import File_transfer; '
+                  'print(time.perf_counter() - started)')
+
+
+def bench_startup(args):
+    """Cold import time of File_transfer in fresh interpreters, and time until the server answers"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [APPS_DIR, env.get('PYTHONPATH')]))
+    env.setdefault('SECURECLOUD_LOG_LEVEL', 'WARNING')
+    imports, ready = [], []
+    for _ in range(args.startup_runs):
+        workdir = tempfile.mkdtemp(prefix='securecloud-bench-')
+        try:
+            out = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT], cwd=workdir, env=env,
+                                 capture_output=True, text=True, timeout=120)
+            if out.returncode != 0:
+                raise RuntimeError(f'Importing File_transfer failed:\n{out.stderr[-2000:]}')
+            imports.append(float(out.stdout.strip().splitlines()[-1]))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        with BenchEnvironment(args.server, args.workers, args.drive_latency_ms / 1000, args.keep) as server:
+            ready.append(server.ready_seconds)
+    result = {'runs': args.startup_runs, 'server': args.server,
+              'import_seconds': percentiles(imports), 'ready_seconds': percentiles(ready)}
+    print(f"  {'import File_transfer':<22} p50 {result['import_seconds']['p50'] * 1000:7.1f} ms"
+          f"  min {min(imports) * 1000:7.1f} ms")
+    print(f"  {'server ready':<22} p50 {result['ready_seconds']['p50'] * 1000:7.1f} ms"
+          f"  min {min(ready) * 1000:7.1f} ms")
+    return result
+
+
+# Ciphers
+def cpu_flags():
+    """Whether the CPU advertises AES-NI and carry-less multiply (used by AES-GCM), where known"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = set(line.split(':', 1)[1].split())
+                    return {'aes': 'aes' in flags, 'pclmulqdq': 'pclmulqdq' in flags}
+    except OSError:
+        pass
+    return None
+
+
+def _rate(fn, size, min_seconds):
+    """Bytes per second of fn() processing size bytes, repeated for at least min_seconds"""
+    runs, started = 0, time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return round(size * runs / elapsed, 1)
+
+
+def bench_ciphers(args):
+    """Container encryption and decryption speed for every cipher on this host"""
+    key = os.urandom(16)
+    data = os.urandom(args.cipher_size)
+    results = []
+    for name in container.CIPHER_NAMES.values():
+        def encrypt():
+            out = io.BytesIO()
+            container.encrypt_stream(io.BytesIO(data), out, key, compression='none', cipher=name)
+            return out.getvalue()
+
+        blob = encrypt()
+
+        def decrypt():
+            reader = container.open_reader(io.BytesIO(blob), len(blob))
+            for _ in reader.iter_decrypt(key):
+                pass
+
+        result = {'cipher': name, 'size': args.cipher_size,
+                  'segment_size': container.DEFAULT_SEGMENT_SIZE,
+                  'encrypt_bytes_per_second': _rate(encrypt, args.cipher_size, args.cipher_seconds),
+                  'decrypt_bytes_per_second': _rate(decrypt, args.cipher_size, args.cipher_seconds)}
+        print(f"  {name:<18} encrypt {result['encrypt_bytes_per_second'] / UNITS['MB']:8.1f} MiB/s"
+              f"  decrypt {result['decrypt_bytes_per_second'] / UNITS['MB']:8.1f} MiB/s")
+        results.append(result)
+    fastest = max(results, key=lambda r: r['encrypt_bytes_per_second'] + r['decrypt_bytes_per_second'])
+    print(f"  fastest: {fastest['cipher']} (set SECURECLOUD_CIPHER={fastest['cipher']})")
+    return results
+
+
+# Reporting
+def _git(*cmd):
+    try:
+        return subprocess.run(['git', *cmd], cwd=APPS_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _case_key(result):
+    return f"{result['operation']}/{format_size(result['size'])}/x{result['concurrency']}"
+
+
+def compare(current, baseline_path):
+    """Print throughput and p50 latency changes against an earlier results file"""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    before = {_case_key(r): r for r in baseline.get('transfers', [])}
+    print(f"\nCompared with {baseline_path} ({(baseline.get('meta') or {}).get('commit') or 'unknown commit'}):")
+    for result in current['transfers']:
+        old = before.get(_case_key(result))
+        if not old or not old.get('throughput_bytes_per_second') or not result['throughput_bytes_per_second']:
+            continue
+        throughput = result['throughput_bytes_per_second'] / old['throughput_bytes_per_second'] - 1
+        p50 = ((result['latency_seconds'] or {}).get('p50') or 0) / ((old['latency_seconds'] or {}).get('p50') or 1) - 1
+        print(f"  {_case_key(result):<40} throughput {throughput:+7.1%}  p50 latency {p50:+7.1%}")
+    old_listing = {r['files']: r for r in baseline.get('listing', [])}
+    for result in current['listing']:
+        old = old_listing.get(result['files'])
+        if old:
+            change = result['page_latency_seconds']['p50'] / old['page_latency_seconds']['p50'] - 1
+            print(f"  {'/files ' + str(result['files']) + ' files':<40} page p50 latency {change:+7.1%}")
+    old_startup = baseline.get('startup')
+    if current['startup'] and old_startup:
+        for key in ('import_seconds', 'ready_seconds'):
+            change = current['startup'][key]['p50'] / old_startup[key]['p50'] - 1
+            print(f"  {'startup ' + key.replace('_seconds', ''):<40} p50 {change:+7.1%}")
+    old_ciphers = {r['cipher']: r for r in baseline.get('ciphers', [])}
+    for result in current['ciphers']:
+        old = old_ciphers.get(result['cipher'])
+        if old:
+            encrypt = result['encrypt_bytes_per_second'] / old['encrypt_bytes_per_second'] - 1
+            decrypt = result['decrypt_bytes_per_second'] / old['decrypt_bytes_per_second'] - 1
+            print(f"  {'cipher ' + result['cipher']:<40} encrypt {encrypt:+7.1%}  decrypt {decrypt:+7.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark SecureCloud against a local fake Google Drive')
+    parser.add_argument('--sizes', type=size_list, default=size_list('1KB,1MB,16MB'),
+                        help='File sizes, e.g. 1KB,1MB,64MB,4GB (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4, 16],
+                        help='Concurrent clients per case (default: 1,4,16)')
+    parser.add_argument('--requests', type=int, default=16,
+                        help='Requests per case; at least the concurrency level (default: %(default)s)')
+    parser.add_argument('--listing', type=int_list, default=[100, 1000, 10000],
+                        help='Directory sizes for /files latency (default: 100,1000,10000)')
+    parser.add_argument('--listing-requests', type=int, default=50)
+    parser.add_argument('--listing-batch', type=int, default=1000, help='Files per /upload/batch request')
+    parser.add_argument('--page-size', type=int, default=100, help='/files page size')
+    parser.add_argument('--server', choices=('flask', 'gunicorn', 'async'), default='flask',
+                        help='Server to run the app under (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes for gunicorn/async')
+    parser.add_argument('--drive-latency-ms', type=float, default=0.0,
+                        help='Delay the fake Drive adds to every request')
+    parser.add_argument('--replication-timeout', type=float, default=600.0)
+    parser.add_argument('--ciphers', action='store_true',
+                        help='Only run the cipher micro-benchmark (MB/s per AEAD mode on this host)')
+    parser.add_argument('--cipher-size', type=parse_size, default=parse_size('64MB'),
+                        help='Plaintext size per cipher run (default: 64MB)')
+    parser.add_argument('--cipher-seconds', type=float, default=2.0,
+                        help='Minimum time per cipher measurement (default: %(default)s)')
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help='Fresh imports and server starts to time (default: %(default)s)')
+    parser.add_argument('--skip-startup', action='store_true')
+    parser.add_argument('--skip-transfers', action='store_true')
+    parser.add_argument('--skip-listing', action='store_true')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch folders and server log')
+    parser.add_argument('--output', default='benchmark.json', help='Results file (default: %(default)s)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    results = {
+        'schema': SCHEMA_VERSION,
+        'meta': {
+            'commit': _git('rev-parse', 'HEAD'),
+            'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'server': args.server,
+            'workers': args.workers if args.server != 'flask' else 1,
+            'drive_latency_ms': args.drive_latency_ms,
+            'cipher': os.environ.get('SECURECLOUD_CIPHER', 'eax').lower(),
+            'cpu_flags': cpu_flags(),
+        },
+        'startup': None,
+        'ciphers': [],
+        'transfers': [],
+        'replication': [],
+        'listing': [],
+        'peak_rss_bytes': {},
+    }
+
+    if args.ciphers:
+        print("Ciphers:")
+        results['ciphers'] = bench_ciphers(args)
+        args.skip_startup = args.skip_transfers = args.skip_listing = True
+    if not args.skip_startup:
+        print(f"Startup ({args.server}):")
+        results['startup'] = bench_startup(args)
+    if not args.skip_transfers:
+        print(f"Transfers ({args.server}):")
+        transfers, replication, peak_rss = bench_transfers(args)
+        results['transfers'] = transfers
+        results['replication'] = replication
+        results['peak_rss_bytes']['transfer_server'] = peak_rss
+    if not args.skip_listing:
+        print(f"Listing ({args.server}):")
+        listing, peak_rss = bench_listing(args)
+        results['listing'] = listing
+        results['peak_rss_bytes']['listing_server'] = peak_rss
+    results['peak_rss_bytes']['harness'] = harness_peak_rss()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 1 if any(r['errors'] for r in results['transfers']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
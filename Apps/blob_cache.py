@@ -0,0 +1,172 @@
+"""
+Local disk cache for cloud-only blobs in SecureCloud
+
+Files that only exist on Google Drive are fetched once into
+encrypted_files/.cache/<cloud id>.enc and served from disk afterwards.
+Entries stay encrypted, exactly as stored on Drive, and are decrypted
+per request like any local blob. The cache is bounded by total size and
+evicts least recently used entries first. Concurrent misses for the same
+blob share a single fetch.
+"""
+
+import os
+import time
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+
+CACHE_DIRNAME = '.cache'
+STALE_PART_AGE = 3600
+
+log = logging.getLogger('securecloud.blob_cache')
+
+
+class BlobCache:
+    def __init__(self, folder, fetch_fn, max_bytes=1024 * 1024 * 1024):
+        """fetch_fn(cloud_id, dest_path) -> (size, error) downloads a blob to dest_path"""
+        self.cache_dir = os.path.join(folder, CACHE_DIRNAME)
+        self.fetch_fn = fetch_fn
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # cloud id -> size, least recently used first
+        self._bytes = 0
+        self._fetching = {}             # cloud id -> lock held while it is fetched
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'fetch_errors': 0, 'bytes_fetched': 0}
+        self._loaded = False
+
+    def _path(self, cloud_id):
+        return os.path.join(self.cache_dir, cloud_id + '.enc')
+
+    def load(self):
+        """Create the cache folder and rebuild the LRU order from cached files (idempotent)"""
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.enc'):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, entry.name[:-len('.enc')], stat.st_size))
+                elif entry.name.endswith('.part') and time.time() - entry.stat().st_mtime > STALE_PART_AGE:
+                    # Left behind by a crashed fetch (other workers may still be writing theirs)
+                    os.remove(entry.path)
+            # Oldest access first
+            for _, cloud_id, size in sorted(entries):
+                self._entries[cloud_id] = size
+                self._bytes += size
+            self._evict()
+            self._loaded = True
+
+    def _evict(self, keep=None):
+        # Caller holds self._lock
+        while self._bytes > self.max_bytes and self._entries:
+            cloud_id = next(iter(self._entries))
+            if cloud_id == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(cloud_id)
+                continue
+            size = self._entries.pop(cloud_id)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+            try:
+                # Responses still streaming from the file keep their open handle
+                os.remove(self._path(cloud_id))
+            except OSError as e:
+                log.warning(f"Failed to remove cached blob {cloud_id}: {str(e)}")
+
+    def open_cached(self, cloud_id):
+        """Open a cached blob and mark it recently used; returns (file, size) or None"""
+        self.load()
+        with self._lock:
+            if cloud_id not in self._entries:
+                return None
+            try:
+                f = open(self._path(cloud_id), 'rb')
+            except FileNotFoundError:
+                self._bytes -= self._entries.pop(cloud_id)
+                return None
+            self._entries.move_to_end(cloud_id)
+            self._stats['hits'] += 1
+            return f, self._entries[cloud_id]
+
+    def new_partial(self):
+        """Create an empty partial file in the cache folder and return its path"""
+        self.load()
+        fd, partial_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        os.close(fd)
+        return partial_path
+
+    def record_miss(self, error=None):
+        with self._lock:
+            self._stats['misses'] += 1
+            if error:
+                self._stats['fetch_errors'] += 1
+
+    def adopt(self, cloud_id, partial_path):
+        """Move a fully fetched partial file into the cache; returns (file, size)"""
+        size = os.path.getsize(partial_path)
+        with self._lock:
+            os.replace(partial_path, self._path(cloud_id))
+            f = open(self._path(cloud_id), 'rb')
+            self._entries[cloud_id] = size
+            self._bytes += size
+            self._stats['bytes_fetched'] += size
+            self._evict(keep=cloud_id)
+        return f, size
+
+    def open(self, cloud_id):
+        """Return (file, size, error) for a blob, fetching it from the cloud on a miss"""
+        cached = self.open_cached(cloud_id)
+        if cached:
+            return cached[0], cached[1], None
+
+        with self._lock:
+            fetch_lock = self._fetching.setdefault(cloud_id, threading.Lock())
+        with fetch_lock:
+            # Another request may have fetched it while we waited
+            cached = self.open_cached(cloud_id)
+            if cached:
+                return cached[0], cached[1], None
+
+            partial_path = self.new_partial()
+            try:
+                started = time.time()
+                _, error = self.fetch_fn(cloud_id, partial_path)
+                self.record_miss(error)
+                if error:
+                    return None, 0, error
+                f, size = self.adopt(cloud_id, partial_path)
+                log.info(f"📥 Cached {cloud_id} from cloud ({size} bytes in {time.time() - started:.2f}s)")
+                return f, size, None
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                with self._lock:
+                    self._fetching.pop(cloud_id, None)
+
+    def discard(self, cloud_id):
+        """Drop a cached blob, e.g. after it failed to decrypt"""
+        with self._lock:
+            size = self._entries.pop(cloud_id, None)
+            if size is None:
+                return
+            self._bytes -= size
+            try:
+                os.remove(self._path(cloud_id))
+            except OSError:
+                pass
+
+    def status(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+                'stats': dict(self._stats),
+            }
@@ -1,114 +1,133 @@
 #!/usr/bin/env python3
 """
-Simple script to check Google Drive connection and list files
+Check the Google Drive connection and reconcile local blobs with their cloud copies
+
+    python check_google_drive.py                       # report only
+    python check_google_drive.py --repair              # re-upload and restore
+    python check_google_drive.py --repair --delete-orphans
+
+Every local .enc blob is hashed from disk and compared with the size and
+MD5 the replica tier reports in its bulk listing, so nothing is
+downloaded. See reconcile.py for the categories. Run it from the folder
+the server runs in; it uses the same SECURECLOUD_* settings.
 """
 
 import os
+import sys
 import json
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import pickle
-
-# Google Drive API setup
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-CREDENTIALS_FILE = 'credentials.json'
-TOKEN_FILE = 'token.pickle'
-
-def get_google_drive_service():
-    """Get Google Drive service instance"""
-    creds = None
-    
-    # Load existing token
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    
-    # If no valid credentials, get new ones
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if os.path.exists(CREDENTIALS_FILE):
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    CREDENTIALS_FILE, 
-                    SCOPES,
-                    redirect_uri='http://localhost:8080'
-                )
-                creds = flow.run_local_server(port=8080, prompt='consent')
-            else:
-                return None
-        
-        # Save credentials
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    
-    return build('drive', 'v3', credentials=creds)
-
-def list_all_files():
-    """List all files from Google Drive"""
-    try:
-        service = get_google_drive_service()
-        if not service:
-            print("❌ Google Drive not configured")
-            return
-        
-        print("🔍 Fetching files from Google Drive...")
-        
-        # List files
-        results = service.files().list(
-            pageSize=50,
-            fields="nextPageToken, files(id, name, createdTime, size)"
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        if not files:
-            print("📁 No files found in Google Drive")
-        else:
-            print(f"📁 Found {len(files)} files in Google Drive:")
-            for file in files:
-                print(f"  📄 {file['name']} (ID: {file['id']})")
-        
-        # Check for encrypted files specifically
-        encrypted_files = [f for f in files if f['name'].endswith('.enc')]
-        if encrypted_files:
-            print(f"\n🔐 Found {len(encrypted_files)} encrypted files:")
-            for file in encrypted_files:
-                print(f"  🔒 {file['name']} (ID: {file['id']})")
-        else:
-            print("\n❌ No encrypted files found in Google Drive")
-            
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
-
-def check_local_metadata():
-    """Check local metadata files"""
-    print("\n🔍 Checking local metadata files...")
-    
-    if not os.path.exists('encrypted_files'):
-        print("❌ encrypted_files directory not found")
-        return
-    
-    metadata_files = [f for f in os.listdir('encrypted_files') if f.endswith('.meta.json')]
-    
-    if not metadata_files:
-        print("❌ No metadata files found")
+import time
+import argparse
+
+import reconcile
+import metadata_store
+
+DEFAULT_SHOWN = 20
+
+def check_local_metadata(server):
+    """Check the local metadata index"""
+    print("🔍 Checking local metadata index...")
+
+    if not os.path.exists(server.UPLOAD_FOLDER):
+        print(f"❌ {server.UPLOAD_FOLDER} directory not found")
+        return False
+
+    server.metadata_index.import_sidecars()
+    stats = server.metadata_index.storage_stats()
+    print(f"📁 Found {server.metadata_index.count()} indexed files in {stats['blobs']} local blobs")
+    return True
+
+def print_report(report, shown):
+    """Summary line per category, with the first few entries of each"""
+    print(f"📊 Compared {report['local_blobs']} local blobs with {report['remote_objects']} remote objects "
+          f"in {report['seconds']} s ({report['hashed_bytes'] / (1024 * 1024):.1f} MiB hashed)")
+    print(f"  ✅ ok: {report['ok']}" + (f" (+{report['size_only']} by size only)" if report['size_only'] else ""))
+    if report['pending']:
+        print(f"  ⏳ pending replication: {report['pending']}")
+    for category in reconcile.CATEGORIES + ('errors',):
+        entries = report[category]
+        if not entries:
+            continue
+        print(f"  ❌ {category.replace('_', ' ')}: {len(entries)}")
+        for entry in entries[:shown]:
+            detail = entry.get('error') or entry.get('local_path') or entry.get('id')
+            print(f"     {entry['name']} ({detail})")
+        if len(entries) > shown:
+            print(f"     ... and {len(entries) - shown} more")
+
+def queue_reupload(server, entry):
+    server.metadata_index.set_replication_state(entry['local_path'], metadata_store.STATE_PENDING)
+    server.replication_queue.enqueue(entry['name'], entry['local_path'])
+
+def wait_for_replication(server):
+    """Run queued uploads here when no server process owns the queue"""
+    status = server.replication_queue.status()
+    if not status['owner']:
+        print("📤 Re-uploads queued for the running server")
         return
-    
-    print(f"📁 Found {len(metadata_files)} metadata files:")
-    for meta_file in metadata_files:
-        try:
-            with open(os.path.join('encrypted_files', meta_file), 'r') as f:
-                metadata = json.load(f)
-                print(f"  📄 {metadata['filename']} -> Cloud ID: {metadata['cloud_id']}")
-        except Exception as e:
-            print(f"  ❌ Error reading {meta_file}: {str(e)}")
+    print("📤 Uploading...")
+    while status['queue_depth'] or status['in_flight']:
+        time.sleep(0.5)
+        status = server.replication_queue.status()
+    if status['failed']:
+        print(f"⚠️ {len(status['failed'])} uploads failed; see GET /replication/status")
 
-if __name__ == "__main__":
-    print("🔐 Google Drive Connection Check")
+def reconcile_storage(server, args):
+    """Compare every local blob with its replica; returns True if both tiers agree"""
+    reconciler = reconcile.Reconciler(
+        list_blobs_fn=server.metadata_index.list_blobs,
+        list_objects_fn=server.cloud_storage.list,
+        cloud_ids_fn=server.metadata_index.cloud_ids,
+        workers=args.workers
+    )
+    report, error = reconciler.run()
+    if error:
+        print(f"❌ {error}")
+        return False
+    print_report(report, args.show)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.json}")
+
+    if args.repair:
+        summary = reconcile.Reconciler.repair(
+            report,
+            enqueue_fn=lambda entry: queue_reupload(server, entry),
+            restore_fn=lambda entry: reconcile.restore_blob(server.cloud_storage.fetch, entry),
+            delete_fn=server.cloud_storage.delete if args.delete_orphans else None,
+            is_referenced_fn=server.metadata_index.is_cloud_referenced
+        )
+        print(f"\n🔧 Queued {summary['queued']} re-uploads, restored {summary['restored']} local blobs, "
+              f"deleted {summary['deleted']} orphans, {summary['failed']} failed")
+        if summary['queued']:
+            wait_for_replication(server)
+        return summary['failed'] == 0
+    return not any(report[category] for category in reconcile.CATEGORIES + ('errors',))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check cloud storage and reconcile it with the local blobs')
+    parser.add_argument('--workers', type=int, default=reconcile.DEFAULT_WORKERS,
+                        help='Threads hashing local blobs (default: %(default)s)')
+    parser.add_argument('--repair', action='store_true',
+                        help='Re-upload divergent, missing and unreplicated blobs and restore missing local blobs')
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help='With --repair, delete remote objects no indexed file refers to')
+    parser.add_argument('--show', type=int, default=DEFAULT_SHOWN,
+                        help='Entries to print per category (default: %(default)s)')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    args = parser.parse_args(argv)
+
+    print("🔐 Cloud Storage Check")
     print("=" * 40)
-    
-    check_local_metadata()
-    list_all_files() 
\ No newline at end of file
+
+    # Loads the same storage settings, index and replication queue as the server
+    import File_transfer as server
+
+    if not check_local_metadata(server):
+        return 1
+    print(f"🔍 Listing {server.STORAGE_BACKEND} storage and hashing local blobs...")
+    return 0 if reconcile_storage(server, args) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
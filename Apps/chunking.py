@@ -0,0 +1,136 @@
+"""
+Content-defined chunking for SecureCloud delta uploads
+
+Splits a plaintext stream into chunks whose boundaries depend only on
+the bytes around them, so an edit in the middle of a large file changes
+the one or two chunks it touches and every other chunk is unchanged.
+
+Boundaries are placed with FastCDC: a Gear rolling hash, where every
+byte shifts the hash left by one bit and adds a keyed 64-bit value for
+that byte, so the top bits of the hash mix the last 64 bytes. A chunk
+ends where the top bits are all zero. Bytes before the minimum chunk
+size are skipped (only the last window is hashed), and normalized
+chunking tests more bits before the normal size and fewer after it,
+which pulls chunk sizes towards the average. The loop is plain Python
+reading two bytes per iteration, so it runs at roughly 5-20 MB/s
+depending on the CPU, well below encryption speed; in exchange the
+boundaries hold up on low-entropy data such as logs, CSV and JSON.
+
+The gear table is derived from a secret key, so chunk sizes do not
+fingerprint known plaintexts.
+"""
+
+import sys
+import hmac
+import hashlib
+import functools
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+# Bytes that contribute to the top bit of the hash
+WINDOW_SIZE = 64
+# Bits tested before the normal size are this many more, and after it
+# this many fewer, than the average size calls for
+NORMALIZATION = 2
+
+_MASK64 = (1 << 64) - 1
+
+
+def gear_table(key):
+    """A keyed pseudo-random 64-bit value for every byte value"""
+    seed = hmac.new(key, b'securecloud-chunking-gear', hashlib.sha256).digest()
+    material = hashlib.shake_256(seed).digest(256 * 8)
+    return [int.from_bytes(material[i:i + 8], 'little') for i in range(0, len(material), 8)]
+
+
+@functools.lru_cache(maxsize=4)
+def gear_tables(key):
+    """(gear, first, second): the gear table, and the gear values of the first and
+    second byte of every native-order 16-bit word"""
+    gear = gear_table(key)
+    low = [gear[word & 0xFF] for word in range(65536)]
+    high = [gear[word >> 8] for word in range(65536)]
+    return (gear, low, high) if sys.byteorder == 'little' else (gear, high, low)
+
+
+def chunk_limits(chunk_size):
+    """(min_size, normal_size, max_size, strict_mask, loose_mask) for chunks averaging about chunk_size bytes"""
+    min_size = max(chunk_size // 4, 1)
+    normal_size = max(chunk_size - min_size, min_size)
+    max_size = max(chunk_size * 4, normal_size)
+    # Past the minimum, a position ends a chunk with probability 2**-bits
+    bits = max(chunk_size.bit_length() - 1, NORMALIZATION + 1)
+    strict = ((1 << (bits + NORMALIZATION)) - 1) << (64 - bits - NORMALIZATION)
+    loose = ((1 << (bits - NORMALIZATION)) - 1) << (64 - bits + NORMALIZATION)
+    return min_size, normal_size, max_size, strict, loose
+
+
+def _roll(view, h, mask, tables):
+    """Roll the hash over a memoryview of bytes; returns (length up to the first
+    position where h & mask is zero or -1, the hash)"""
+    gear, first, second = tables
+    even = len(view) & ~1
+    with view[:even].cast('H') as words:
+        for i, word in enumerate(words):
+            h = ((h << 1) + first[word]) & 0xFFFFFFFFFFFFFFFF
+            if not h & mask:
+                return 2 * i + 1, h
+            h = ((h << 1) + second[word]) & 0xFFFFFFFFFFFFFFFF
+            if not h & mask:
+                return 2 * i + 2, h
+    if even < len(view):
+        h = ((h << 1) + gear[view[even]]) & _MASK64
+        if not h & mask:
+            return len(view), h
+    return -1, h
+
+
+def find_boundary(data, start, end, limits, tables):
+    """Offset where the chunk starting at start ends, at most end"""
+    min_size, normal_size, max_size, strict, loose = limits
+    if start + min_size >= end:
+        return end
+    gear = tables[0]
+    with memoryview(data) as view:
+        # Fill the window first so the first position tested depends only on the bytes under it
+        h = 0
+        for byte in view[max(start + min_size - WINDOW_SIZE, start):start + min_size]:
+            h = ((h << 1) + gear[byte]) & _MASK64
+        for first, last, mask in ((min_size, normal_size, strict), (normal_size, max_size, loose)):
+            if start + first >= end:
+                break
+            found, h = _roll(view[start + first:min(start + last, end)], h, mask, tables)
+            if found >= 0:
+                return start + first + found
+    return end
+
+
+def iter_chunks(stream, key, chunk_size=DEFAULT_CHUNK_SIZE, read_size=READ_SIZE):
+    """Yield the content-defined chunks of a readable stream as bytes"""
+    limits = chunk_limits(chunk_size)
+    max_size = limits[2]
+    tables = gear_tables(key)
+    read_size = max(read_size, max_size)
+
+    data = bytearray()
+    start = 0
+    eof = False
+    while True:
+        # Keep at least one maximum-size chunk buffered ahead of start
+        while not eof and len(data) - start < max_size:
+            block = stream.read(read_size)
+            if not block:
+                eof = True
+                break
+            data += block
+        if start >= len(data):
+            return
+
+        end = find_boundary(data, start, min(start + max_size, len(data)), limits, tables)
+        yield bytes(data[start:end])
+        start = end
+
+        # Drop consumed bytes once they outweigh what is still buffered
+        if start > read_size:
+            del data[:start]
+            start = 0
@@ -0,0 +1,214 @@
+"""
+Cached Google Drive listing for SecureCloud
+
+Keeps an in-memory copy of the remote .enc file set so /files does not
+need a Drive round trip per request. The cache is seeded once with a
+full list_cloud_files() call, then kept current by applying deltas
+from the Drive changes feed, starting from a stored start page token.
+A background thread pulls deltas every refresh_interval seconds; if
+the last successful sync is older than max_staleness, readers pull
+deltas synchronously before being served. The listing and page token
+are persisted so a restart does not need a full re-list.
+
+Storage backends without a changes feed (S3, local volumes) are given
+no service_fn; every sync is then a full re-list.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+CACHE_FILENAME = 'cloud_listing.json'
+
+log = logging.getLogger('securecloud.cloud_listing')
+CHANGE_FIELDS = ('nextPageToken, newStartPageToken, '
+                 'changes(fileId, removed, file(id, name, createdTime, size, mimeType, trashed))')
+
+
+class CloudListingCache:
+    def __init__(self, folder, list_fn, service_fn, max_staleness=30.0, refresh_interval=10.0):
+        """list_fn() -> (files, error) lists every .enc file on Drive;
+        service_fn() returns the shared Drive service or None. Pass
+        service_fn=None for backends that have no changes feed."""
+        self.path = os.path.join(folder, CACHE_FILENAME)
+        self.list_fn = list_fn
+        self.service_fn = service_fn
+        self.max_staleness = max_staleness
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._files = None       # Drive file id -> file resource
+        self._page_token = None
+        self._synced_at = 0.0
+        self._last_error = None
+        self._thread = None
+        self._stats = {'seeds': 0, 'delta_syncs': 0, 'changes_applied': 0, 'hits': 0, 'stale_reads': 0}
+
+    # Persistence
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            self._files = {file['id']: file for file in state['files']}
+            self._page_token = state['page_token']
+        except Exception as e:
+            log.warning(f"Ignoring unreadable cloud listing cache: {str(e)}")
+
+    def _save(self):
+        # Per-process temp name: several server workers may save at once
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'page_token': self._page_token, 'files': list(self._files.values())}, f)
+        os.replace(tmp_path, self.path)
+
+    # Sync
+    def seed(self):
+        """Full re-list; returns an error string or None"""
+        page_token = None
+        if self.service_fn is not None:
+            service = self.service_fn()
+            if not service:
+                return "Google Drive not configured"
+            try:
+                # Take the token first so changes made during the listing are replayed
+                page_token = service.changes().getStartPageToken().execute()['startPageToken']
+            except Exception as e:
+                return str(e)
+        files, error = self.list_fn()
+        if error:
+            return error
+        with self._lock:
+            self._files = {file['id']: file for file in files}
+            self._page_token = page_token
+            self._synced_at = time.time()
+            self._stats['seeds'] += 1
+            self._save()
+        return None
+
+    @staticmethod
+    def _is_listed(file):
+        return (not file.get('trashed')
+                and file.get('mimeType', 'application/octet-stream') == 'application/octet-stream'
+                and file.get('name', '').endswith('.enc'))
+
+    def sync(self, wait=True):
+        """Apply pending changes from the Drive changes feed; returns an error string or None.
+
+        With wait=False, returns immediately if another thread is already syncing.
+        """
+        # Drive calls happen under _sync_lock only, so readers copying the
+        # listing under _lock are never blocked behind a network round trip
+        if not self._sync_lock.acquire(blocking=wait):
+            return None
+        try:
+            if self._files is None or self._page_token is None:
+                error = self.seed()
+                self._last_error = error
+                return error
+
+            service = self.service_fn()
+            if not service:
+                self._last_error = "Google Drive not configured"
+                return self._last_error
+
+            page_token = self._page_token
+            changes = []
+            try:
+                while True:
+                    response = service.changes().list(
+                        pageToken=page_token,
+                        pageSize=1000,
+                        spaces='drive',
+                        fields=CHANGE_FIELDS
+                    ).execute()
+                    changes.extend(response.get('changes', []))
+                    if 'newStartPageToken' in response:
+                        page_token = response['newStartPageToken']
+                        break
+                    page_token = response['nextPageToken']
+            except Exception as e:
+                # An expired or invalid token needs a full re-list
+                if getattr(getattr(e, 'resp', None), 'status', None) in (403, 404, 410):
+                    self._page_token = None
+                self._last_error = str(e)
+                return self._last_error
+
+            with self._lock:
+                for change in changes:
+                    file = change.get('file')
+                    if change.get('removed') or not file or not self._is_listed(file):
+                        self._files.pop(change['fileId'], None)
+                    else:
+                        self._files[file['id']] = {k: file[k] for k in ('id', 'name', 'createdTime', 'size') if k in file}
+                self._page_token = page_token
+                self._synced_at = time.time()
+                self._last_error = None
+                self._stats['delta_syncs'] += 1
+                self._stats['changes_applied'] += len(changes)
+                if changes:
+                    self._save()
+            return None
+        finally:
+            self._sync_lock.release()
+
+    def record_upload(self, cloud_id, name):
+        """Add a file we just uploaded without waiting for the changes feed"""
+        with self._lock:
+            if self._files is not None:
+                self._files[cloud_id] = {'id': cloud_id, 'name': name,
+                                         'createdTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+    # Readers
+    def get_files(self, prefix=None):
+        """Return (files, error) from the cache, syncing first if it is too stale"""
+        self.start()
+        if self._files is None or time.time() - self._synced_at > self.max_staleness:
+            self._stats['stale_reads'] += 1
+            # A stale but seeded cache is served as-is while another sync runs
+            error = self.sync(wait=self._files is None)
+            if error and self._files is None:
+                return [], error
+        else:
+            self._stats['hits'] += 1
+        with self._lock:
+            files = list(self._files.values())
+        if prefix:
+            files = [f for f in files if f['name'].startswith(prefix)]
+        return files, None
+
+    def status(self):
+        with self._lock:
+            return {
+                'seeded': self._files is not None,
+                'files': len(self._files) if self._files is not None else 0,
+                'age_seconds': round(time.time() - self._synced_at, 3) if self._synced_at else None,
+                'max_staleness': self.max_staleness,
+                'refresh_interval': self.refresh_interval,
+                'last_error': self._last_error,
+                'stats': dict(self._stats),
+            }
+
+    # Background refresher
+    def start(self):
+        """Load the persisted listing and start the background delta refresher (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._load()
+            self._thread = threading.Thread(target=self._refresh_loop, name='cloud-listing-refresher', daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                log.warning(f"Cloud listing refresh failed: {str(e)}")
@@ -0,0 +1,309 @@
+"""
+Parallel ranged downloads from Google Drive for SecureCloud
+
+Large blobs are fetched as fixed-size parts with concurrent HTTP Range
+requests instead of one serial get_media() call. The destination file
+is preallocated to the full size and every part is written straight to
+its offset, so memory use is bounded by part_size per worker no matter
+how large the blob is. A failed part is retried on its own with
+exponential backoff; the download only fails once a part has exhausted
+its attempts or hits a non-retryable status.
+
+Until a server has answered a Range request with 206, the first part is
+fetched on its own. A server that ignores Range sends the whole object
+with 200 instead; that response is kept as the download, and later
+downloads from the same downloader make one plain request, so the
+object is never fetched once per part.
+
+RangedDownloader runs parts on a thread pool over httplib2;
+AsyncRangedDownloader runs the same scheme on an asyncio event loop
+with an async HTTP client (httpx).
+"""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+# 429 and 5xx responses are worth retrying; other errors are permanent
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PartError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RangeIgnored(PartError):
+    """The server ignored the Range header and sent the whole object; content is its body"""
+    def __init__(self, content):
+        super().__init__('Server ignored the Range header', retryable=False)
+        self.content = content
+
+
+def _part_content(status, content, start, end):
+    """Validate a ranged response and return exactly bytes start..end"""
+    if status == 200:
+        raise RangeIgnored(content)
+    if status != 206:
+        raise PartError(f'HTTP {status} for bytes {start}-{end}', retryable=status in RETRYABLE_STATUSES)
+    if len(content) != end - start + 1:
+        raise PartError(f'Short read for bytes {start}-{end}: got {len(content)}')
+    return content
+
+
+def _write_part(dest_path, start, content):
+    with open(dest_path, 'r+b') as f:
+        f.seek(start)
+        f.write(content)
+
+
+class RangedDownloader:
+    def __init__(self, http_fn, part_size=8 * 1024 * 1024, workers=4, max_attempts=5, base_delay=0.5):
+        """http_fn() returns the calling thread's authorized httplib2 connection"""
+        self.http_fn = http_fn
+        self.part_size = part_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+
+        # None until a server answers a Range request, then whether it honoured it
+        self.ranges_supported = None
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'downloads': 0, 'parts': 0, 'part_retries': 0, 'failures': 0, 'bytes': 0,
+                       'whole_downloads': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _pool(self):
+        # Shared so worker threads keep their keep-alive connections between downloads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download')
+            return self._executor
+
+    @staticmethod
+    def _preallocate(dest_path, size):
+        with open(dest_path, 'wb') as f:
+            f.truncate(size)
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError:
+                    pass  # Not supported by this filesystem; the sparse file still works
+
+    def _read_part(self, uri, start, end):
+        """Return bytes start..end (inclusive), retrying the request with backoff"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                resp, content = self.http_fn().request(uri, 'GET', headers={'Range': f'bytes={start}-{end}'})
+                content = self._checked(resp.status, content, start, end)
+                self._count('parts')
+                self._count('bytes', len(content))
+                return content
+            except Exception as e:
+                if attempt == self.max_attempts or not getattr(e, 'retryable', True):
+                    raise
+                self._count('part_retries')
+                time.sleep(self.base_delay * (2 ** (attempt - 1)))
+
+    def _checked(self, status, content, start, end):
+        """_part_content(), remembering whether the server honours Range"""
+        try:
+            content = _part_content(status, content, start, end)
+        except RangeIgnored:
+            self.ranges_supported = False
+            raise
+        self.ranges_supported = True
+        return content
+
+    def _read_whole(self, uri, size):
+        """Fetch the whole object with one plain request, retrying with backoff"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                resp, content = self.http_fn().request(uri, 'GET')
+                if resp.status != 200:
+                    raise PartError(f'HTTP {resp.status}', retryable=resp.status in RETRYABLE_STATUSES)
+                return self._whole_content(content, size)
+            except Exception as e:
+                if attempt == self.max_attempts or not getattr(e, 'retryable', True):
+                    raise
+                self._count('part_retries')
+                time.sleep(self.base_delay * (2 ** (attempt - 1)))
+
+    def _whole_content(self, content, size):
+        if len(content) != size:
+            raise PartError(f'Short read: got {len(content)} of {size} bytes')
+        self._count('whole_downloads')
+        self._count('bytes', len(content))
+        return content
+
+    def _fetch_part(self, uri, dest_path, start, end):
+        """Download bytes start..end (inclusive) into dest_path at offset start"""
+        content = self._read_part(uri, start, end)
+        _write_part(dest_path, start, content)
+        return len(content)
+
+    def iter_range(self, uri, start, end, size=None):
+        """Yield bytes start..end (inclusive) of uri one part at a time, in order.
+
+        size is the object's size, used to check a whole-object response
+        from a server that ignores Range.
+        """
+        if self.ranges_supported is False:
+            yield self._read_whole(uri, size if size is not None else end + 1)[start:end + 1]
+            return
+        for part_start in range(start, end + 1, self.part_size):
+            try:
+                yield self._read_part(uri, part_start, min(part_start + self.part_size, end + 1) - 1)
+            except RangeIgnored as e:
+                # The rest of the range is in the body we already have
+                content = self._whole_content(e.content, size) if size is not None else e.content
+                yield content[part_start:end + 1]
+                return
+
+    def download(self, uri, size, dest_path):
+        """Fetch size bytes from uri into dest_path; returns (size, error)"""
+        self._count('downloads')
+        try:
+            self._preallocate(dest_path, size)
+            if size == 0:
+                return 0, None
+            if self.ranges_supported is False:
+                _write_part(dest_path, 0, self._read_whole(uri, size))
+                return size, None
+            ranges = [(start, min(start + self.part_size, size) - 1)
+                      for start in range(0, size, self.part_size)]
+            if len(ranges) == 1 or self.ranges_supported is None:
+                # Alone, so a server that ignores Range sends the object once
+                try:
+                    self._fetch_part(uri, dest_path, *ranges[0])
+                except RangeIgnored as e:
+                    _write_part(dest_path, 0, self._whole_content(e.content, size))
+                    return size, None
+                ranges = ranges[1:]
+
+            futures = [self._pool().submit(self._fetch_part, uri, dest_path, start, end)
+                       for start, end in ranges]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            for future in done:
+                future.result()
+            return size, None
+        except Exception as e:
+            self._count('failures')
+            return None, str(e)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, part_size=self.part_size, workers=self.workers)
+
+
+class AsyncRangedDownloader(RangedDownloader):
+    def __init__(self, part_size=8 * 1024 * 1024, workers=4, max_attempts=5, base_delay=0.5):
+        """workers bounds the parts in flight per download"""
+        super().__init__(http_fn=None, part_size=part_size, workers=workers,
+                         max_attempts=max_attempts, base_delay=base_delay)
+
+    async def _stream_whole(self, resp, dest_path, size):
+        """Write a whole-object response into dest_path as it arrives; returns the bytes written"""
+        loop = asyncio.get_running_loop()
+        written = 0
+        f = await loop.run_in_executor(None, open, dest_path, 'r+b')
+        try:
+            async for chunk in resp.aiter_bytes(self.part_size):
+                # Disk writes stay off the event loop
+                await loop.run_in_executor(None, f.write, chunk)
+                written += len(chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        if written != size:
+            raise PartError(f'Short read: got {written} of {size} bytes')
+        self._count('whole_downloads')
+        self._count('bytes', written)
+        return written
+
+    async def _fetch_part_async(self, client, uri, headers, dest_path, start, end, size=None):
+        """Download bytes start..end (inclusive) into dest_path; returns the bytes written.
+
+        Given the object's size, a whole-object response from a server
+        that ignores Range is streamed into dest_path instead.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with client.stream('GET', uri, headers=dict(headers, Range=f'bytes={start}-{end}')) as resp:
+                    if resp.status_code == 200:
+                        self.ranges_supported = False
+                        if size is None:
+                            raise RangeIgnored(None)
+                        return await self._stream_whole(resp, dest_path, size)
+                    content = self._checked(resp.status_code, await resp.aread(), start, end)
+                # Disk writes stay off the event loop
+                await loop.run_in_executor(None, _write_part, dest_path, start, content)
+                self._count('parts')
+                self._count('bytes', len(content))
+                return len(content)
+            except Exception as e:
+                if attempt == self.max_attempts or not getattr(e, 'retryable', True):
+                    raise
+                self._count('part_retries')
+                await asyncio.sleep(self.base_delay * (2 ** (attempt - 1)))
+
+    async def _download_whole_async(self, client, uri, headers, dest_path, size):
+        """Stream the whole object into dest_path with one plain request, retrying with backoff"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with client.stream('GET', uri, headers=headers) as resp:
+                    if resp.status_code != 200:
+                        raise PartError(f'HTTP {resp.status_code}',
+                                        retryable=resp.status_code in RETRYABLE_STATUSES)
+                    return await self._stream_whole(resp, dest_path, size)
+            except Exception as e:
+                if attempt == self.max_attempts or not getattr(e, 'retryable', True):
+                    raise
+                self._count('part_retries')
+                await asyncio.sleep(self.base_delay * (2 ** (attempt - 1)))
+
+    async def download(self, client, uri, size, dest_path, headers=None):
+        """Fetch size bytes from uri into dest_path with an httpx.AsyncClient; returns (size, error)"""
+        self._count('downloads')
+        headers = headers or {}
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def bounded(start, end):
+            async with semaphore:
+                return await self._fetch_part_async(client, uri, headers, dest_path, start, end)
+
+        tasks = []
+        try:
+            await loop.run_in_executor(None, self._preallocate, dest_path, size)
+            if self.ranges_supported is False:
+                await self._download_whole_async(client, uri, headers, dest_path, size)
+                return size, None
+            starts = list(range(0, size, self.part_size))
+            if starts and self.ranges_supported is None:
+                # Alone, so a server that ignores Range sends the object once
+                await self._fetch_part_async(client, uri, headers, dest_path, 0, min(self.part_size, size) - 1, size)
+                if self.ranges_supported is False:
+                    return size, None
+                starts = starts[1:]
+            tasks = [asyncio.ensure_future(bounded(start, min(start + self.part_size, size) - 1))
+                     for start in starts]
+            await asyncio.gather(*tasks)
+            return size, None
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._count('failures')
+            return None, str(e)
@@ -0,0 +1,449 @@
+"""
+Chunked encryption container for SecureCloud .enc files
+
+Version 2 (uncompressed, fixed stride):
+
+    header   : MAGIC (4) | version (1) | flags (1) | segment_size (4)
+    segment* : nonce (16) | tag (16) | ciphertext (<= segment_size)
+
+Version 3 (compressed, variable-length segments):
+
+    header   : MAGIC (4) | version (1) | flags (1) | segment_size (4) | codec (1)
+    segment* : length (4) | nonce (16) | tag (16) | ciphertext
+    index    : offset (8) per segment
+    trailer  : index_offset (8) | segment_count (8) | plaintext_size (8) | MAGIC (4)
+
+Version 4 (any AEAD cipher):
+
+    header   : MAGIC (4) | version (1) | flags (1) | segment_size (4) | codec (1) | cipher (1)
+
+Version 5 (any cipher, keyring key):
+
+    header   : MAGIC (4) | version (1) | flags (1) | segment_size (4) | codec (1) | cipher (1) | key_id (4)
+
+Versions 4 and 5 are followed by fixed-stride segments like version 2
+when uncompressed, or by length-prefixed segments, index and trailer
+like version 3. Nonces are 12 bytes for AES-GCM and 24 bytes for
+XChaCha20-Poly1305. Files without a key ID were written with key 0.
+
+In version 3 each segment_size block of plaintext is compressed on its
+own (so ranges stay seekable through the index) and prefixed with one
+byte saying whether the compressed form was kept. The codec is chosen
+per file by sampling the first block: data that already looks
+compressed is written as version 2.
+
+Every segment is sealed with its own nonce and tag. Versions 2 and 3
+always use AES-EAX; version 4 names the cipher in the header. The header,
+the segment index and a "last segment" flag are bound in as associated
+data, so segments cannot be reordered, dropped or truncated unnoticed;
+in version 3 the last segment also authenticates the plaintext size.
+Files written by the original single-shot encrypt_file (nonce | tag |
+ciphertext, no header) are still readable.
+"""
+
+import io
+import os
+import math
+import zlib
+import struct
+import hashlib
+from collections import Counter
+from Crypto.Random import get_random_bytes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'SCE\x00'
+VERSION = 2
+COMPRESSED_VERSION = 3
+CIPHER_VERSION = 4
+KEY_ID_VERSION = 5
+HEADER_FORMATS = {
+    2: '>4sBBI',
+    3: '>4sBBIB',
+    4: '>4sBBIBB',
+    5: '>4sBBIBBI',
+}
+HEADER_SIZE = struct.calcsize(HEADER_FORMATS[VERSION])
+NONCE_SIZE = 16
+TAG_SIZE = 16
+SEGMENT_OVERHEAD = NONCE_SIZE + TAG_SIZE
+LENGTH_FORMAT = '>I'
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+TRAILER_FORMAT = '>QQQ4s'
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+DEFAULT_SEGMENT_SIZE = 1024 * 1024  # 1 MiB of plaintext per segment
+
+# Compression codecs
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {CODEC_NONE: 'none', CODEC_ZLIB: 'zlib', CODEC_ZSTD: 'zstd'}
+# Above this many bits per byte a sample is treated as already compressed
+ENTROPY_THRESHOLD = 7.5
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+
+# AEAD ciphers
+CIPHER_EAX = 0
+CIPHER_GCM = 1
+CIPHER_CHACHA20_POLY1305 = 2
+CIPHER_NAMES = {CIPHER_EAX: 'eax', CIPHER_GCM: 'gcm', CIPHER_CHACHA20_POLY1305: 'chacha20-poly1305'}
+# XChaCha20's 24-byte nonce keeps random nonces safe under one long-lived key
+NONCE_SIZES = {CIPHER_EAX: NONCE_SIZE, CIPHER_GCM: 12, CIPHER_CHACHA20_POLY1305: 24}
+
+
+class Header:
+    def __init__(self, version, flags, segment_size, codec, raw, cipher=CIPHER_EAX, key_id=0):
+        self.version = version
+        self.flags = flags
+        self.segment_size = segment_size
+        self.codec = codec
+        self.cipher = cipher
+        self.key_id = key_id
+        self.raw = raw
+
+    @property
+    def size(self):
+        return len(self.raw)
+
+    @property
+    def overhead(self):
+        """Nonce and tag bytes added to every segment"""
+        return NONCE_SIZES[self.cipher] + TAG_SIZE
+
+
+def pack_header(segment_size, flags=0, codec=CODEC_NONE, cipher=CIPHER_EAX, key_id=0):
+    """Build the container header with the oldest version that can describe the file"""
+    if key_id:
+        return struct.pack(HEADER_FORMATS[KEY_ID_VERSION], MAGIC, KEY_ID_VERSION,
+                           flags, segment_size, codec, cipher, key_id)
+    if cipher != CIPHER_EAX:
+        return struct.pack(HEADER_FORMATS[CIPHER_VERSION], MAGIC, CIPHER_VERSION,
+                           flags, segment_size, codec, cipher)
+    if codec == CODEC_NONE:
+        return struct.pack(HEADER_FORMATS[VERSION], MAGIC, VERSION, flags, segment_size)
+    return struct.pack(HEADER_FORMATS[COMPRESSED_VERSION], MAGIC, COMPRESSED_VERSION,
+                       flags, segment_size, codec)
+
+
+def parse_header(data):
+    """Parse a container header, returning a Header or None for legacy blobs"""
+    if len(data) < HEADER_SIZE or not data.startswith(MAGIC):
+        return None
+    version = data[len(MAGIC)]
+    if version not in HEADER_FORMATS:
+        raise ValueError(f"Unsupported container version: {version}")
+    header_format = HEADER_FORMATS[version]
+    size = struct.calcsize(header_format)
+    if len(data) < size:
+        raise ValueError("Truncated container header")
+    fields = struct.unpack(header_format, data[:size])
+    segment_size = fields[3]
+    codec = fields[4] if version >= COMPRESSED_VERSION else CODEC_NONE
+    cipher = fields[5] if version >= CIPHER_VERSION else CIPHER_EAX
+    key_id = fields[6] if version >= KEY_ID_VERSION else 0
+    if segment_size <= 0:
+        raise ValueError("Invalid segment size in container header")
+    if codec not in CODEC_NAMES:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+    if cipher not in CIPHER_NAMES:
+        raise ValueError(f"Unsupported cipher: {cipher}")
+    return Header(version, fields[2], segment_size, codec, data[:size], cipher, key_id)
+
+
+def is_container(data):
+    """Check whether a blob (or its first bytes) uses the chunked format"""
+    return len(data) >= HEADER_SIZE and data.startswith(MAGIC)
+
+
+# Compression
+def available_codec():
+    """Best compression codec installed on this host"""
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def sample_entropy(data):
+    """Shannon entropy of a sample in bits per byte"""
+    sample = data[:ENTROPY_SAMPLE_SIZE]
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(c / total * math.log2(c / total) for c in Counter(sample).values())
+
+
+def choose_codec(first_block, compression='auto'):
+    """Pick a codec for a file from its first plaintext block"""
+    if compression in (None, 'none'):
+        return CODEC_NONE
+    if compression == 'zlib':
+        return CODEC_ZLIB
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression requested but the zstandard package is not installed")
+        return CODEC_ZSTD
+    if len(first_block) < 512 or sample_entropy(first_block) > ENTROPY_THRESHOLD:
+        return CODEC_NONE
+    return available_codec()
+
+
+def _compress(codec, data):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(codec, data, limit):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("File is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=limit)
+    decompressor = zlib.decompressobj()
+    out = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Compressed segment exceeds the segment size")
+    return out
+
+
+def _pack_block(codec, block):
+    """Compressed segments carry a one-byte marker; incompressible blocks are stored raw"""
+    compressed = _compress(codec, block)
+    if len(compressed) < len(block):
+        return b'\x01' + compressed
+    return b'\x00' + block
+
+
+def _unpack_block(codec, payload, limit):
+    if payload[:1] == b'\x01':
+        return _decompress(codec, payload[1:], limit)
+    return payload[1:]
+
+
+# Segment sealing
+def cipher_id(name):
+    """Cipher ID for a configured name ('eax', 'gcm' or 'chacha20-poly1305')"""
+    for cipher, cipher_name in CIPHER_NAMES.items():
+        if cipher_name == name.lower():
+            return cipher
+    raise ValueError(f"Unknown cipher: {name} (expected one of {', '.join(CIPHER_NAMES.values())})")
+
+
+def _chacha_key(key):
+    # ChaCha20 takes a 256-bit key; derive one from the AES key
+    return hashlib.sha256(b'securecloud-chacha20:' + key).digest()
+
+
+def _new_cipher(cipher, key, nonce):
+    # Crypto.Cipher loads native code (through cffi when installed), which
+    # takes tens of milliseconds; it is imported on the first use instead
+    from Crypto.Cipher import AES, ChaCha20_Poly1305
+    if cipher == CIPHER_GCM:
+        return AES.new(key, AES.MODE_GCM, nonce=nonce)
+    if cipher == CIPHER_CHACHA20_POLY1305:
+        return ChaCha20_Poly1305.new(key=_chacha_key(key), nonce=nonce)
+    return AES.new(key, AES.MODE_EAX, nonce=nonce)
+
+
+def _segment_aad(header, index, last, total=None):
+    aad = header + struct.pack('>QB', index, 1 if last else 0)
+    if total is not None:
+        aad += struct.pack('>Q', total)
+    return aad
+
+
+def _seal_segment(key, aad, plaintext, cipher=CIPHER_EAX):
+    nonce = get_random_bytes(NONCE_SIZES[cipher])
+    aead = _new_cipher(cipher, key, nonce)
+    aead.update(aad)
+    ciphertext, tag = aead.encrypt_and_digest(plaintext)
+    return nonce + tag + ciphertext
+
+
+def _open_segment(key, aad, sealed, cipher=CIPHER_EAX):
+    nonce_size = NONCE_SIZES[cipher]
+    if len(sealed) < nonce_size + TAG_SIZE:
+        raise ValueError("Truncated segment")
+    nonce = sealed[:nonce_size]
+    tag = sealed[nonce_size:nonce_size + TAG_SIZE]
+    aead = _new_cipher(cipher, key, nonce)
+    aead.update(aad)
+    return aead.decrypt_and_verify(sealed[nonce_size + TAG_SIZE:], tag)
+
+
+def _read_full(src, size):
+    """Read exactly size bytes from a stream unless it hits EOF first"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(remaining)
+        if not chunk:
+            break
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(parts)
+
+
+# Encryption
+def encrypt_stream(src, dst, key, segment_size=DEFAULT_SEGMENT_SIZE, compression='auto', cipher='eax',
+                   key_id=0):
+    """Encrypt a readable stream into dst segment by segment.
+
+    Only two segments of plaintext are held in memory at any time, one
+    of them being the read-ahead used to detect the final segment.
+    compression is 'auto' (sample the first block), 'none', 'zlib' or
+    'zstd'; cipher is 'eax', 'gcm' or 'chacha20-poly1305'; key_id names the
+    key in the keyring and is recorded in the header. Returns
+    (plaintext bytes consumed, codec).
+    """
+    cipher = cipher_id(cipher)
+    current = _read_full(src, segment_size)
+    codec = choose_codec(current, compression)
+    header = pack_header(segment_size, codec=codec, cipher=cipher, key_id=key_id)
+    dst.write(header)
+    offset = len(header)
+    offsets = []
+
+    total = 0
+    index = 0
+    while True:
+        following = _read_full(src, segment_size) if len(current) == segment_size else b''
+        last = not following
+        total += len(current)
+        if codec == CODEC_NONE:
+            dst.write(_seal_segment(key, _segment_aad(header, index, last), current, cipher))
+        else:
+            sealed = _seal_segment(key, _segment_aad(header, index, last, total if last else None),
+                                   _pack_block(codec, current), cipher)
+            dst.write(struct.pack(LENGTH_FORMAT, len(sealed)))
+            dst.write(sealed)
+            offsets.append(offset)
+            offset += LENGTH_SIZE + len(sealed)
+        if last:
+            break
+        current = following
+        index += 1
+
+    if codec != CODEC_NONE:
+        dst.write(b''.join(struct.pack('>Q', o) for o in offsets))
+        dst.write(struct.pack(TRAILER_FORMAT, offset, len(offsets), total, MAGIC))
+    return total, codec
+
+
+def encrypt_bytes(data, key, segment_size=DEFAULT_SEGMENT_SIZE, compression='auto', cipher='eax', key_id=0):
+    """Encrypt an in-memory buffer into the chunked format"""
+    out = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), out, key, segment_size, compression, cipher, key_id)
+    return out.getvalue()
+
+
+# Decryption
+class ContainerReader:
+    """Random access to the plaintext of an open container file"""
+
+    def __init__(self, f, blob_size, header):
+        self.f = f
+        self.blob_size = blob_size
+        self.header = header
+        if header.codec == CODEC_NONE:
+            stride = header.segment_size + header.overhead
+            body = blob_size - header.size
+            if body < header.overhead:
+                raise ValueError("Container has no segments")
+            self.segment_count = (body + stride - 1) // stride
+            self.plaintext_size = body - self.segment_count * header.overhead
+            self.offsets = None
+        else:
+            if blob_size < header.size + TRAILER_SIZE:
+                raise ValueError("Truncated container trailer")
+            f.seek(blob_size - TRAILER_SIZE)
+            index_offset, count, total, magic = struct.unpack(TRAILER_FORMAT, f.read(TRAILER_SIZE))
+            if magic != MAGIC or count == 0 or index_offset + count * 8 + TRAILER_SIZE != blob_size:
+                raise ValueError("Corrupt container trailer")
+            f.seek(index_offset)
+            raw_index = _read_full(f, count * 8)
+            self.offsets = list(struct.unpack(f'>{count}Q', raw_index)) + [index_offset]
+            self.segment_count = count
+            self.plaintext_size = total
+
+    def _segment(self, key, index):
+        header = self.header
+        last = index == self.segment_count - 1
+        if self.offsets is None:
+            stride = header.segment_size + header.overhead
+            self.f.seek(header.size + index * stride)
+            return _open_segment(key, _segment_aad(header.raw, index, last), _read_full(self.f, stride),
+                                 header.cipher)
+
+        start, end = self.offsets[index], self.offsets[index + 1]
+        self.f.seek(start + LENGTH_SIZE)
+        sealed = _read_full(self.f, end - start - LENGTH_SIZE)
+        payload = _open_segment(key, _segment_aad(header.raw, index, last,
+                                                  self.plaintext_size if last else None), sealed, header.cipher)
+        block = _unpack_block(header.codec, payload, header.segment_size)
+        expected = header.segment_size if not last else \
+            self.plaintext_size - index * header.segment_size
+        if len(block) != expected:
+            raise ValueError("Segment size mismatch")
+        return block
+
+    def iter_decrypt(self, key, start=0, end=None):
+        """Yield plaintext for the inclusive byte range [start, end], one segment at a time"""
+        segment_size = self.header.segment_size
+        if end is None or end >= self.plaintext_size:
+            end = self.plaintext_size - 1
+        if start > end:
+            if self.plaintext_size == 0:
+                # Still authenticate the header and the empty segment
+                self._segment(key, 0)
+            return
+        first = start // segment_size
+        last = end // segment_size
+        for index in range(first, last + 1):
+            plaintext = self._segment(key, index)
+            lo = start - index * segment_size if index == first else 0
+            hi = end - index * segment_size + 1 if index == last else len(plaintext)
+            yield plaintext[lo:hi]
+
+
+def read_header(f):
+    """Read the header of an open blob, returning a Header or None for legacy blobs"""
+    f.seek(0)
+    return parse_header(f.read(max(struct.calcsize(fmt) for fmt in HEADER_FORMATS.values())))
+
+
+def open_reader(f, blob_size):
+    """Return a ContainerReader for an open blob, or None for legacy blobs"""
+    header = read_header(f)
+    if header is None:
+        return None
+    return ContainerReader(f, blob_size, header)
+
+
+def iter_decrypt(f, blob_size, key, start=0, end=None):
+    """Yield decrypted plaintext for the inclusive byte range [start, end] of a container"""
+    reader = open_reader(f, blob_size)
+    if reader is None:
+        raise ValueError("Not a chunked container")
+    return reader.iter_decrypt(key, start, end)
+
+
+def decrypt_bytes(blob, key):
+    """Decrypt a complete chunked container held in memory"""
+    return b''.join(iter_decrypt(io.BytesIO(blob), len(blob), key))
+
+
+def blob_key_id(f):
+    """Key ID an open blob was encrypted with (0 for files written before keyrings)"""
+    header = read_header(f)
+    return header.key_id if header else 0
+
+
+def blob_plaintext_size(path):
+    """Decrypted size of an .enc file on disk, for either format"""
+    blob_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        reader = open_reader(f, blob_size)
+    if reader is None:
+        return max(blob_size - SEGMENT_OVERHEAD, 0)
+    return reader.plaintext_size
@@ -0,0 +1,324 @@
+"""
+Shared Google Drive client for SecureCloud
+
+Builds the Drive v3 service once per process and hands out the same
+instance to every caller. httplib2 connections are not thread-safe, so
+each thread gets its own keep-alive AuthorizedHttp, created lazily and
+reused for every request that thread makes. Credentials are refreshed
+ahead of expiry under a lock so concurrent requests never race on
+token.pickle.
+
+Setting SECURECLOUD_DRIVE_ENDPOINT points the client at a stand-in for
+the Drive API (e.g. fake_drive.py) instead of Google, without OAuth.
+
+The Google client libraries take a few hundred milliseconds to import,
+so they are only imported on first use (or by prewarm()): local-only
+runs and short CLI commands never load them. The service is built from
+a copy of the Drive discovery document trimmed to the files and changes
+resources, cached in drive_discovery.json.
+"""
+
+import os
+import json
+import pickle
+import logging
+import importlib
+import threading
+from datetime import datetime, timedelta
+
+# Google Drive API setup
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+CREDENTIALS_FILE = 'credentials.json'
+TOKEN_FILE = 'token.pickle'
+
+# Refresh the access token this long before it actually expires
+REFRESH_MARGIN = timedelta(minutes=5)
+HTTP_TIMEOUT = 60
+
+# Base URL of a local Drive API stand-in, used instead of Google when set
+DRIVE_ENDPOINT = os.environ.get('SECURECLOUD_DRIVE_ENDPOINT')
+GOOGLE_ROOT_URL = 'https://www.googleapis.com/'
+
+# Trimmed Drive discovery document, rebuilt when googleapiclient changes
+DISCOVERY_CACHE_FILE = os.environ.get('SECURECLOUD_DISCOVERY_CACHE_FILE', 'drive_discovery.json')
+DISCOVERY_RESOURCES = ('files', 'changes')
+
+# Imported lazily; prewarm() loads them ahead of the first request
+GOOGLE_MODULES = ('httplib2', 'google_auth_httplib2', 'google.auth.transport.requests',
+                  'googleapiclient.discovery', 'googleapiclient.http')
+
+log = logging.getLogger('securecloud.drive')
+
+_lock = threading.RLock()
+_local = threading.local()
+_service = None
+_creds = None
+_stats = {
+    'builds': 0,
+    'refreshes': 0,
+    'connections_created': 0,
+    'connections_reused': 0,
+}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _save_credentials(creds):
+    try:
+        with open(TOKEN_FILE, 'wb') as token:
+            pickle.dump(creds, token)
+    except Exception as e:
+        log.warning(f"Failed to save token.pickle: {str(e)}")
+
+
+def _load_credentials(interactive=True):
+    """Load credentials from token.pickle, running the OAuth flow if needed (and interactive)"""
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        try:
+            with open(TOKEN_FILE, 'rb') as token:
+                creds = pickle.load(token)
+        except Exception as e:
+            log.warning(f"Failed to load token.pickle: {str(e)}")
+            creds = None
+
+    if creds and creds.valid:
+        return creds
+
+    from google.auth.transport.requests import Request
+    try:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            _stats['refreshes'] += 1
+        elif not interactive:
+            return None
+        elif os.path.exists(CREDENTIALS_FILE):
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            print("OAuth redirect URI used: http://localhost:8081")
+            flow = InstalledAppFlow.from_client_secrets_file(
+                CREDENTIALS_FILE,
+                SCOPES,
+                redirect_uri='http://localhost:8081'
+            )
+            creds = flow.run_local_server(port=8081, prompt='consent')
+        else:
+            log.warning("Credentials file not found.")
+            return None
+    except Exception as e:
+        log.error(f"OAuth setup failed: {str(e)}. Please run: python setup_cloud.py")
+        return None
+
+    _save_credentials(creds)
+    return creds
+
+
+def _endpoint_credentials():
+    # The stand-in does not check tokens; a static one keeps every code path unchanged
+    from google.oauth2.credentials import Credentials
+    return Credentials(token='local-endpoint')
+
+
+def _schema_refs(node, refs):
+    """Collect every schema name referenced with $ref below node"""
+    if isinstance(node, dict):
+        if '$ref' in node:
+            refs.add(node['$ref'])
+        for value in node.values():
+            _schema_refs(value, refs)
+    elif isinstance(node, list):
+        for value in node:
+            _schema_refs(value, refs)
+    return refs
+
+
+def _trim_document(document):
+    """Keep only DISCOVERY_RESOURCES and the schemas they (transitively) reference"""
+    trimmed = dict(document)
+    trimmed['resources'] = {name: document['resources'][name] for name in DISCOVERY_RESOURCES}
+    needed = _schema_refs(trimmed['resources'], set())
+    pending = list(needed)
+    while pending:
+        for ref in _schema_refs(document['schemas'][pending.pop()], set()) - needed:
+            needed.add(ref)
+            pending.append(ref)
+    trimmed['schemas'] = {name: document['schemas'][name] for name in sorted(needed)}
+    return trimmed
+
+
+def discovery_document():
+    """Trimmed Drive v3 discovery document, from the on-disk cache when it is current"""
+    from googleapiclient.version import __version__ as client_version
+    try:
+        with open(DISCOVERY_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+        if cached.get('googleapiclient') == client_version:
+            return cached['document']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning(f"Ignoring unreadable discovery cache: {str(e)}")
+
+    # Built from the copy bundled with googleapiclient; never fetched
+    from googleapiclient import discovery_cache
+    document = _trim_document(json.loads(discovery_cache.get_static_doc('drive', 'v3')))
+    try:
+        tmp_path = f'{DISCOVERY_CACHE_FILE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'googleapiclient': client_version, 'document': document}, f)
+        os.replace(tmp_path, DISCOVERY_CACHE_FILE)
+    except Exception as e:
+        log.warning(f"Failed to cache discovery document: {str(e)}")
+    return document
+
+
+def _build_service():
+    from googleapiclient.discovery import build_from_document
+    document = discovery_document()
+    if DRIVE_ENDPOINT:
+        # Both the API and the upload paths go to the stand-in
+        document = dict(document, rootUrl=root_url(), baseUrl=root_url() + document['servicePath'])
+    return build_from_document(document, http=get_http(), requestBuilder=_build_request)
+
+
+def root_url():
+    """Root URL of the Drive API in use (Google or the configured stand-in)"""
+    return DRIVE_ENDPOINT.rstrip('/') + '/' if DRIVE_ENDPOINT else GOOGLE_ROOT_URL
+
+
+def files_url():
+    """Base URL for Drive v3 file resources, for HTTP clients other than googleapiclient"""
+    return root_url() + 'drive/v3/files/'
+
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    return creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+
+def ensure_fresh_credentials():
+    """Refresh the shared credentials if they are expired or about to expire"""
+    creds = _creds
+    if creds is None or not _needs_refresh(creds):
+        return
+    with _lock:
+        # Another thread may have refreshed while we waited for the lock
+        if not _needs_refresh(creds) or not creds.refresh_token:
+            return
+        from google.auth.transport.requests import Request
+        try:
+            creds.refresh(Request())
+            _stats['refreshes'] += 1
+            _save_credentials(creds)
+        except Exception as e:
+            log.warning(f"Token refresh failed: {str(e)}")
+
+
+def get_http():
+    """Return this thread's keep-alive AuthorizedHttp, creating it on first use"""
+    ensure_fresh_credentials()
+    http = getattr(_local, 'http', None)
+    if http is not None and http.credentials is _creds:
+        _count('connections_reused')
+        return http
+    import httplib2
+    import google_auth_httplib2
+    transport = httplib2.Http(timeout=HTTP_TIMEOUT)
+    # Resumable uploads answer 308 for an incomplete upload, not a redirect
+    transport.redirect_codes = transport.redirect_codes - {308}
+    http = google_auth_httplib2.AuthorizedHttp(_creds, http=transport)
+    _local.http = http
+    _count('connections_created')
+    return http
+
+
+def _build_request(http, *args, **kwargs):
+    # Called by googleapiclient for every request; swap the shared http
+    # for the calling thread's own connection.
+    from googleapiclient.http import HttpRequest
+    return HttpRequest(get_http(), *args, **kwargs)
+
+
+def get_service(interactive=True):
+    """Get the process-wide Google Drive service, or None if Drive is not configured.
+
+    With interactive=False, missing or unusable credentials return None
+    instead of starting the browser OAuth flow.
+    """
+    global _service, _creds
+    if _service is not None:
+        return _service
+
+    with _lock:
+        if _service is not None:
+            return _service
+
+        creds = _endpoint_credentials() if DRIVE_ENDPOINT else _load_credentials(interactive)
+        if creds is None:
+            return None
+        try:
+            _creds = creds
+            service = _build_service()
+        except Exception as e:
+            log.error(f"Failed to build Google Drive service: {str(e)}")
+            _creds = None
+            return None
+
+        _stats['builds'] += 1
+        _service = service
+        log.info("Google Drive service initialized successfully.")
+        return _service
+
+
+def prewarm():
+    """Import the Google client stack and build the service now instead of on the first request.
+
+    Returns True if Drive is configured and the service was built.
+    """
+    for module in GOOGLE_MODULES:
+        importlib.import_module(module)
+    discovery_document()
+    # Never start an interactive OAuth flow while a worker is booting
+    return get_service(interactive=False) is not None
+
+
+def get_access_token():
+    """Return a fresh OAuth access token for other HTTP clients, or None if Drive is not configured"""
+    if get_service() is None:
+        return None
+    ensure_fresh_credentials()
+    return _creds.token
+
+
+def reset():
+    """Drop the cached service and credentials so the next call rebuilds them"""
+    global _service, _creds
+    with _lock:
+        _service = None
+        _creds = None
+        _local.__dict__.clear()
+
+
+def _reset_after_fork():
+    # The parent's connections and lock state must not leak into a forked
+    # worker; rebuild everything lazily on first use in the child.
+    global _lock, _local, _service, _creds
+    _lock = threading.RLock()
+    _local = threading.local()
+    _service = None
+    _creds = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_stats():
+    """Return a snapshot of build/refresh/connection counters"""
+    with _lock:
+        return dict(_stats, service_cached=_service is not None)
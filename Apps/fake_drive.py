@@ -0,0 +1,375 @@
+"""
+Local stand-in for the Google Drive v3 API
+
+Implements the subset of Drive that SecureCloud uses: resumable uploads,
+file metadata, ranged media downloads, file listing with simple queries
+and the changes feed. File contents are kept on disk, so multi-gigabyte
+blobs work. No OAuth; tokens are accepted and ignored.
+
+Point SecureCloud at it with SECURECLOUD_DRIVE_ENDPOINT:
+
+    python fake_drive.py --port 8090 --root /tmp/fake-drive
+    SECURECLOUD_DRIVE_ENDPOINT=http://127.0.0.1:8090/ python File_transfer.py
+
+benchmark.py starts one in-process with FakeDrive(root).start().
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COPY_BUFFER = 1024 * 1024
+
+_QUERY_CLAUSE = re.compile(r"^(\w+)\s*(=|!=|contains)\s*(?:'((?:[^'\\]|\\.)*)'|(\w+))$")
+
+
+def _matches(file, query):
+    """Evaluate a Drive query made of 'and'-joined clauses; unknown fields are ignored"""
+    if not query:
+        return True
+    for clause in re.split(r'\s+and\s+', query.strip()):
+        match = _QUERY_CLAUSE.match(clause.strip())
+        if not match:
+            continue
+        field, op, quoted, bare = match.groups()
+        value = re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else bare
+        actual = file.get(field)
+        if isinstance(actual, bool):
+            value = value == 'true'
+        if op == '=' and actual != value:
+            return False
+        if op == '!=' and actual == value:
+            return False
+        if op == 'contains' and value not in (actual or ''):
+            return False
+    return True
+
+
+class FakeDrive:
+    def __init__(self, root, host='127.0.0.1', port=0, latency=0.0):
+        """latency adds a fixed delay (seconds) to every request, to mimic a remote API"""
+        self.root = root
+        self.latency = latency
+        self.blob_dir = os.path.join(root, 'files')
+        self.upload_dir = os.path.join(root, 'uploads')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._files = {}      # file id -> resource
+        self._sessions = {}   # upload id -> {'metadata', 'total', 'received', 'md5'}
+        self._changes = []    # file ids in change order; page tokens index into it
+        self._stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+        handler = type('Handler', (_Handler,), {'drive': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-drive', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, files=len(self._files))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _blob_path(self, file_id):
+        return os.path.join(self.blob_dir, file_id)
+
+    # Resources
+    def _record_change(self, file_id):
+        # Caller holds self._lock
+        self._changes.append(file_id)
+
+    def create_session(self, metadata, total):
+        upload_id = uuid.uuid4().hex
+        open(os.path.join(self.upload_dir, upload_id), 'wb').close()
+        with self._lock:
+            self._sessions[upload_id] = {'metadata': metadata, 'total': total,
+                                         'received': 0, 'md5': hashlib.md5()}
+        return upload_id
+
+    def finish_upload(self, upload_id):
+        with self._lock:
+            session = self._sessions.pop(upload_id)
+        file_id = uuid.uuid4().hex
+        os.replace(os.path.join(self.upload_dir, upload_id), self._blob_path(file_id))
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        metadata = session['metadata']
+        resource = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'size': str(session['received']),
+            'md5Checksum': session['md5'].hexdigest(),
+            'createdTime': now,
+            'modifiedTime': now,
+            'trashed': False,
+        }
+        with self._lock:
+            self._files[file_id] = resource
+            self._record_change(file_id)
+        return resource
+
+    def delete(self, file_id):
+        with self._lock:
+            if self._files.pop(file_id, None) is None:
+                return False
+            self._record_change(file_id)
+        try:
+            os.remove(self._blob_path(file_id))
+        except OSError:
+            pass
+        return True
+
+    def list_files(self, query, page_size, page_token):
+        with self._lock:
+            files = [f for f in self._files.values() if _matches(f, query)]
+        files.sort(key=lambda f: (f['createdTime'], f['id']))
+        start = int(page_token or 0)
+        page = files[start:start + page_size]
+        body = {'kind': 'drive#fileList', 'files': page}
+        if start + page_size < len(files):
+            body['nextPageToken'] = str(start + page_size)
+        return body
+
+    def start_page_token(self):
+        with self._lock:
+            return str(len(self._changes) + 1)
+
+    def list_changes(self, page_token, page_size):
+        start = int(page_token) - 1
+        with self._lock:
+            ids = self._changes[start:start + page_size]
+            changes = []
+            for file_id in ids:
+                file = self._files.get(file_id)
+                change = {'kind': 'drive#change', 'changeType': 'file', 'fileId': file_id,
+                          'removed': file is None}
+                if file is not None:
+                    change['file'] = dict(file)
+                changes.append(change)
+            body = {'kind': 'drive#changeList', 'changes': changes}
+            if start + page_size < len(self._changes):
+                body['nextPageToken'] = str(start + page_size + 1)
+            else:
+                body['newStartPageToken'] = str(len(self._changes) + 1)
+        return body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    drive = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # Helpers
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.drive._count('bytes_out', len(payload))
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _error(self, status, message):
+        self._send_json(status, {'error': {'code': status, 'message': message,
+                                           'errors': [{'message': message}]}})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _route(self, method):
+        self.drive._count('requests')
+        if self.drive.latency:
+            time.sleep(self.drive.latency)
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip('/')
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        try:
+            if path == '/upload/drive/v3/files':
+                if method == 'POST':
+                    return self._start_upload(params)
+                if method == 'PUT':
+                    return self._upload_chunk(params)
+            elif path == '/drive/v3/files' and method == 'GET':
+                return self._send_json(200, self.drive.list_files(
+                    params.get('q'), int(params.get('pageSize', 100)), params.get('pageToken')))
+            elif path == '/drive/v3/changes/startPageToken' and method == 'GET':
+                return self._send_json(200, {'kind': 'drive#startPageToken',
+                                             'startPageToken': self.drive.start_page_token()})
+            elif path == '/drive/v3/changes' and method == 'GET':
+                if 'pageToken' not in params:
+                    return self._error(400, 'Required parameter: pageToken')
+                return self._send_json(200, self.drive.list_changes(
+                    params['pageToken'], int(params.get('pageSize', 100))))
+            elif path.startswith('/drive/v3/files/'):
+                file_id = path[len('/drive/v3/files/'):]
+                if method == 'GET':
+                    return self._get_file(file_id, params)
+                if method == 'DELETE':
+                    self._read_body()
+                    if not self.drive.delete(file_id):
+                        return self._error(404, f'File not found: {file_id}')
+                    return self._send_empty(204)
+            self._error(404, f'Unsupported request: {method} {parts.path}')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    # Uploads
+    def _start_upload(self, params):
+        body = self._read_body()
+        if params.get('uploadType') != 'resumable':
+            return self._error(400, 'Only resumable uploads are supported')
+        metadata = json.loads(body) if body else {}
+        if 'mimeType' not in metadata and self.headers.get('X-Upload-Content-Type'):
+            metadata['mimeType'] = self.headers['X-Upload-Content-Type']
+        total = self.headers.get('X-Upload-Content-Length')
+        upload_id = self.drive.create_session(metadata, int(total) if total else None)
+        host = self.headers.get('Host') or '%s:%d' % self.server.server_address[:2]
+        self._send_empty(200, {'Location': f'http://{host}/upload/drive/v3/files'
+                                           f'?uploadType=resumable&upload_id={upload_id}'})
+
+    def _upload_chunk(self, params):
+        upload_id = params.get('upload_id')
+        with self.drive._lock:
+            session = self.drive._sessions.get(upload_id)
+        if session is None:
+            self._read_body()
+            return self._error(404, 'Upload session not found')
+
+        # Content-Range is "bytes first-last/total" or "bytes */total" for a status query
+        match = re.match(r'bytes (\*|(\d+)-(\d+))/(\d+|\*)', self.headers.get('Content-Range', ''))
+        length = int(self.headers.get('Content-Length') or 0)
+        if match and match.group(4) != '*':
+            session['total'] = int(match.group(4))
+        if match and match.group(1) != '*':
+            first = int(match.group(2))
+            if first != session['received']:
+                self.rfile.read(length)
+                return self._upload_progress(session)
+            path = os.path.join(self.drive.upload_dir, upload_id)
+            with open(path, 'r+b') as f:
+                f.seek(first)
+                remaining = length
+                while remaining:
+                    data = self.rfile.read(min(COPY_BUFFER, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    session['md5'].update(data)
+                    remaining -= len(data)
+            session['received'] += length - remaining
+            self.drive._count('bytes_in', length - remaining)
+        else:
+            self.rfile.read(length)
+
+        if session['total'] is not None and session['received'] >= session['total']:
+            return self._send_json(200, self.drive.finish_upload(upload_id))
+        self._upload_progress(session)
+
+    def _upload_progress(self, session):
+        headers = {'Range': f"bytes=0-{session['received'] - 1}"} if session['received'] else {}
+        self._send_empty(308, headers)
+
+    # Downloads
+    def _get_file(self, file_id, params):
+        with self.drive._lock:
+            resource = self.drive._files.get(file_id)
+        if resource is None:
+            return self._error(404, f'File not found: {file_id}')
+        if params.get('alt') != 'media':
+            return self._send_json(200, resource)
+
+        size = int(resource['size'])
+        start, end, status = 0, size - 1, 200
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start > end:
+                return self._send_empty(416, {'Content-Range': f'bytes */{size}'})
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', resource['mimeType'])
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        with open(self.drive._blob_path(file_id), 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(COPY_BUFFER, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+        self.drive._count('bytes_out', end - start + 1)
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Google Drive v3 API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--root', default='fake_drive', help='Folder for stored files')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay added to every request')
+    args = parser.parse_args()
+
+    drive = FakeDrive(args.root, args.host, args.port, latency=args.latency_ms / 1000)
+    print(f"Fake Google Drive listening on {drive.url}")
+    try:
+        drive.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,25 @@
+# Gunicorn settings for SecureCloud
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# Each worker process runs its own thread pool. Workers share the metadata
+# index (SQLite in WAL mode) and the encrypted_files/ folder. Only one of
+# them owns the replication queue at a time.
+
+import os
+
+wsgi_app = 'File_transfer:create_app()'
+bind = os.environ.get('SECURECLOUD_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('SECURECLOUD_WORKERS', 2))
+threads = int(os.environ.get('SECURECLOUD_THREADS', 8))
+worker_class = 'gthread'
+
+# Large uploads and cloud fetches can hold a request for a while
+timeout = int(os.environ.get('SECURECLOUD_WORKER_TIMEOUT', 300))
+
+# Load the app in each worker after fork rather than in the master
+preload_app = False
+
+# Workers load the Google client and cipher code before they accept
+# requests (set SECURECLOUD_PREWARM=0 to load them on first use instead)
+os.environ.setdefault('SECURECLOUD_PREWARM', '1')
@@ -0,0 +1,196 @@
+"""
+Encryption keyring for SecureCloud
+
+Every blob names the key it was encrypted with in its header. The
+keyring maps those key IDs to keys and says which one encrypts new
+files. Key 0 is the built-in KEY from File_transfer.py, so blobs
+written before the keyring existed stay readable; further keys are kept
+in keyring.json (SECURECLOUD_KEYRING_FILE):
+
+    {"active": 2, "keys": {"1": "<base64 key>", "2": "<base64 key>"}}
+
+Old keys stay in the ring until the re-encryption job has moved every
+blob off them; retiring a key is refused while the metadata index still
+records blobs encrypted with it or a re-encryption pass is unfinished.
+Manage it with:
+
+    python key_store.py list
+    python key_store.py new --activate
+    python key_store.py activate 1
+    python key_store.py retire 1
+"""
+
+import os
+import sys
+import json
+import base64
+import argparse
+import threading
+
+from Crypto.Random import get_random_bytes
+
+KEYRING_FILE = os.environ.get('SECURECLOUD_KEYRING_FILE', 'keyring.json')
+LEGACY_KEY_ID = 0
+MAX_KEY_ID = 2 ** 32 - 1
+NEW_KEY_SIZE = 32  # AES-256
+
+
+class KeyRing:
+    def __init__(self, path, legacy_key, retire_check=None):
+        """legacy_key is key 0, used for blobs that carry no key ID.
+        retire_check(key_id) returns why a key is still needed, or None."""
+        self.path = path
+        self.legacy_key = legacy_key
+        self.retire_check = retire_check
+
+        self._lock = threading.Lock()
+        self._keys = {LEGACY_KEY_ID: legacy_key}
+        self._active = LEGACY_KEY_ID
+        self._signature = None
+
+    # Persistence
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """Reload the keyring file if it changed (e.g. a key was added from the command line)"""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            keys, active = {LEGACY_KEY_ID: self.legacy_key}, LEGACY_KEY_ID
+            if signature is not None:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                for key_id, encoded in data.get('keys', {}).items():
+                    keys[int(key_id)] = base64.b64decode(encoded)
+                active = int(data.get('active', LEGACY_KEY_ID))
+                if active not in keys:
+                    raise ValueError(f"Active key {active} is not in {self.path}")
+            self._keys, self._active, self._signature = keys, active, signature
+
+    def _save(self, keys, active):
+        data = {
+            'active': active,
+            'keys': {str(key_id): base64.b64encode(key).decode()
+                     for key_id, key in sorted(keys.items()) if key_id != LEGACY_KEY_ID}
+        }
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # Lookups
+    def active(self):
+        """(key_id, key) used to encrypt new blobs"""
+        self._refresh()
+        with self._lock:
+            return self._active, self._keys[self._active]
+
+    def active_id(self):
+        return self.active()[0]
+
+    def get(self, key_id):
+        """Key for a key ID read from a blob header"""
+        self._refresh()
+        with self._lock:
+            key = self._keys.get(key_id)
+        if key is None:
+            raise ValueError(f"Key {key_id} is not in the keyring")
+        return key
+
+    def status(self):
+        """Key IDs and the active one; never the keys themselves"""
+        self._refresh()
+        with self._lock:
+            return {'active': self._active, 'keys': sorted(self._keys)}
+
+    # Changes
+    def add(self, key=None, activate=False):
+        """Add a key (random if not given) and return its ID"""
+        key = key or get_random_bytes(NEW_KEY_SIZE)
+        if len(key) not in (16, 24, 32):
+            raise ValueError("Keys must be 16, 24 or 32 bytes")
+        self._refresh()
+        with self._lock:
+            key_id = max(self._keys) + 1
+            if key_id > MAX_KEY_ID:
+                raise ValueError("No key IDs left")
+            keys = dict(self._keys)
+            keys[key_id] = key
+            active = key_id if activate else self._active
+            self._save(keys, active)
+        self._refresh()
+        return key_id
+
+    def activate(self, key_id):
+        """Encrypt new blobs with key_id from now on"""
+        self._refresh()
+        with self._lock:
+            if key_id not in self._keys:
+                raise ValueError(f"Key {key_id} is not in the keyring")
+            self._save(self._keys, key_id)
+        self._refresh()
+
+    def retire(self, key_id):
+        """Drop a key once no blob uses it any more; refused while retire_check reports a use"""
+        self._refresh()
+        if key_id != self._active and key_id != LEGACY_KEY_ID and key_id in self._keys and self.retire_check:
+            reason = self.retire_check(key_id)
+            if reason:
+                raise ValueError(f"Key {key_id} is still needed: {reason}")
+        with self._lock:
+            if key_id == self._active:
+                raise ValueError("Cannot retire the active key")
+            if key_id == LEGACY_KEY_ID:
+                raise ValueError("Key 0 is built in and cannot be retired")
+            if key_id not in self._keys:
+                raise ValueError(f"Key {key_id} is not in the keyring")
+            keys = {k: v for k, v in self._keys.items() if k != key_id}
+            self._save(keys, self._active)
+        self._refresh()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the SecureCloud encryption keyring')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='Show key IDs and the active key')
+    new = commands.add_parser('new', help='Generate a new random key')
+    new.add_argument('--activate', action='store_true', help='Encrypt new files with it')
+    for name, help_text in (('activate', 'Encrypt new files with this key'),
+                            ('retire', 'Remove a key no blob uses any more')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('key_id', type=int)
+    args = parser.parse_args(argv)
+
+    # Key 0 is only needed for lookups; it is never written to the file
+    keyring = KeyRing(KEYRING_FILE, legacy_key=b'')
+    try:
+        if args.command == 'new':
+            key_id = keyring.add(activate=args.activate)
+            print(f"Added key {key_id}" + (" (active)" if args.activate else ""))
+        elif args.command == 'activate':
+            keyring.activate(args.key_id)
+            print(f"Key {args.key_id} is now active")
+        elif args.command == 'retire':
+            # The server's keyring checks the metadata index and re-encryption state first
+            import File_transfer
+            File_transfer.keyring.retire(args.key_id)
+            print(f"Retired key {args.key_id}")
+        status = keyring.status()
+        print(f"Keys: {', '.join(map(str, status['keys']))} (active: {status['active']})")
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
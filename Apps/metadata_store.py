@@ -0,0 +1,559 @@
+"""
+SQLite metadata index for SecureCloud
+
+One row per stored file, keyed by its secure filename (without the .enc
+suffix). Replaces scanning encrypted_files/ and opening a .meta.json
+sidecar per file: listings and download lookups are indexed queries.
+Each thread gets its own connection; the database runs in WAL mode so
+readers never block the upload path.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import container
+
+DB_FILENAME = 'metadata.db'
+
+log = logging.getLogger('securecloud.metadata')
+
+# Replication states
+STATE_LOCAL = 'local'          # on disk only, no replication requested
+STATE_PENDING = 'pending'      # queued for upload to Drive
+STATE_REPLICATED = 'replicated'
+STATE_FAILED = 'failed'
+STATE_CHUNKED = 'chunked'      # stored as chunks; each chunk has its own state
+
+# Chunk blobs are replicated under this prefix; secure_filename() strips
+# leading underscores, so no uploaded file can have a name starting with it
+CHUNK_NAME_PREFIX = '_chunk-'
+
+# Blobs stored only in the cloud are listed for re-encryption under this
+# prefix followed by their content ID (their cloud ID changes when they
+# are re-encrypted); local paths never start with it
+CLOUD_BLOB_PREFIX = 'cloud:'
+
+# /files lists names with the .enc suffix, which sort differently from
+# the bare names ('a-b.enc' < 'a.enc' but 'a' < 'a-b'); the listing
+# indexes below cover these exact expressions
+LISTING_NAME = "name || '.enc'"
+LISTING_SORT_KEYS = {
+    'name': (LISTING_NAME,),
+    'created': ('created_at', LISTING_NAME),
+    'size': ('COALESCE(size, -1)', LISTING_NAME)
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    cloud_id TEXT,
+    local_path TEXT,
+    checksum TEXT,
+    created_at REAL NOT NULL,
+    replication_state TEXT NOT NULL,
+    content_id TEXT,
+    chunk_count INTEGER,
+    key_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_cloud_id ON files (cloud_id);
+CREATE INDEX IF NOT EXISTS files_created_at ON files (created_at);
+CREATE INDEX IF NOT EXISTS files_replication_state ON files (replication_state);
+CREATE INDEX IF NOT EXISTS files_content_id ON files (content_id);
+CREATE INDEX IF NOT EXISTS files_local_path ON files (local_path);
+CREATE INDEX IF NOT EXISTS files_listing_name ON files (name || '.enc');
+CREATE INDEX IF NOT EXISTS files_listing_created ON files (created_at, name || '.enc');
+CREATE INDEX IF NOT EXISTS files_listing_size ON files (COALESCE(size, -1), name || '.enc');
+CREATE INDEX IF NOT EXISTS files_key_id ON files (key_id);
+CREATE TABLE IF NOT EXISTS chunks (
+    content_id TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    local_path TEXT,
+    cloud_id TEXT,
+    created_at REAL NOT NULL,
+    replication_state TEXT NOT NULL,
+    key_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS chunks_local_path ON chunks (local_path);
+CREATE INDEX IF NOT EXISTS chunks_cloud_id ON chunks (cloud_id);
+CREATE INDEX IF NOT EXISTS chunks_key_id ON chunks (key_id);
+CREATE TABLE IF NOT EXISTS file_chunks (
+    name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    content_id TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (name, seq)
+);
+CREATE INDEX IF NOT EXISTS file_chunks_content_id ON file_chunks (content_id);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class BlobReleased(Exception):
+    """Blobs an upload reused were released by another upload before it was recorded.
+
+    released holds the reused local paths (whole files) or chunk content
+    IDs that no file refers to any more.
+    """
+    def __init__(self, released):
+        super().__init__(f"Reused blobs were released: {', '.join(sorted(released))}")
+        self.released = set(released)
+
+
+class MetadataStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, DB_FILENAME)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited across fork() must not be reused by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._migrate(conn)
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def _migrate(self, conn):
+        """Add columns introduced after a database was first created"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(files)')}
+        if columns and 'content_id' not in columns:
+            conn.execute('ALTER TABLE files ADD COLUMN content_id TEXT')
+        if columns and 'chunk_count' not in columns:
+            conn.execute('ALTER TABLE files ADD COLUMN chunk_count INTEGER')
+        if columns and 'key_id' not in columns:
+            conn.execute('ALTER TABLE files ADD COLUMN key_id INTEGER')
+            # Cloud-only rows without a local blob come from the sidecar
+            # import, which predates the keyring: they are on key 0
+            conn.execute('UPDATE files SET key_id = 0 WHERE local_path IS NULL AND chunk_count IS NULL')
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(chunks)')}
+        if columns and 'key_id' not in columns:
+            conn.execute('ALTER TABLE chunks ADD COLUMN key_id INTEGER')
+
+    # Settings
+    def get_setting(self, key, default=None):
+        row = self._conn().execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_setting(self, key, value):
+        self._conn().execute(
+            'INSERT INTO settings (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, value)
+        )
+
+    # Files
+    def get(self, name):
+        """Return the row for a file as a dict, or None"""
+        row = self._conn().execute('SELECT * FROM files WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_content(self, content_id):
+        """Return a locally stored file with this content ID, or None"""
+        row = self._conn().execute(
+            'SELECT * FROM files WHERE content_id = ? AND local_path IS NOT NULL LIMIT 1',
+            (content_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def record_upload(self, name, size, local_path, checksum, content_id=None,
+                      cloud_id=None, replication_state=STATE_PENDING, key_id=None, reused=()):
+        """Insert or refresh a file after it has been written locally.
+
+        key_id is the key its blob is encrypted with, None if unknown.
+        Returns the local paths this upload stopped referencing that no
+        other file references any more.
+        """
+        return self.record_uploads([(name, size, local_path, checksum, content_id,
+                                     cloud_id, replication_state, key_id)], reused)
+
+    def record_uploads(self, uploads, reused=()):
+        """Record many (name, size, local_path, checksum, content_id, cloud_id,
+        replication_state, key_id) uploads in one transaction; returns orphaned local paths.
+
+        reused lists the local paths of already stored blobs that uploads
+        were deduplicated onto. If another upload released one of them in
+        the meantime, nothing is recorded and BlobReleased is raised.
+        """
+        now = time.time()
+        conn = self._conn()
+        # Take the write lock up front: a deferred transaction that reads
+        # first cannot wait for the lock once another writer holds it, so
+        # it fails with "database is locked" instead of honouring the timeout
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Deduplication looked the blobs up outside this transaction
+            released = {path for path in reused if not self._blob_referenced(conn, path)}
+            if released:
+                raise BlobReleased(released)
+            replaced = set()
+            dropped = set()
+            for upload in uploads:
+                row = conn.execute('SELECT local_path FROM files WHERE name = ?', (upload[0],)).fetchone()
+                if row and row['local_path'] and row['local_path'] != upload[2]:
+                    replaced.add(row['local_path'])
+                # A whole-blob upload replaces a file that was stored as chunks
+                dropped.update(self._drop_manifest(conn, upload[0]))
+            conn.executemany(
+                'INSERT INTO files (name, size, local_path, checksum, content_id, cloud_id, '
+                'created_at, replication_state, key_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET size = excluded.size, local_path = excluded.local_path, '
+                'checksum = excluded.checksum, content_id = excluded.content_id, '
+                'cloud_id = excluded.cloud_id, created_at = excluded.created_at, '
+                'replication_state = excluded.replication_state, chunk_count = NULL, key_id = excluded.key_id',
+                [(name, size, local_path, checksum, content_id, cloud_id, now, state, key_id)
+                 for name, size, local_path, checksum, content_id, cloud_id, state, key_id in uploads]
+            )
+            orphaned = [path for path in replaced if not self._blob_referenced(conn, path)]
+            orphaned += self._release_chunks(conn, dropped)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return orphaned
+
+    def set_cloud_id(self, local_path, cloud_id):
+        """Record a completed replication for every file or chunk stored in this blob"""
+        conn = self._conn()
+        for table in ('files', 'chunks'):
+            conn.execute(
+                f'UPDATE {table} SET cloud_id = ?, replication_state = ? WHERE local_path = ?',
+                (cloud_id, STATE_REPLICATED, local_path)
+            )
+
+    def replace_cloud_id(self, old_cloud_id, new_cloud_id):
+        """Point every file or chunk stored in a re-uploaded blob at its new Drive file"""
+        conn = self._conn()
+        for table in ('files', 'chunks'):
+            conn.execute(f'UPDATE {table} SET cloud_id = ? WHERE cloud_id = ?', (new_cloud_id, old_cloud_id))
+
+    def is_referenced(self, local_path):
+        return self._blob_referenced(self._conn(), local_path)
+
+    def _blob_referenced(self, conn, local_path):
+        return conn.execute(
+            'SELECT 1 FROM files WHERE local_path = ? UNION ALL '
+            'SELECT 1 FROM chunks WHERE local_path = ? LIMIT 1', (local_path, local_path)).fetchone() is not None
+
+    def cloud_ids(self):
+        """Every cloud ID some indexed file or chunk refers to"""
+        rows = self._conn().execute(
+            'SELECT cloud_id FROM files WHERE cloud_id IS NOT NULL UNION '
+            'SELECT cloud_id FROM chunks WHERE cloud_id IS NOT NULL').fetchall()
+        return {row[0] for row in rows}
+
+    def is_cloud_referenced(self, cloud_id):
+        return self._conn().execute(
+            'SELECT 1 FROM files WHERE cloud_id = ? UNION ALL '
+            'SELECT 1 FROM chunks WHERE cloud_id = ? LIMIT 1', (cloud_id, cloud_id)).fetchone() is not None
+
+    def list_blobs(self, after=None, limit=100, cloud_only=False):
+        """One entry per stored blob in blob_id order, starting after the given blob_id.
+
+        blob_id is the local path. With cloud_only, blobs stored only in
+        the cloud are listed too, without a local_path and with
+        CLOUD_BLOB_PREFIX and their replica name or content ID as blob_id.
+        Chunk blobs are listed under their replica name, CHUNK_NAME_PREFIX
+        followed by the chunk's content ID.
+        """
+        if cloud_only:
+            file_id = f"COALESCE(local_path, '{CLOUD_BLOB_PREFIX}' || COALESCE(content_id, cloud_id))"
+            chunk_id = f"COALESCE(local_path, '{CLOUD_BLOB_PREFIX}{CHUNK_NAME_PREFIX}' || content_id)"
+            stored = 'local_path IS NOT NULL OR cloud_id IS NOT NULL'
+        else:
+            file_id = chunk_id = 'local_path'
+            stored = 'local_path IS NOT NULL'
+        rows = self._conn().execute(
+            f'SELECT {file_id} AS blob_id, MAX(local_path) AS local_path, MIN(name) AS name, MAX(size) AS size, '
+            f'MAX(cloud_id) AS cloud_id, MAX(content_id) AS content_id, MAX(replication_state) AS replication_state '
+            f'FROM files WHERE ({stored}) AND chunk_count IS NULL AND {file_id} > ? GROUP BY {file_id} '
+            f'UNION ALL '
+            f'SELECT {chunk_id}, local_path, ? || content_id, size, cloud_id, content_id, replication_state '
+            f'FROM chunks WHERE ({stored}) AND {chunk_id} > ? '
+            f'ORDER BY blob_id LIMIT ?',
+            (after or '', CHUNK_NAME_PREFIX, after or '', limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_replication_state(self, local_path, state):
+        conn = self._conn()
+        for table in ('files', 'chunks'):
+            conn.execute(f'UPDATE {table} SET replication_state = ? WHERE local_path = ?', (state, local_path))
+
+    # Encryption keys of stored blobs
+    def set_key_id(self, local_path, key_id, cloud_id=None):
+        """Record the key every file or chunk stored in this blob is encrypted with.
+
+        Blobs stored only in the cloud (local_path None) are matched by cloud_id.
+        """
+        conn = self._conn()
+        for table in ('files', 'chunks'):
+            if local_path is None:
+                conn.execute(f'UPDATE {table} SET key_id = ? WHERE local_path IS NULL AND cloud_id = ?',
+                             (key_id, cloud_id))
+            else:
+                conn.execute(f'UPDATE {table} SET key_id = ? WHERE local_path = ?', (key_id, local_path))
+
+    def count_blobs_with_key(self, key_id):
+        """Blobs (whole files and chunks) recorded as encrypted with key_id"""
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM (SELECT COALESCE(local_path, cloud_id) FROM files '
+            'WHERE key_id = ? AND chunk_count IS NULL UNION '
+            'SELECT COALESCE(local_path, cloud_id) FROM chunks WHERE key_id = ?)', (key_id, key_id)
+        ).fetchone()[0]
+
+    def blobs_without_key_id(self):
+        """Local paths of blobs whose key is not recorded (None for cloud-only files)"""
+        rows = self._conn().execute(
+            'SELECT local_path FROM files WHERE key_id IS NULL AND chunk_count IS NULL UNION '
+            'SELECT local_path FROM chunks WHERE key_id IS NULL').fetchall()
+        return [row[0] for row in rows]
+
+    # Files stored as content-defined chunks
+    def get_chunk(self, content_id):
+        row = self._conn().execute('SELECT * FROM chunks WHERE content_id = ?', (content_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_manifest(self, name):
+        """The chunks of a chunked file in order, with where each one is stored"""
+        rows = self._conn().execute(
+            'SELECT file_chunks.seq, file_chunks.content_id, file_chunks.offset, file_chunks.size, '
+            'chunks.local_path, chunks.cloud_id, chunks.replication_state '
+            'FROM file_chunks JOIN chunks ON chunks.content_id = file_chunks.content_id '
+            'WHERE file_chunks.name = ? ORDER BY file_chunks.seq',
+            (name,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_chunked_upload(self, name, size, checksum, content_id, manifest, reused=()):
+        """Insert or refresh a file stored as chunks, in one transaction.
+
+        manifest lists (content_id, offset, size, local_path, key_id) per
+        chunk in file order. Chunks not stored before, or whose replication
+        failed, are marked pending. reused lists the content IDs of chunks
+        that were already stored; if one of them has been released since,
+        nothing is recorded and BlobReleased is raised. Returns (orphaned
+        local paths, [(content_id, local_path)] of the chunks to replicate).
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            released = {chunk_id for chunk_id in reused if conn.execute(
+                'SELECT 1 FROM chunks WHERE content_id = ? AND local_path IS NOT NULL', (chunk_id,)).fetchone() is None}
+            if released:
+                raise BlobReleased(released)
+            row = conn.execute('SELECT local_path FROM files WHERE name = ?', (name,)).fetchone()
+            replaced = row['local_path'] if row else None
+            dropped = self._drop_manifest(conn, name)
+            conn.execute(
+                'INSERT INTO files (name, size, local_path, checksum, content_id, cloud_id, '
+                'created_at, replication_state, chunk_count) VALUES (?, ?, NULL, ?, ?, NULL, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET size = excluded.size, local_path = NULL, '
+                'checksum = excluded.checksum, content_id = excluded.content_id, cloud_id = NULL, '
+                'created_at = excluded.created_at, replication_state = excluded.replication_state, '
+                'chunk_count = excluded.chunk_count',
+                (name, size, checksum, content_id, now, STATE_CHUNKED, len(manifest))
+            )
+
+            to_replicate = {}
+            for chunk_id, _, chunk_size, local_path, key_id in manifest:
+                if chunk_id in to_replicate:
+                    continue
+                chunk = conn.execute('SELECT replication_state FROM chunks WHERE content_id = ?',
+                                     (chunk_id,)).fetchone()
+                if chunk is None:
+                    conn.execute(
+                        'INSERT INTO chunks (content_id, size, local_path, cloud_id, created_at, '
+                        'replication_state, key_id) VALUES (?, ?, ?, NULL, ?, ?, ?)',
+                        (chunk_id, chunk_size, local_path, now, STATE_PENDING, key_id)
+                    )
+                elif chunk['replication_state'] not in (STATE_REPLICATED, STATE_PENDING):
+                    conn.execute('UPDATE chunks SET local_path = ?, replication_state = ?, key_id = ? '
+                                 'WHERE content_id = ?', (local_path, STATE_PENDING, key_id, chunk_id))
+                else:
+                    continue
+                to_replicate[chunk_id] = local_path
+            conn.executemany(
+                'INSERT INTO file_chunks (name, seq, content_id, offset, size) VALUES (?, ?, ?, ?, ?)',
+                [(name, seq, chunk_id, offset, chunk_size)
+                 for seq, (chunk_id, offset, chunk_size, _, _) in enumerate(manifest)]
+            )
+
+            orphaned = self._release_chunks(conn, dropped)
+            if replaced and not self._blob_referenced(conn, replaced):
+                orphaned.append(replaced)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return orphaned, list(to_replicate.items())
+
+    def _drop_manifest(self, conn, name):
+        """Remove a file's chunk list; returns the content IDs it referred to"""
+        rows = conn.execute('SELECT DISTINCT content_id FROM file_chunks WHERE name = ?', (name,)).fetchall()
+        conn.execute('DELETE FROM file_chunks WHERE name = ?', (name,))
+        return {row[0] for row in rows}
+
+    def _release_chunks(self, conn, content_ids):
+        """Forget chunks no file refers to any more; returns their local paths"""
+        orphaned = []
+        for content_id in content_ids:
+            if conn.execute('SELECT 1 FROM file_chunks WHERE content_id = ? LIMIT 1', (content_id,)).fetchone():
+                continue
+            row = conn.execute('SELECT local_path FROM chunks WHERE content_id = ?', (content_id,)).fetchone()
+            conn.execute('DELETE FROM chunks WHERE content_id = ?', (content_id,))
+            if row and row['local_path'] and not self._blob_referenced(conn, row['local_path']):
+                orphaned.append(row['local_path'])
+        return orphaned
+
+    def list_files(self, prefix=None, substring=None, sort='name', descending=False, after=None, limit=None):
+        """One page of indexed files in /files order.
+
+        prefix and substring match the listed name (with .enc). sort is a
+        LISTING_SORT_KEYS key and after the sort key of the last file on
+        the previous page, so each page is an index range scan.
+        """
+        columns = LISTING_SORT_KEYS[sort]
+        conditions = []
+        params = []
+        if prefix:
+            # Range scan rather than LIKE, which cannot use an index
+            conditions.append(f'{LISTING_NAME} >= ? AND {LISTING_NAME} < ?')
+            params += [prefix, prefix + '\U0010ffff']
+        if substring:
+            conditions.append(f'instr(lower({LISTING_NAME}), ?) > 0')
+            params.append(substring.lower())
+        if after is not None:
+            after = list(after)[:len(columns)]
+            # The bound on the leading column alone lets SQLite seek to the cursor
+            conditions.append(f"{columns[0]} {'<=' if descending else '>='} ? AND "
+                              f"({', '.join(columns)}) {'<' if descending else '>'} "
+                              f"({', '.join('?' * len(columns))})")
+            params += [after[0]] + after
+        sql = 'SELECT * FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(column + (' DESC' if descending else '') for column in columns)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def existing_names(self, names):
+        """The subset of names that are indexed"""
+        names = list(names)
+        found = set()
+        conn = self._conn()
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            rows = conn.execute(f"SELECT name FROM files WHERE name IN ({', '.join('?' * len(batch))})",
+                                batch).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def storage_stats(self):
+        """Logical vs physically stored bytes across deduplicated blobs and chunks"""
+        conn = self._conn()
+        files, logical = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files '
+            'WHERE local_path IS NOT NULL OR chunk_count IS NOT NULL'
+        ).fetchone()
+        blobs, stored = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+            '(SELECT local_path, MAX(size) AS size FROM files WHERE local_path IS NOT NULL GROUP BY local_path)'
+        ).fetchone()
+        chunks, chunk_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chunks').fetchone()
+        stored += chunk_bytes
+        return {
+            'files': files,
+            'blobs': blobs,
+            'chunks': chunks,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'saved_bytes': logical - stored,
+            'saved_ratio': round((logical - stored) / logical, 4) if logical else 0.0
+        }
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    # One-time import of the legacy .meta.json sidecars
+    def import_sidecars(self):
+        """Index existing .enc files and .meta.json sidecars once; returns rows imported"""
+        if self.get_setting('sidecars_imported'):
+            return 0
+
+        imported = 0
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Sidecars without a local .enc describe cloud-only files
+            names = set()
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith('.enc'):
+                    names.add(entry.name[:-len('.enc')])
+                elif entry.name.endswith('.meta.json'):
+                    names.add(entry.name[:-len('.meta.json')])
+
+            for name in names:
+                cloud_id = None
+                metadata_path = os.path.join(self.folder, name + '.meta.json')
+                if os.path.exists(metadata_path):
+                    try:
+                        with open(metadata_path, 'r') as f:
+                            cloud_id = json.load(f).get('cloud_id')
+                    except Exception as e:
+                        log.warning(f"Skipping unreadable metadata {metadata_path}: {str(e)}")
+
+                local_path = os.path.join(self.folder, name + '.enc')
+                # Sidecars predate the keyring, so files only in the cloud are on key 0
+                key_id = 0
+                if os.path.exists(local_path):
+                    size = container.blob_plaintext_size(local_path)
+                    created_at = os.path.getmtime(local_path)
+                    with open(local_path, 'rb') as f:
+                        key_id = container.blob_key_id(f)
+                elif cloud_id:
+                    local_path, size, created_at = None, None, os.path.getmtime(metadata_path)
+                else:
+                    continue
+
+                conn.execute(
+                    'INSERT OR IGNORE INTO files (name, size, cloud_id, local_path, checksum, '
+                    'created_at, replication_state, key_id) VALUES (?, ?, ?, ?, NULL, ?, ?, ?)',
+                    (name, size, cloud_id, local_path, created_at,
+                     STATE_REPLICATED if cloud_id else STATE_LOCAL, key_id)
+                )
+                imported += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('sidecars_imported', ?)",
+                (str(time.time()),)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if imported:
+            log.info(f"📥 Imported {imported} files into the metadata index")
+        return imported
@@ -0,0 +1,275 @@
+"""
+Request and stage timing for SecureCloud
+
+A small Prometheus-compatible metrics registry: histograms, counters and
+gauges with labels, rendered in the text exposition format by render()
+for the /metrics endpoint. stage() times one step of a request (read,
+encrypt, local write, Drive upload, ...); WSGIMetrics and ASGIMetrics
+record whole-request latency and in-flight counts, measured until the
+response body has been sent rather than when the view returns.
+
+Metrics are kept per process; with several server workers each one
+reports its own series.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+THROUGHPUT_BUCKETS = (1e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with _lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def _samples(self):
+        lines = []
+        for key, (counts, count, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', repr(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+        return lines
+
+
+# SecureCloud metrics
+STAGE_SECONDS = Histogram('securecloud_stage_seconds', 'Time spent in each processing stage', ('stage',))
+REQUEST_SECONDS = Histogram('securecloud_request_seconds', 'Request latency until the response body is sent',
+                            ('endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('securecloud_requests_in_flight', 'Requests currently being served', ('endpoint',))
+TRANSFERS_IN_FLIGHT = Gauge('securecloud_transfers_in_flight', 'Transfers currently in progress', ('operation',))
+BYTES_TOTAL = Counter('securecloud_bytes_total', 'Plaintext or ciphertext bytes moved', ('operation',))
+THROUGHPUT = Histogram('securecloud_throughput_bytes_per_second', 'Per-transfer throughput', ('operation',),
+                       buckets=THROUGHPUT_BUCKETS)
+ADMISSION_REJECTIONS = Counter('securecloud_admission_rejections_total',
+                               'Requests turned away by admission control', ('endpoint', 'reason'))
+STARTUP_SECONDS = Gauge('securecloud_startup_seconds', 'Time this process spent starting up, by phase',
+                        ('phase',))
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one processing stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def record_transfer(operation, size, seconds):
+    """Count bytes moved by one transfer and its throughput"""
+    BYTES_TOTAL.inc(size, operation=operation)
+    if seconds > 0 and size:
+        THROUGHPUT.observe(size / seconds, operation=operation)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class WSGIMetrics:
+    """WSGI middleware timing each request until its response iterable is closed.
+
+    The application calls WSGIMetrics.mark() once it has routed the
+    request, which sets the endpoint label and counts it as in flight.
+    """
+
+    ENVIRON_KEY = 'securecloud.endpoint'
+
+    def __init__(self, app):
+        self.app = app
+
+    @classmethod
+    def mark(cls, environ, endpoint):
+        if endpoint and cls.ENVIRON_KEY not in environ:
+            environ[cls.ENVIRON_KEY] = endpoint
+            REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = {}
+
+        def capture(status_line, headers, exc_info=None):
+            status['code'] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            body = self.app(environ, capture)
+        except Exception:
+            self._finish(environ, started, '500')
+            raise
+        return _ClosingIterable(body, lambda: self._finish(environ, started, status.get('code', '500')))
+
+    @classmethod
+    def _finish(cls, environ, started, code):
+        endpoint = environ.get(cls.ENVIRON_KEY)
+        if endpoint:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint or 'unknown',
+                                method=environ.get('REQUEST_METHOD', ''), status=code)
+
+
+class _ClosingIterable:
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+class ASGIMetrics:
+    """ASGI middleware timing HTTP requests handled by the given Starlette routes.
+
+    Requests routed into a mounted app (which has no endpoint of its
+    own) are left to that app's instrumentation.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def _endpoint(self, scope):
+        for route in self.routes:
+            match, child_scope = route.matches(scope)
+            if match.name == 'FULL':
+                endpoint = child_scope.get('endpoint')
+                return getattr(endpoint, '__name__', None) and 'async_' + endpoint.__name__
+        return None
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self._endpoint(scope) if scope['type'] == 'http' else None
+        if endpoint is None:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {'code': '500'}
+
+        async def capture(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = str(message['status'])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                    method=scope.get('method', ''), status=status['code'])
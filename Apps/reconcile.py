@@ -0,0 +1,244 @@
+"""
+Local/cloud integrity reconciliation for SecureCloud
+
+Compares every local .enc blob in the metadata index with its copy in
+the replica tier, without downloading anything. The remote side comes
+from one paged bulk listing that carries each object's size and, where
+the backend provides it, a server-side MD5 (Drive's md5Checksum, the
+ETag of single-part S3 objects). The local side is hashed from disk on a
+thread pool while the listing runs, so on large stores the run is
+bounded by disk throughput rather than by API calls.
+
+Each blob ends up in one category:
+
+- ok: both copies exist and agree (size_only when the backend has no
+  checksum and only sizes could be compared)
+- divergent: both exist but differ in size or MD5
+- missing_in_cloud: recorded as replicated, but the remote object is gone
+- missing_locally: the local blob is gone, the remote copy is still there
+- lost: both copies are gone
+- unreplicated: never replicated (or replication failed)
+- orphaned: remote .enc objects no file in the index refers to
+
+repair() queues re-uploads for divergent, missing and unreplicated
+blobs, restores missing local blobs from their remote copy and, only
+when asked, deletes orphaned objects.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metadata_store
+
+DEFAULT_WORKERS = 8
+BLOCK_SIZE = 1024 * 1024
+LIST_PAGE_SIZE = 1000
+MAX_IN_FLIGHT = 256   # hash jobs queued ahead of the workers
+
+CATEGORIES = ('divergent', 'missing_in_cloud', 'missing_locally', 'lost', 'unreplicated', 'orphaned')
+
+log = logging.getLogger('securecloud.reconcile')
+
+
+def file_md5(path, block_size=BLOCK_SIZE):
+    """(md5 hex digest, size) of a file, read in blocks; hashlib releases the GIL on large updates"""
+    digest = hashlib.md5()
+    size = 0
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+            size += read
+    return digest.hexdigest(), size
+
+
+def object_size(obj):
+    # Drive reports sizes as strings
+    size = obj.get('size')
+    return int(size) if size is not None else None
+
+
+class Reconciler:
+    def __init__(self, list_blobs_fn, list_objects_fn, cloud_ids_fn, workers=DEFAULT_WORKERS,
+                 block_size=BLOCK_SIZE):
+        """list_blobs_fn(after, limit) -> blobs from the metadata index in local_path order;
+        list_objects_fn() -> (objects, error) lists every remote .enc object, with 'md5Checksum'
+        where the backend has one; cloud_ids_fn() -> every cloud ID the index refers to"""
+        self.list_blobs_fn = list_blobs_fn
+        self.list_objects_fn = list_objects_fn
+        self.cloud_ids_fn = cloud_ids_fn
+        self.workers = workers
+        self.block_size = block_size
+
+    def _hash(self, blob):
+        try:
+            md5, size = file_md5(blob['local_path'], self.block_size)
+            return {'md5': md5, 'size': size}
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            return {'error': str(e)}
+
+    def _hash_blobs(self, pool):
+        """Hash every local blob that has a remote copy; returns (blobs, {local_path: hash})"""
+        blobs, futures = [], {}
+        semaphore = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+        def hash_one(blob):
+            try:
+                return self._hash(blob)
+            finally:
+                semaphore.release()
+
+        after = None
+        while True:
+            page = self.list_blobs_fn(after, LIST_PAGE_SIZE)
+            if not page:
+                break
+            for blob in page:
+                blobs.append(blob)
+                # Blobs that were never replicated have nothing to be compared with
+                if blob['cloud_id']:
+                    semaphore.acquire()
+                    futures[blob['local_path']] = pool.submit(hash_one, blob)
+            after = page[-1]['local_path']
+        return blobs, {path: future.result() for path, future in futures.items()}
+
+    def run(self):
+        """Compare both tiers; returns (report, error)"""
+        started = time.perf_counter()
+        listing = {}
+
+        # The bulk listing runs alongside the local hashing
+        def list_objects():
+            listing['objects'], listing['error'] = self.list_objects_fn()
+
+        lister = threading.Thread(target=list_objects, name='reconcile-list', daemon=True)
+        lister.start()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reconcile-hash') as pool:
+            blobs, hashes = self._hash_blobs(pool)
+        lister.join()
+        if listing['error']:
+            return None, f"Could not list remote objects: {listing['error']}"
+
+        objects = {obj['id']: obj for obj in listing['objects']}
+        report = {category: [] for category in CATEGORIES}
+        report.update({'ok': 0, 'size_only': 0, 'pending': 0, 'errors': [],
+                       'local_blobs': len(blobs), 'remote_objects': len(objects), 'hashed_bytes': 0})
+
+        for blob in blobs:
+            entry = {'name': blob['name'], 'local_path': blob['local_path'], 'cloud_id': blob['cloud_id']}
+            if not blob['cloud_id']:
+                if not os.path.exists(blob['local_path']):
+                    report['lost'].append(entry)
+                elif blob['replication_state'] == metadata_store.STATE_PENDING:
+                    report['pending'] += 1
+                else:
+                    report['unreplicated'].append(dict(entry, replication_state=blob['replication_state']))
+                continue
+
+            local = hashes[blob['local_path']]
+            if local is not None and 'error' in local:
+                report['errors'].append(dict(entry, error=local['error']))
+                continue
+            if local is not None:
+                report['hashed_bytes'] += local['size']
+            obj = objects.get(blob['cloud_id'])
+            if obj is None:
+                report['lost' if local is None else 'missing_in_cloud'].append(entry)
+                continue
+            remote_size, remote_md5 = object_size(obj), obj.get('md5Checksum')
+            if local is None:
+                report['missing_locally'].append(dict(entry, remote_size=remote_size, remote_md5=remote_md5))
+            elif remote_size is not None and remote_size != local['size']:
+                report['divergent'].append(dict(entry, local_size=local['size'], remote_size=remote_size))
+            elif remote_md5 and remote_md5 != local['md5']:
+                report['divergent'].append(dict(entry, local_md5=local['md5'], remote_md5=remote_md5))
+            elif remote_md5:
+                report['ok'] += 1
+            else:
+                report['size_only'] += 1
+
+        referenced = self.cloud_ids_fn()
+        report['orphaned'] = [{'id': obj['id'], 'name': obj['name'], 'size': object_size(obj),
+                               'createdTime': obj.get('createdTime')}
+                              for obj in objects.values() if obj['id'] not in referenced]
+
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        report['bytes_per_second'] = round(report['hashed_bytes'] / report['seconds'], 1) \
+            if report['seconds'] else None
+        return report, None
+
+    @staticmethod
+    def repair(report, enqueue_fn, restore_fn=None, delete_fn=None, is_referenced_fn=None):
+        """Act on a report from run():
+
+        enqueue_fn(entry) queues a re-upload of a local blob; restore_fn(entry) -> error
+        copies a remote object back to its local path; delete_fn(cloud_id) -> error removes
+        an orphan, after is_referenced_fn(cloud_id) confirms nothing started using it since
+        the run. Returns counts of what was done and failed.
+        """
+        summary = {'queued': 0, 'restored': 0, 'deleted': 0, 'failed': 0, 'errors': []}
+
+        def failed(entry, error):
+            summary['failed'] += 1
+            summary['errors'].append({'name': entry['name'], 'error': error})
+            log.warning(f"Repair of {entry['name']} failed: {error}")
+
+        for entry in report['divergent'] + report['missing_in_cloud'] + report['unreplicated']:
+            try:
+                enqueue_fn(entry)
+                summary['queued'] += 1
+            except Exception as e:
+                failed(entry, str(e))
+
+        if restore_fn is not None:
+            for entry in report['missing_locally']:
+                error = restore_fn(entry)
+                if error:
+                    failed(entry, error)
+                else:
+                    summary['restored'] += 1
+
+        if delete_fn is not None:
+            for entry in report['orphaned']:
+                if is_referenced_fn is not None and is_referenced_fn(entry['id']):
+                    continue
+                error = delete_fn(entry['id'])
+                if error:
+                    failed(entry, error)
+                else:
+                    summary['deleted'] += 1
+        return summary
+
+
+def restore_blob(fetch_fn, entry, block_size=BLOCK_SIZE):
+    """Copy a remote object back to its local path, checking it against the listed size
+    and MD5 first; fetch_fn(cloud_id, dest_path) -> (size, error). Returns an error or None."""
+    local_path = entry['local_path']
+    tmp_path = f'{local_path}.{os.getpid()}.restore'
+    try:
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        _, error = fetch_fn(entry['cloud_id'], tmp_path)
+        if error:
+            return error
+        md5, size = file_md5(tmp_path, block_size)
+        if entry.get('remote_size') is not None and size != entry['remote_size']:
+            return f"Fetched {size} bytes, expected {entry['remote_size']}"
+        if entry.get('remote_md5') and md5 != entry['remote_md5']:
+            return "Fetched copy does not match the listed MD5"
+        os.replace(tmp_path, local_path)
+        return None
+    except Exception as e:
+        return str(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
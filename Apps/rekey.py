@@ -0,0 +1,225 @@
+"""
+Background re-encryption for SecureCloud key rotation
+
+After a new key is activated, new uploads use it straight away and this
+job moves existing blobs over in the background. Blobs are visited in
+blob ID order (the local path, or the cloud ID for blobs stored only in
+the cloud), in batches spread over a worker pool. Each batch is
+throttled to a byte rate so the job does not starve uploads and
+downloads. Progress is checkpointed to encrypted_files/.rekey/state.json
+after every batch, so a restart resumes where it left off. Every blob
+names its key in its header, so files not yet migrated keep being read
+with their old key.
+
+Like replication, only the process holding .rekey/owner.lock runs the
+job. Any process can report its progress from the state file, and any
+process can ask it to pause.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: the single server process runs the job
+    fcntl = None
+
+REKEY_DIRNAME = '.rekey'
+STATE_FILENAME = 'state.json'
+LOCK_FILENAME = 'owner.lock'
+PAUSE_FILENAME = 'pause'
+MAX_REPORTED_ERRORS = 100
+
+STATUS_RUNNING = 'running'
+STATUS_PAUSED = 'paused'
+STATUS_COMPLETED = 'completed'
+
+log = logging.getLogger('securecloud.rekey')
+
+
+class ReencryptionJob:
+    def __init__(self, folder, list_fn, migrate_fn, workers=2, batch_size=32, max_bytes_per_second=0):
+        """list_fn(after, limit) -> blobs (dicts with 'blob_id' and 'size') ordered by
+        blob_id, starting after the given ID; migrate_fn(blob, key_id) -> (migrated, error)
+        re-encrypts one blob, returning migrated=False if it already uses key_id.
+        max_bytes_per_second of 0 disables throttling."""
+        self.rekey_dir = os.path.join(folder, REKEY_DIRNAME)
+        self.state_path = os.path.join(self.rekey_dir, STATE_FILENAME)
+        self.pause_path = os.path.join(self.rekey_dir, PAUSE_FILENAME)
+        self.list_fn = list_fn
+        self.migrate_fn = migrate_fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_bytes_per_second = max_bytes_per_second
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lock_file = None
+
+    # Persistence
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"Unreadable re-encryption state: {str(e)}")
+            return None
+
+    def _write_state(self, state):
+        state['updated_at'] = time.time()
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    # Ownership across server processes
+    def _acquire(self):
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(self.rekey_dir, LOCK_FILENAME), 'a+')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _release(self):
+        if fcntl is not None and self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # Public API
+    def start(self, key_id):
+        """Start or resume moving every blob to key_id; returns (status, error)"""
+        os.makedirs(self.rekey_dir, exist_ok=True)
+        with self._lock:
+            state = self._read_state()
+            if self._thread is not None and self._thread.is_alive():
+                if state and state['key_id'] != key_id:
+                    return self.status(), f"Re-encryption to key {state['key_id']} is still running"
+                self._clear_pause()
+                return self.status(), None
+            if not self._acquire():
+                return self.status(), "Re-encryption is running in another process"
+
+            if state and state['key_id'] == key_id and state['status'] != STATUS_COMPLETED:
+                log.info(f"Resuming re-encryption to key {key_id} after {state['cursor']}")
+            else:
+                state = {
+                    'key_id': key_id,
+                    'status': STATUS_RUNNING,
+                    'cursor': None,
+                    'migrated': 0,
+                    'skipped': 0,
+                    'failed': 0,
+                    'bytes': 0,
+                    'errors': {},
+                    'started_at': time.time(),
+                    'finished_at': None,
+                }
+            state['status'] = STATUS_RUNNING
+            self._clear_pause()
+            self._write_state(state)
+            self._thread = threading.Thread(target=self._run, args=(state,), name='rekey', daemon=True)
+            self._thread.start()
+        return self.status(), None
+
+    def resume(self):
+        """Continue an interrupted run after a restart, if this process can own it"""
+        state = self._read_state()
+        if state and state['status'] == STATUS_RUNNING:
+            _, error = self.start(state['key_id'])
+            if error:
+                log.debug(f"Not resuming re-encryption here: {error}")
+
+    def pause(self):
+        """Ask the running job (in whichever process) to stop after its current batch"""
+        os.makedirs(self.rekey_dir, exist_ok=True)
+        state = self._read_state()
+        if state and state['status'] == STATUS_RUNNING:
+            open(self.pause_path, 'w').close()
+        return self.status()
+
+    def _clear_pause(self):
+        try:
+            os.remove(self.pause_path)
+        except FileNotFoundError:
+            pass
+
+    def status(self):
+        state = self._read_state() or {'status': None}
+        state['pause_requested'] = os.path.exists(self.pause_path)
+        state['running_here'] = self._thread is not None and self._thread.is_alive()
+        return state
+
+    # Worker
+    def _migrate(self, blob, key_id):
+        try:
+            return self.migrate_fn(blob, key_id)
+        except Exception as e:
+            return False, str(e)
+
+    def _throttle(self, batch_bytes, elapsed):
+        """Sleep long enough to keep the batch under max_bytes_per_second"""
+        if not self.max_bytes_per_second:
+            return
+        deadline = time.monotonic() + batch_bytes / self.max_bytes_per_second - elapsed
+        while not os.path.exists(self.pause_path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 1.0))
+
+    def _run(self, state):
+        key_id = state['key_id']
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rekey-worker')
+        try:
+            while True:
+                if os.path.exists(self.pause_path):
+                    self._clear_pause()
+                    state['status'] = STATUS_PAUSED
+                    self._write_state(state)
+                    log.info(f"Re-encryption to key {key_id} paused after {state['cursor']}")
+                    return
+
+                batch = self.list_fn(state['cursor'], self.batch_size)
+                if not batch:
+                    state['status'] = STATUS_COMPLETED
+                    state['finished_at'] = time.time()
+                    self._write_state(state)
+                    log.info(f"Re-encryption to key {key_id} finished: {state['migrated']} migrated, "
+                             f"{state['failed']} failed")
+                    return
+
+                started = time.monotonic()
+                outcomes = list(pool.map(lambda blob: self._migrate(blob, key_id), batch))
+                batch_bytes = 0
+                for blob, (migrated, error) in zip(batch, outcomes):
+                    if error:
+                        state['failed'] += 1
+                        if len(state['errors']) < MAX_REPORTED_ERRORS:
+                            state['errors'][blob['blob_id']] = error
+                        log.warning(f"Re-encryption of {blob['blob_id']} failed: {error}")
+                    elif migrated:
+                        state['migrated'] += 1
+                        state['bytes'] += blob['size'] or 0
+                        batch_bytes += blob['size'] or 0
+                    else:
+                        state['skipped'] += 1
+                # Checkpoint: a restart continues after the last finished batch
+                state['cursor'] = batch[-1]['blob_id']
+                self._write_state(state)
+                self._throttle(batch_bytes, time.monotonic() - started)
+        except Exception as e:
+            log.error(f"Re-encryption to key {key_id} stopped: {str(e)}")
+            state['last_error'] = str(e)
+            self._write_state(state)
+        finally:
+            pool.shutdown(wait=True)
+            self._release()
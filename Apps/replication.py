@@ -0,0 +1,293 @@
+"""
+Background cloud replication for SecureCloud
+
+Uploads return as soon as the encrypted file is on local disk; pushing
+the .enc blob to Google Drive happens here, on worker threads. Jobs are
+persisted as one JSON file each under encrypted_files/.replication/, so
+pending work survives a restart. Failed attempts are retried with
+exponential backoff; jobs that exhaust their attempts are moved to
+.replication/failed/ and reported by status().
+
+When several server processes share the folder, only the one holding
+the lock on .replication/owner.lock runs uploads. The others write
+their jobs to disk, where the owner picks them up on its next scan,
+and wait to take over if the owner exits.
+"""
+
+import os
+import json
+import time
+import uuid
+import heapq
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: the single server process owns the queue
+    fcntl = None
+
+QUEUE_DIRNAME = '.replication'
+LOCK_FILENAME = 'owner.lock'
+
+log = logging.getLogger('securecloud.replication')
+
+
+class ReplicationQueue:
+    def __init__(self, folder, upload_fn, on_complete, on_failure=None, workers=2,
+                 max_attempts=8, base_delay=2.0, max_delay=300.0, scan_interval=5.0):
+        """upload_fn(local_path, filename) -> (cloud_id, error);
+        on_complete(job, cloud_id) is called once the blob is on Drive and
+        on_failure(job) once a job has given up."""
+        self.queue_dir = os.path.join(folder, QUEUE_DIRNAME)
+        self.failed_dir = os.path.join(self.queue_dir, 'failed')
+        self.upload_fn = upload_fn
+        self.on_complete = on_complete
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.scan_interval = scan_interval
+
+        self._cond = threading.Condition()
+        self._heap = []        # (due_time, seq, job_id)
+        self._seq = 0
+        self._jobs = {}        # job_id -> job, queued or in flight
+        self._in_flight = {}   # job_id -> start time
+        self._threads = []
+        self._started = False
+        self._owner = False
+        self._lock_file = None
+        self._scanned_at = 0.0
+        self._stats = {'enqueued': 0, 'completed': 0, 'retries': 0, 'failed': 0}
+
+    # Persistence
+    def _job_path(self, job_id, failed=False):
+        return os.path.join(self.failed_dir if failed else self.queue_dir, job_id + '.json')
+
+    def _write_job(self, job, failed=False):
+        path = self._job_path(job['id'], failed)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _remove_job(self, job_id):
+        try:
+            os.remove(self._job_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _load_jobs(self):
+        """Schedule job files not yet known to this process"""
+        # Caller holds self._cond
+        self._scanned_at = time.time()
+        for name in os.listdir(self.queue_dir):
+            if not name.endswith('.json') or name[:-len('.json')] in self._jobs:
+                continue
+            try:
+                with open(os.path.join(self.queue_dir, name), 'r') as f:
+                    job = json.load(f)
+            except Exception as e:
+                log.warning(f"Skipping unreadable replication job {name}: {str(e)}")
+                continue
+            # Another process may have queued a file that is already pending here
+            pending = self._pending_job(job['filename'])
+            if pending:
+                pending['local_path'] = job['local_path']
+                self._write_job(pending)
+                self._remove_job(job['id'])
+                continue
+            self._schedule(job)
+
+    def _pending_job(self, filename):
+        for job in self._jobs.values():
+            if job['filename'] == filename and job['id'] not in self._in_flight:
+                return job
+        return None
+
+    def _schedule(self, job):
+        # Caller holds self._cond (or is single-threaded during start)
+        self._jobs[job['id']] = job
+        self._seq += 1
+        heapq.heappush(self._heap, (job['next_attempt_at'], self._seq, job['id']))
+
+    # Ownership across server processes
+    def _acquire_ownership(self, blocking):
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(self.queue_dir, LOCK_FILENAME), 'a+')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+
+    def _become_owner(self):
+        # Caller holds self._cond
+        self._owner = True
+        self._load_jobs()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'replication-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._cond.notify_all()
+
+    def _wait_for_ownership(self):
+        self._acquire_ownership(blocking=True)
+        with self._cond:
+            self._become_owner()
+        log.info(f"Replication queue taken over by process {os.getpid()}")
+
+    # Public API
+    def start(self):
+        """Load persisted jobs and start the worker threads (idempotent)
+
+        If another process already owns the queue, this process only
+        writes jobs to disk and waits in the background to take over.
+        """
+        with self._cond:
+            if self._started:
+                return
+            os.makedirs(self.failed_dir, exist_ok=True)
+            self._started = True
+            if self._acquire_ownership(blocking=False):
+                self._become_owner()
+            else:
+                threading.Thread(target=self._wait_for_ownership, name='replication-standby', daemon=True).start()
+
+    def enqueue(self, filename, local_path):
+        """Queue a local .enc file for upload to Drive, returning the job id"""
+        self.start()
+        with self._cond:
+            # A re-upload of a still-pending file is covered by the queued job
+            job = self._pending_job(filename)
+            if job:
+                if job['local_path'] != local_path:
+                    job['local_path'] = local_path
+                    self._write_job(job)
+                return job['id']
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'filename': filename,
+                'local_path': local_path,
+                'attempts': 0,
+                'created_at': time.time(),
+                'next_attempt_at': time.time(),
+                'last_error': None,
+            }
+            self._write_job(job)
+            self._stats['enqueued'] += 1
+            # Non-owners leave the job on disk for the owning process
+            if self._owner:
+                self._schedule(job)
+                self._cond.notify()
+            return job['id']
+
+    def status(self):
+        """Snapshot of queue depth, in-flight jobs and failures"""
+        with self._cond:
+            failed = []
+            if os.path.isdir(self.failed_dir):
+                for name in sorted(os.listdir(self.failed_dir)):
+                    try:
+                        with open(os.path.join(self.failed_dir, name), 'r') as f:
+                            job = json.load(f)
+                        failed.append({k: job.get(k) for k in ('id', 'filename', 'attempts', 'last_error')})
+                    except Exception:
+                        continue
+            now = time.time()
+            if self._owner:
+                queue_depth = len(self._jobs) - len(self._in_flight)
+            else:
+                queue_depth = sum(1 for name in os.listdir(self.queue_dir) if name.endswith('.json')) \
+                    if os.path.isdir(self.queue_dir) else 0
+            return {
+                'running': self._started,
+                'owner': self._owner,
+                'workers': self.workers,
+                'queue_depth': queue_depth,
+                'in_flight': [
+                    {'id': job_id, 'filename': self._jobs[job_id]['filename'],
+                     'seconds': round(now - started, 3)}
+                    for job_id, started in self._in_flight.items()
+                ],
+                'retrying': [
+                    {'id': job['id'], 'filename': job['filename'], 'attempts': job['attempts'],
+                     'next_attempt_in': round(max(job['next_attempt_at'] - now, 0), 3),
+                     'last_error': job['last_error']}
+                    for job in self._jobs.values()
+                    if job['attempts'] and job['id'] not in self._in_flight
+                ],
+                'failed': failed,
+                'stats': dict(self._stats),
+            }
+
+    # Workers
+    def _next_job(self):
+        with self._cond:
+            while True:
+                # Pick up jobs queued by other server processes
+                if time.time() - self._scanned_at >= self.scan_interval:
+                    self._load_jobs()
+                if self._heap:
+                    due, _, job_id = self._heap[0]
+                    wait = due - time.time()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        if job_id not in self._jobs:
+                            continue
+                        self._in_flight[job_id] = time.time()
+                        return self._jobs[job_id]
+                    self._cond.wait(min(wait, self.scan_interval))
+                else:
+                    self._cond.wait(self.scan_interval)
+
+    def _backoff(self, attempts):
+        return min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            permanent = False
+            try:
+                if not os.path.exists(job['local_path']):
+                    cloud_id, error = None, 'Local file no longer exists'
+                    permanent = True
+                else:
+                    cloud_id, error = self.upload_fn(job['local_path'], job['filename'])
+                if cloud_id:
+                    self.on_complete(job, cloud_id)
+            except Exception as e:
+                cloud_id, error = None, str(e)
+
+            with self._cond:
+                del self._in_flight[job['id']]
+                if cloud_id:
+                    del self._jobs[job['id']]
+                    self._remove_job(job['id'])
+                    self._stats['completed'] += 1
+                    continue
+
+                job['attempts'] += 1
+                job['last_error'] = error
+                if permanent or job['attempts'] >= self.max_attempts:
+                    del self._jobs[job['id']]
+                    self._write_job(job, failed=True)
+                    self._remove_job(job['id'])
+                    self._stats['failed'] += 1
+                    log.warning(f"Replication of {job['filename']} failed permanently: {error}")
+                    if self.on_failure:
+                        try:
+                            self.on_failure(job)
+                        except Exception as e:
+                            log.error(f"Replication failure hook raised: {str(e)}")
+                else:
+                    job['next_attempt_at'] = time.time() + self._backoff(job['attempts'])
+                    self._write_job(job)
+                    self._schedule(job)
+                    self._stats['retries'] += 1
+                self._cond.notify()
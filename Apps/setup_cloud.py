@@ -6,8 +6,6 @@ This script helps you configure Google Drive API for cloud storage
 
 import os
 import json
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import pickle
 
 # Google Drive API setup
@@ -36,6 +34,9 @@ def setup_google_drive():
     print("✅ Found credentials.json")
     
     try:
+        # Imported here so the checks above run without loading the Google client libraries
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         # Create flow with specific redirect URI
         print("OAuth redirect URI used: http://localhost:8081")
         flow = InstalledAppFlow.from_client_secrets_file(
@@ -0,0 +1,476 @@
+"""
+Pluggable storage backends for SecureCloud
+
+Encrypted blobs live in two tiers. The hot tier is local disk: every
+upload is encrypted straight into it and every download is decrypted
+from it. The replica tier is where uploads are copied in the background
+and where cloud-only blobs are fetched back from. Both tiers implement
+the same interface:
+
+    put(name, stream)           -> (object_id, error)   streamed from a readable file
+    put_file(name, path)        -> (object_id, error)
+    get(object_id, start, end)  -> (chunks, error)      inclusive byte range, streamed
+    fetch(object_id, dest_path) -> (size, error)        whole object into a local file
+    list(prefix)                -> (objects, error)     dicts with id, name, size, createdTime
+                                                        and md5Checksum where the store has one
+    delete(object_id)           -> error
+    status()
+
+Backends:
+- LocalBackend: one or more directories ("volumes"), e.g. one per
+  disk; new objects go to the volume with the most free space
+- DriveBackend: Google Drive, through the resumable upload and parallel
+  ranged download functions in File_transfer.py
+- S3Backend: any S3-compatible object store (AWS S3, MinIO), using
+  boto3 multipart uploads and concurrent ranged downloads
+
+Object names are the .enc file names shown by /files. Drive assigns
+its own file IDs. LocalBackend and S3Backend use the name behind a
+random prefix (new_object_id), so two uploads under one name never
+overwrite each other.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import contextlib
+
+import metrics
+
+READ_CHUNK_SIZE = 1024 * 1024
+OBJECT_ID_PREFIX_LENGTH = 33  # uuid4 hex and a dash
+
+
+def new_object_id(name):
+    """Unique, filesystem-safe object ID that keeps the name readable"""
+    return f'{uuid.uuid4().hex}-{name}'
+
+
+def object_name(object_id):
+    """Name part of an ID made by new_object_id (other IDs are returned unchanged)"""
+    if len(object_id) > OBJECT_ID_PREFIX_LENGTH and object_id[OBJECT_ID_PREFIX_LENGTH - 1] == '-':
+        return object_id[OBJECT_ID_PREFIX_LENGTH:]
+    return object_id
+
+
+def format_time(timestamp):
+    """Epoch seconds as an RFC 3339 UTC timestamp, like Drive's createdTime"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+class StorageBackend:
+    """Base class; subclasses implement put, get, fetch, list and delete"""
+    name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'puts': 0, 'gets': 0, 'fetches': 0, 'deletes': 0, 'errors': 0,
+                       'bytes_in': 0, 'bytes_out': 0}
+
+    def _count(self, operation, size=0, error=None):
+        with self._lock:
+            if error:
+                self._stats['errors'] += 1
+                return
+            self._stats[operation] += 1
+            if operation == 'puts':
+                self._stats['bytes_in'] += size or 0
+            elif operation in ('gets', 'fetches'):
+                self._stats['bytes_out'] += size or 0
+
+    def put(self, name, stream):
+        raise NotImplementedError
+
+    def put_file(self, name, path):
+        with open(path, 'rb') as f:
+            return self.put(name, f)
+
+    def get(self, object_id, start=0, end=None):
+        raise NotImplementedError
+
+    def fetch(self, object_id, dest_path):
+        """Default: stream get() into dest_path"""
+        chunks, error = self.get(object_id)
+        if error:
+            return None, error
+        size = 0
+        try:
+            with open(dest_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception as e:
+            return None, str(e)
+        return size, None
+
+    def list(self, prefix=None):
+        raise NotImplementedError
+
+    def delete(self, object_id):
+        raise NotImplementedError
+
+    def status(self):
+        with self._lock:
+            return {'backend': self.name, 'stats': dict(self._stats)}
+
+
+class LocalBackend(StorageBackend):
+    name = 'local'
+
+    def __init__(self, volumes):
+        """volumes: directories to spread objects over (at least one)"""
+        super().__init__()
+        if not volumes:
+            raise ValueError("LocalBackend needs at least one volume")
+        self.volumes = list(volumes)
+
+    def ensure_volumes(self):
+        for volume in self.volumes:
+            os.makedirs(volume, exist_ok=True)
+
+    def pick_volume(self):
+        """Volume for a new object: the one with the most free space"""
+        if len(self.volumes) == 1:
+            return self.volumes[0]
+        return max(self.volumes, key=lambda volume: shutil.disk_usage(volume).free)
+
+    def new_partial(self, near=None):
+        """Create a .part file (on the same volume as near, if given); returns (fd, path)"""
+        volume = os.path.dirname(near) if near else self.pick_volume()
+        fd, path = tempfile.mkstemp(dir=volume, suffix='.part')
+        # mkstemp returns an absolute path; keep paths relative to the volume as configured
+        return fd, os.path.join(volume, os.path.basename(path))
+
+    def commit(self, partial_path, object_id):
+        """Atomically move a finished .part file into place on its volume; returns the path"""
+        path = os.path.join(os.path.dirname(partial_path), object_id)
+        os.replace(partial_path, path)
+        return path
+
+    def hold(self, path):
+        """Hard-link a blob under a new .part name on its volume, so its data
+        outlives the original path; returns the link, or None if the blob is gone"""
+        link_path = os.path.join(os.path.dirname(path), new_object_id(os.path.basename(path)) + '.part')
+        try:
+            os.link(path, link_path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            # Volumes without hard links get a copy
+            try:
+                shutil.copyfile(path, link_path)
+            except FileNotFoundError:
+                return None
+        return link_path
+
+    def path(self, object_id):
+        """Path of an object on whichever volume holds it, or None"""
+        for volume in self.volumes:
+            path = os.path.join(volume, object_id)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def open_path(self, path):
+        """Open a blob by its recorded path; returns (file, size), or (None, 0) if it is gone"""
+        if not path:
+            return None, 0
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None, 0
+        return f, os.fstat(f.fileno()).st_size
+
+    def put(self, name, stream):
+        object_id = new_object_id(name)
+        fd, partial_path = self.new_partial()
+        started = time.perf_counter()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, READ_CHUNK_SIZE)
+                size = f.tell()
+            self.commit(partial_path, object_id)
+        except Exception as e:
+            self._count('puts', error=e)
+            return None, str(e)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage('storage_upload', elapsed)
+        metrics.record_transfer('cloud_upload', size, elapsed)
+        self._count('puts', size)
+        return object_id, None
+
+    def get(self, object_id, start=0, end=None):
+        path = self.path(object_id)
+        if path is None:
+            return None, "Object not found"
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        if end is None or end >= size:
+            end = size - 1
+        self._count('gets', max(end - start + 1, 0))
+        return self._iter_range(f, start, end), None
+
+    @staticmethod
+    def _iter_range(f, start, end):
+        with f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def fetch(self, object_id, dest_path):
+        path = self.path(object_id)
+        if path is None:
+            return None, "Object not found"
+        started = time.perf_counter()
+        try:
+            shutil.copyfile(path, dest_path)
+        except Exception as e:
+            self._count('fetches', error=e)
+            return None, str(e)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(dest_path)
+        metrics.observe_stage('storage_download', elapsed)
+        metrics.record_transfer('cloud_download', size, elapsed)
+        self._count('fetches', size)
+        return size, None
+
+    def list(self, prefix=None):
+        objects = []
+        try:
+            for volume in self.volumes:
+                if not os.path.isdir(volume):
+                    continue
+                for entry in os.scandir(volume):
+                    if not entry.is_file():
+                        continue
+                    name = object_name(entry.name)
+                    if not name.endswith('.enc') or (prefix and not name.startswith(prefix)):
+                        continue
+                    stat = entry.stat()
+                    objects.append({'id': entry.name, 'name': name, 'size': stat.st_size,
+                                    'createdTime': format_time(stat.st_mtime)})
+        except Exception as e:
+            return [], str(e)
+        return objects, None
+
+    def delete(self, object_id):
+        path = self.path(object_id)
+        if path is None:
+            return None
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            return str(e)
+        self._count('deletes')
+        return None
+
+    def status(self):
+        status = super().status()
+        status['volumes'] = []
+        for volume in self.volumes:
+            try:
+                usage = shutil.disk_usage(volume)
+                status['volumes'].append({'path': volume, 'free_bytes': usage.free, 'total_bytes': usage.total})
+            except OSError as e:
+                status['volumes'].append({'path': volume, 'error': str(e)})
+        return status
+
+
+class DriveBackend(StorageBackend):
+    name = 'drive'
+
+    def __init__(self, upload_fn, fetch_fn, range_fn, list_fn, delete_fn, limiter=None):
+        """upload_fn(path, name) -> (file_id, error) runs a resumable upload from disk;
+        fetch_fn(file_id, dest_path) -> (size, error) downloads with parallel ranges;
+        range_fn(file_id, start, end) -> (chunks, error); list_fn(prefix) -> (files, error);
+        delete_fn(file_id) -> error. Every call runs inside limiter (a context manager
+        capping concurrent Drive calls), if one is given."""
+        super().__init__()
+        self.upload_fn = upload_fn
+        self.fetch_fn = fetch_fn
+        self.range_fn = range_fn
+        self.list_fn = list_fn
+        self.delete_fn = delete_fn
+        self.limiter = limiter
+
+    def _slot(self):
+        return self.limiter if self.limiter is not None else contextlib.nullcontext()
+
+    def put(self, name, stream):
+        # Resumable sessions are resumed from a file on disk
+        with tempfile.NamedTemporaryFile(suffix='.part') as spool:
+            shutil.copyfileobj(stream, spool, READ_CHUNK_SIZE)
+            spool.flush()
+            return self.put_file(name, spool.name)
+
+    def put_file(self, name, path):
+        with self._slot():
+            file_id, error = self.upload_fn(path, name)
+        self._count('puts', os.path.getsize(path), error)
+        return file_id, error
+
+    def get(self, object_id, start=0, end=None):
+        # The slot covers the metadata lookup; the ranges are read as the caller iterates
+        with self._slot():
+            chunks, error = self.range_fn(object_id, start, end)
+        self._count('gets', error=error)
+        return chunks, error
+
+    def fetch(self, object_id, dest_path):
+        with self._slot():
+            size, error = self.fetch_fn(object_id, dest_path)
+        self._count('fetches', size, error)
+        return size, error
+
+    def list(self, prefix=None):
+        with self._slot():
+            return self.list_fn(prefix)
+
+    def delete(self, object_id):
+        with self._slot():
+            error = self.delete_fn(object_id)
+        self._count('deletes', error=error)
+        return error
+
+
+class S3Backend(StorageBackend):
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 part_size=8 * 1024 * 1024, workers=4):
+        """endpoint_url points at an S3-compatible server such as MinIO;
+        credentials come from the usual AWS environment variables or files"""
+        # boto3 is optional and slow to import, so only S3 setups load it
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise ValueError("S3 storage requested but the boto3 package is not installed")
+        if not bucket:
+            raise ValueError("S3 storage needs a bucket (SECURECLOUD_S3_BUCKET)")
+        super().__init__()
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.boto3 = boto3
+        # Multipart uploads and downloads move part_size pieces on several threads
+        self.transfer_config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                              max_concurrency=workers, io_chunksize=READ_CHUNK_SIZE)
+        self._client = None
+        self._client_pid = None
+
+    def client(self):
+        """Shared boto3 client, rebuilt in forked server workers"""
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    self._client = self.boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region)
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def _key(self, object_id):
+        return self.prefix + object_id
+
+    def put(self, name, stream):
+        object_id = new_object_id(name)
+        counter = _ByteCounter(stream)
+        started = time.perf_counter()
+        try:
+            with metrics.TRANSFERS_IN_FLIGHT.track(operation='cloud_upload'):
+                self.client().upload_fileobj(counter, self.bucket, self._key(object_id),
+                                             Config=self.transfer_config)
+        except Exception as e:
+            self._count('puts', error=e)
+            return None, str(e)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage('storage_upload', elapsed)
+        metrics.record_transfer('cloud_upload', counter.size, elapsed)
+        self._count('puts', counter.size)
+        return object_id, None
+
+    def get(self, object_id, start=0, end=None):
+        byte_range = f'bytes={start}-' + (str(end) if end is not None else '')
+        try:
+            response = self.client().get_object(Bucket=self.bucket, Key=self._key(object_id), Range=byte_range)
+        except Exception as e:
+            self._count('gets', error=e)
+            return None, str(e)
+        self._count('gets', response['ContentLength'])
+        return response['Body'].iter_chunks(READ_CHUNK_SIZE), None
+
+    def fetch(self, object_id, dest_path):
+        started = time.perf_counter()
+        try:
+            with metrics.TRANSFERS_IN_FLIGHT.track(operation='cloud_download'):
+                self.client().download_file(self.bucket, self._key(object_id), dest_path,
+                                            Config=self.transfer_config)
+        except Exception as e:
+            self._count('fetches', error=e)
+            return None, str(e)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(dest_path)
+        metrics.observe_stage('storage_download', elapsed)
+        metrics.record_transfer('cloud_download', size, elapsed)
+        self._count('fetches', size)
+        return size, None
+
+    def list(self, prefix=None):
+        objects = []
+        try:
+            paginator = self.client().get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                for item in page.get('Contents', []):
+                    object_id = item['Key'][len(self.prefix):]
+                    name = object_name(object_id)
+                    if not name.endswith('.enc') or (prefix and not name.startswith(prefix)):
+                        continue
+                    obj = {'id': object_id, 'name': name, 'size': item['Size'],
+                           'createdTime': format_time(item['LastModified'].timestamp())}
+                    # The ETag is the MD5 of the object unless it was a multipart upload
+                    etag = item.get('ETag', '').strip('"')
+                    if etag and '-' not in etag:
+                        obj['md5Checksum'] = etag
+                    objects.append(obj)
+        except Exception as e:
+            return [], str(e)
+        return objects, None
+
+    def delete(self, object_id):
+        try:
+            self.client().delete_object(Bucket=self.bucket, Key=self._key(object_id))
+        except Exception as e:
+            self._count('deletes', error=e)
+            return str(e)
+        self._count('deletes')
+        return None
+
+    def status(self):
+        status = super().status()
+        status.update(bucket=self.bucket, prefix=self.prefix, endpoint=self.endpoint_url)
+        return status
+
+
+class _ByteCounter:
+    """Readable wrapper totalling the bytes read from a stream"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        return data
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import unittest
+
+import admission
+
+
+class UnknownLengthTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = admission.AdmissionController(
+            route_max_bytes={'upload_file': 1000}, default_max_bytes=10,
+            budget=admission.ByteBudget(300), clients=admission.ClientLimits(bytes_per_second=100),
+            limited_routes=('upload_file',), upload_routes=('upload_file',), unknown_length_reserve=50)
+
+    def test_chunked_upload_does_not_lock_out_others(self):
+        chunked = self.controller.admit('upload_file', 'a', None)
+        self.assertEqual(chunked.size, 50)
+        # A second upload fits next to the bounded reservation
+        other = self.controller.admit('upload_file', 'b', 100)
+        self.controller.release(other)
+
+    def test_reservation_grows_as_bytes_arrive(self):
+        chunked = self.controller.admit('upload_file', 'a', None)
+        for _ in range(5):
+            chunked.received(40)
+        self.assertEqual(self.controller.budget.in_flight, 200)
+        with self.assertRaises(admission.Rejected) as rejected:
+            self.controller.admit('upload_file', 'b', 150)
+        self.assertEqual(rejected.exception.status, 503)
+
+        # Releasing returns the grown reservation and charges the client's bandwidth
+        self.controller.release(chunked)
+        self.assertEqual(self.controller.budget.in_flight, 0)
+        with self.assertRaises(admission.Rejected) as rejected:
+            self.controller.admit('upload_file', 'a', 10)
+        self.assertEqual(rejected.exception.reason, 'bandwidth')
+
+    def test_busy_rejection_does_not_charge_the_client(self):
+        held = self.controller.admit('upload_file', 'a', 250)
+        with self.assertRaises(admission.Rejected) as rejected:
+            self.controller.admit('upload_file', 'b', 100)
+        self.assertEqual(rejected.exception.reason, 'byte_budget')
+        self.controller.release(held)
+        # The retry is admitted instead of paying for the body it never sent
+        self.controller.release(self.controller.admit('upload_file', 'b', 100))
+
+    def test_rate_rejection_returns_the_reservation(self):
+        self.controller.admit('upload_file', 'a', 250)
+        self.controller.release(self.controller.admit('upload_file', 'b', 0))
+        with self.assertRaises(admission.Rejected) as rejected:
+            self.controller.admit('upload_file', 'a', 10)
+        self.assertEqual(rejected.exception.reason, 'bandwidth')
+        self.assertEqual(self.controller.budget.in_flight, 250)
+
+    def test_reserve_is_capped_at_the_route_limit(self):
+        self.controller.unknown_length_reserve = 5000
+        self.assertEqual(self.controller.admit('upload_file', 'a', None).size, 1000)
+
+    def test_other_routes_hold_nothing(self):
+        self.assertIsNone(self.controller.admit('list_files', 'a', None))
+        self.controller.release(None)
+
+
+class AsyncAcquireTest(unittest.TestCase):
+    def test_waits_on_the_loop_until_a_thread_releases(self):
+        limit = admission.ConcurrencyLimit(1, max_queue=4)
+        limit.acquire()
+
+        async def waiter():
+            ticks = 0
+            task = asyncio.ensure_future(limit.acquire_async(poll_interval=0.001))
+            # The loop stays free for other work while the coroutine waits
+            while not task.done():
+                ticks += 1
+                if ticks == 5:
+                    threading.Thread(target=limit.release).start()
+                await asyncio.sleep(0.001)
+            await task
+            return ticks
+
+        self.assertGreaterEqual(asyncio.run(waiter()), 5)
+        status = limit.status()
+        self.assertEqual((status['active'], status['waiting'], status['queued']), (1, 0, 1))
+        limit.release()
+
+    def test_cancelled_waiter_leaves_no_trace(self):
+        limit = admission.ConcurrencyLimit(1, max_queue=4)
+        limit.acquire()
+
+        async def cancel():
+            task = asyncio.ensure_future(limit.acquire_async(poll_interval=0.001))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        limit.release()
+        status = limit.status()
+        self.assertEqual((status['active'], status['waiting']), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
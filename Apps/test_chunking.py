@@ -0,0 +1,82 @@
+import io
+import hmac
+import time
+import random
+import hashlib
+import unittest
+
+import chunking
+
+KEY = b'k' * 32
+CHUNK_SIZE = 16 * 1024
+# Chunking throughput below this fails the test; delta sync is opt-in
+# (SECURECLOUD_DELTA_MIN_SIZE) because even the normal rate is slow
+MIN_MB_PER_SECOND = 2
+
+
+def chunk_ids(data):
+    return [hmac.new(KEY, chunk, hashlib.sha256).hexdigest()
+            for chunk in chunking.iter_chunks(io.BytesIO(data), KEY, CHUNK_SIZE, read_size=64 * 1024)]
+
+
+def log_lines(size):
+    rnd = random.Random(1)
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(f'2024-03-01T12:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}Z INFO worker-{rnd.randint(1, 8)} '
+                     f'GET /api/items/{rnd.randint(1, 99999)} status=200 took={rnd.randint(1, 900)}ms\n')
+    return ''.join(lines).encode()
+
+
+def csv_rows(size):
+    rnd = random.Random(2)
+    rows = ['id,customer,amount,date\n']
+    while sum(map(len, rows)) < size:
+        rows.append(f'{len(rows)},customer_{rnd.randint(1, 500)},{rnd.randint(0, 100000) / 100:.2f},'
+                    f'2023-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}\n')
+    return ''.join(rows).encode()
+
+
+class ChunkingTest(unittest.TestCase):
+    def assert_mostly_reused(self, data):
+        before = chunk_ids(data)
+        middle = len(data) // 2
+        for inserted in (b'X', b'a new line\n'):
+            after = chunk_ids(data[:middle] + inserted + data[middle:])
+            reused = len(set(after) & set(before))
+            # Only the chunks around the insertion may change
+            self.assertGreaterEqual(reused, len(after) - 2, inserted)
+            self.assertGreater(len(after), 20)
+
+    def test_insert_into_log(self):
+        self.assert_mostly_reused(log_lines(600 * 1024))
+
+    def test_insert_into_csv(self):
+        self.assert_mostly_reused(csv_rows(600 * 1024))
+
+    def test_chunks_reassemble(self):
+        data = csv_rows(300 * 1024) + bytes(100 * 1024) + random.Random(3).randbytes(101 * 1024 + 1)
+        chunks = list(chunking.iter_chunks(io.BytesIO(data), KEY, CHUNK_SIZE, read_size=64 * 1024))
+        self.assertEqual(b''.join(chunks), data)
+        min_size, _, max_size, _, _ = chunking.chunk_limits(CHUNK_SIZE)
+        self.assertTrue(all(len(chunk) <= max_size for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= min_size for chunk in chunks[:-1]))
+
+    def test_boundaries_depend_on_key(self):
+        data = log_lines(300 * 1024)
+        sizes = [len(chunk) for chunk in chunking.iter_chunks(io.BytesIO(data), KEY, CHUNK_SIZE)]
+        other = [len(chunk) for chunk in chunking.iter_chunks(io.BytesIO(data), b'o' * 32, CHUNK_SIZE)]
+        self.assertNotEqual(sizes, other)
+
+    def test_throughput(self):
+        # The two-bytes-per-iteration loop runs at 5-20 MB/s
+        data = random.Random(4).randbytes(8 * 1024 * 1024)
+        started = time.perf_counter()
+        for _ in chunking.iter_chunks(io.BytesIO(data), KEY):
+            pass
+        rate = len(data) / (time.perf_counter() - started) / 1e6
+        self.assertGreater(rate, MIN_MB_PER_SECOND, f'{rate:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    unittest.main()
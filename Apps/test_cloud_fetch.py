@@ -0,0 +1,97 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+import httpx
+
+import cloud_fetch
+
+DATA = bytes(range(256)) * 400
+PART_SIZE = 16 * 1024
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeHttp:
+    """An httplib2-style connection to a server that may ignore Range"""
+    def __init__(self, honour_ranges):
+        self.honour_ranges = honour_ranges
+        self.requests = []
+
+    def request(self, uri, method, headers=None):
+        ranged = bool(headers and 'Range' in headers)
+        self.requests.append(ranged)
+        if ranged and self.honour_ranges:
+            start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+            return FakeResponse(206), DATA[start:end + 1]
+        return FakeResponse(200), DATA
+
+
+def async_client(honour_ranges, requests):
+    def handle(request):
+        ranged = 'range' in request.headers
+        requests.append(ranged)
+        if ranged and honour_ranges:
+            start, end = map(int, request.headers['range'][len('bytes='):].split('-'))
+            return httpx.Response(206, content=DATA[start:end + 1])
+        return httpx.Response(200, content=DATA)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+
+class RangeFallbackTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.dest = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.dest)
+
+    def downloaded(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_ignored_range_is_fetched_once(self):
+        http = FakeHttp(honour_ranges=False)
+        downloader = cloud_fetch.RangedDownloader(lambda: http, part_size=PART_SIZE, base_delay=0)
+        self.assertEqual(downloader.download('uri', len(DATA), self.dest), (len(DATA), None))
+        self.assertEqual(self.downloaded(), DATA)
+        self.assertEqual(http.requests, [True])
+        # Later downloads skip the Range request altogether
+        downloader.download('uri', len(DATA), self.dest)
+        self.assertEqual(http.requests, [True, False])
+        self.assertEqual(b''.join(downloader.iter_range('uri', 100, 50000, len(DATA))), DATA[100:50001])
+
+    def test_honoured_range_is_fetched_in_parts(self):
+        http = FakeHttp(honour_ranges=True)
+        downloader = cloud_fetch.RangedDownloader(lambda: http, part_size=PART_SIZE, base_delay=0)
+        self.assertEqual(downloader.download('uri', len(DATA), self.dest), (len(DATA), None))
+        self.assertEqual(self.downloaded(), DATA)
+        self.assertEqual(len(http.requests), -(-len(DATA) // PART_SIZE))
+        self.assertTrue(downloader.ranges_supported)
+
+    def test_iter_range_stops_at_first_whole_response(self):
+        http = FakeHttp(honour_ranges=False)
+        downloader = cloud_fetch.RangedDownloader(lambda: http, part_size=PART_SIZE, base_delay=0)
+        self.assertEqual(b''.join(downloader.iter_range('uri', 10, 60000, len(DATA))), DATA[10:60001])
+        self.assertEqual(http.requests, [True])
+
+    def test_async_ignored_range_is_streamed_once(self):
+        async def run():
+            for honour_ranges in (False, True):
+                requests = []
+                downloader = cloud_fetch.AsyncRangedDownloader(part_size=PART_SIZE, base_delay=0)
+                async with async_client(honour_ranges, requests) as client:
+                    result = await downloader.download(client, 'http://drive/file', len(DATA), self.dest)
+                self.assertEqual(result, (len(DATA), None))
+                self.assertEqual(self.downloaded(), DATA)
+                expected = -(-len(DATA) // PART_SIZE) if honour_ranges else 1
+                self.assertEqual(len(requests), expected)
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import io
+import os
+import tempfile
+import unittest
+
+from Crypto.Cipher import AES
+
+import container
+import File_transfer
+
+KEY = b'0123456789abcdef'
+SEGMENT_SIZE = 64
+
+
+def seal(data, compression='none', cipher='eax', key_id=0):
+    return container.encrypt_bytes(data, KEY, SEGMENT_SIZE, compression, cipher, key_id)
+
+
+class RoundTripTest(unittest.TestCase):
+    # Version, encrypt_bytes options and the codec the header should name
+    CASES = [
+        (2, dict(compression='none'), container.CODEC_NONE),
+        (3, dict(compression='zlib'), container.CODEC_ZLIB),
+        (4, dict(compression='none', cipher='gcm'), container.CODEC_NONE),
+        (4, dict(compression='zlib', cipher='chacha20-poly1305'), container.CODEC_ZLIB),
+        (5, dict(compression='none', cipher='eax', key_id=7), container.CODEC_NONE),
+        (5, dict(compression='zlib', cipher='gcm', key_id=7), container.CODEC_ZLIB),
+    ]
+    # Empty, one partial segment, an exact multiple of the segment size and a partial tail
+    SIZES = [0, 10, SEGMENT_SIZE * 3, SEGMENT_SIZE * 3 + 17]
+
+    def test_each_version(self):
+        for version, options, codec in self.CASES:
+            for size in self.SIZES:
+                with self.subTest(version=version, options=options, size=size):
+                    data = (b'segment data ' * 40)[:size]
+                    blob = seal(data, **options)
+                    header = container.parse_header(blob)
+                    self.assertEqual(header.version, version)
+                    self.assertEqual(header.codec, codec)
+                    self.assertEqual(header.key_id, options.get('key_id', 0))
+                    self.assertEqual(container.blob_key_id(io.BytesIO(blob)), header.key_id)
+                    self.assertEqual(container.decrypt_bytes(blob, KEY), data)
+                    self.assertEqual(File_transfer.decrypt_file(blob, KEY), data)
+
+    def test_ranges(self):
+        data = os.urandom(SEGMENT_SIZE * 4 + 5)
+        for _, options, _ in self.CASES:
+            blob = seal(data, **options)
+            reader = container.open_reader(io.BytesIO(blob), len(blob))
+            self.assertEqual(reader.plaintext_size, len(data))
+            for start, end in [(0, 0), (SEGMENT_SIZE - 1, SEGMENT_SIZE), (70, 200), (250, None)]:
+                with self.subTest(options=options, start=start, end=end):
+                    expected = data[start:None if end is None else end + 1]
+                    self.assertEqual(b''.join(reader.iter_decrypt(KEY, start, end)), expected)
+
+    def test_wrong_key(self):
+        for _, options, _ in self.CASES:
+            with self.subTest(options=options):
+                with self.assertRaises(ValueError):
+                    container.decrypt_bytes(seal(b'secret', **options), b'fedcba9876543210')
+
+
+class TamperTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(SEGMENT_SIZE * 3 + 10)
+
+    def assertRejected(self, blob):
+        with self.assertRaises(ValueError):
+            container.decrypt_bytes(bytes(blob), KEY)
+
+    def segments(self, blob):
+        """Split a fixed-stride container into its header and sealed segments"""
+        header = container.parse_header(blob)
+        stride = header.segment_size + header.overhead
+        body = blob[header.size:]
+        return blob[:header.size], [body[i:i + stride] for i in range(0, len(body), stride)]
+
+    def test_header(self):
+        for options in [dict(), dict(compression='zlib'), dict(cipher='gcm'), dict(key_id=7)]:
+            blob = bytearray(seal(self.data, **options))
+            # Flags are not interpreted on read, so only the authentication catches the change
+            blob[5] ^= 1
+            with self.subTest(options=options):
+                self.assertRejected(blob)
+
+    def test_key_id(self):
+        blob = bytearray(seal(self.data, key_id=7))
+        # The key ID is the last header field
+        blob[container.parse_header(bytes(blob)).size - 1] ^= 1
+        self.assertRejected(blob)
+
+    def test_swapped_segments(self):
+        for cipher in ['eax', 'gcm', 'chacha20-poly1305']:
+            header, segments = self.segments(seal(self.data, cipher=cipher))
+            segments[0], segments[1] = segments[1], segments[0]
+            with self.subTest(cipher=cipher):
+                self.assertRejected(header + b''.join(segments))
+
+    def test_swapped_index_entries(self):
+        data = b'compressible ' * 40
+        blob = bytearray(seal(data, compression='zlib'))
+        reader = container.open_reader(io.BytesIO(bytes(blob)), len(blob))
+        index_offset = reader.offsets[-1]
+        first, second = blob[index_offset:index_offset + 8], blob[index_offset + 8:index_offset + 16]
+        blob[index_offset:index_offset + 16] = second + first
+        self.assertRejected(blob)
+
+    def test_dropped_last_segment(self):
+        # The segment that is now last was sealed without the last-segment flag
+        header, segments = self.segments(seal(self.data))
+        self.assertRejected(header + b''.join(segments[:-1]))
+
+    def test_appended_segment(self):
+        # The real last segment carries the flag, so nothing may follow it
+        header, segments = self.segments(seal(self.data))
+        self.assertRejected(header + b''.join(segments + segments[1:2]))
+
+    def test_ciphertext(self):
+        for options in [dict(), dict(compression='zlib'), dict(cipher='chacha20-poly1305')]:
+            blob = bytearray(seal(self.data if not options.get('compression') else b'text ' * 80, **options))
+            blob[container.parse_header(bytes(blob)).size + 40] ^= 0x80
+            with self.subTest(options=options):
+                self.assertRejected(blob)
+
+    def test_plaintext_size_in_trailer(self):
+        data = b'compressible ' * 40
+        blob = bytearray(seal(data, compression='zlib'))
+        # Trailer: index_offset (8) | segment_count (8) | plaintext_size (8) | MAGIC (4)
+        size_offset = len(blob) - container.TRAILER_SIZE + 16
+        blob[size_offset:size_offset + 8] = (len(data) - 1).to_bytes(8, 'big')
+        self.assertRejected(blob)
+
+
+class TruncationTest(unittest.TestCase):
+    def test_truncated(self):
+        data = os.urandom(SEGMENT_SIZE * 2 + 30)
+        for options in [dict(), dict(compression='zlib'), dict(cipher='gcm', key_id=3)]:
+            blob = seal(data if not options.get('compression') else b'text ' * 40, **options)
+            header_size = container.parse_header(blob).size
+            for cut in [1, 16, SEGMENT_SIZE, len(blob) - header_size]:
+                with self.subTest(options=options, cut=cut):
+                    with self.assertRaises(ValueError):
+                        container.decrypt_bytes(blob[:-cut], KEY)
+
+    def test_truncated_header(self):
+        blob = seal(b'data', key_id=9)
+        with self.assertRaises(ValueError):
+            container.parse_header(blob[:container.HEADER_SIZE + 2])
+
+
+class LegacyTest(unittest.TestCase):
+    def setUp(self):
+        self.data = b'written before the chunked format' * 10
+        cipher = AES.new(KEY, AES.MODE_EAX)
+        ciphertext, tag = cipher.encrypt_and_digest(self.data)
+        self.blob = cipher.nonce + tag + ciphertext
+
+    def test_decrypts(self):
+        self.assertFalse(container.is_container(self.blob))
+        self.assertIsNone(container.open_reader(io.BytesIO(self.blob), len(self.blob)))
+        self.assertEqual(container.blob_key_id(io.BytesIO(self.blob)), 0)
+        self.assertEqual(File_transfer.decrypt_file(self.blob, KEY), self.data)
+
+    def test_plaintext_size(self):
+        with tempfile.NamedTemporaryFile(suffix='.enc', delete=False) as f:
+            f.write(self.blob)
+        try:
+            self.assertEqual(container.blob_plaintext_size(f.name), len(self.data))
+        finally:
+            os.remove(f.name)
+
+    def test_tampered(self):
+        blob = bytearray(self.blob)
+        blob[-1] ^= 1
+        with self.assertRaises(ValueError):
+            File_transfer.decrypt_file(bytes(blob), KEY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import key_store
+import metadata_store
+
+
+class RetireTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = metadata_store.MetadataStore(self.folder)
+        self.keyring = key_store.KeyRing(os.path.join(self.folder, 'keyring.json'), b'0' * 16,
+                                         retire_check=self.key_still_needed)
+        self.old = self.keyring.add(activate=True)
+        self.new = self.keyring.add(activate=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def key_still_needed(self, key_id):
+        in_use = self.store.count_blobs_with_key(key_id)
+        return f'{in_use} stored blobs are still encrypted with key {key_id}' if in_use else None
+
+    def test_refused_while_blobs_use_the_key(self):
+        # Two files deduplicated onto one blob, plus a chunk
+        self.store.record_upload('a', 1, '/blobs/x.enc', 'sum', 'x', key_id=self.old)
+        self.store.record_upload('b', 1, '/blobs/x.enc', 'sum', 'x', key_id=self.old)
+        self.store.record_chunked_upload('c', 2, 'sum', 'c', [('y', 0, 2, '/blobs/y.chunk.enc', self.old)])
+        with self.assertRaisesRegex(ValueError, '2 stored blobs'):
+            self.keyring.retire(self.old)
+        self.assertIn(self.old, self.keyring.status()['keys'])
+
+        # Re-encryption records the new key per blob
+        self.store.set_key_id('/blobs/x.enc', self.new)
+        with self.assertRaisesRegex(ValueError, '1 stored blobs'):
+            self.keyring.retire(self.old)
+        self.store.set_key_id('/blobs/y.chunk.enc', self.new)
+        self.keyring.retire(self.old)
+        self.assertNotIn(self.old, self.keyring.status()['keys'])
+
+    def test_cloud_only_blobs_are_listed_for_rekey(self):
+        self.store.record_upload('a', 1, '/blobs/x.enc', 'sum', 'x', key_id=self.old)
+        self.store.record_upload('b', 1, None, 'sum', 'y', cloud_id='drive-y', key_id=self.old)
+        self.assertEqual([blob['blob_id'] for blob in self.store.list_blobs()], ['/blobs/x.enc'])
+        blobs = self.store.list_blobs(cloud_only=True)
+        self.assertEqual([blob['blob_id'] for blob in blobs], ['/blobs/x.enc', metadata_store.CLOUD_BLOB_PREFIX + 'y'])
+        self.assertEqual(self.store.list_blobs(blobs[0]['blob_id'], cloud_only=True), blobs[1:])
+
+        # Re-encryption records the new key by cloud ID for blobs without a local copy
+        self.store.set_key_id('/blobs/x.enc', self.new)
+        self.store.set_key_id(None, self.new, 'drive-y')
+        self.keyring.retire(self.old)
+
+    def test_unrecorded_keys_are_reported(self):
+        self.store.record_upload('a', 1, '/blobs/x.enc', 'sum', 'x')
+        self.store.record_upload('b', 1, '/blobs/z.enc', 'sum', 'z', key_id=self.new)
+        self.assertEqual(self.store.blobs_without_key_id(), ['/blobs/x.enc'])
+
+    def test_active_and_builtin_keys_are_refused_first(self):
+        with self.assertRaisesRegex(ValueError, 'active'):
+            self.keyring.retire(self.new)
+        with self.assertRaisesRegex(ValueError, 'built in'):
+            self.keyring.retire(key_store.LEGACY_KEY_ID)
+
+
+if __name__ == '__main__':
+    unittest.main()
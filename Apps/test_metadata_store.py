@@ -0,0 +1,126 @@
+import shutil
+import tempfile
+import threading
+import unittest
+
+import metadata_store
+
+
+class ConcurrentWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = metadata_store.MetadataStore(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def run_writers(self, write, threads=8, calls=200):
+        errors = []
+
+        def worker(thread):
+            try:
+                for call in range(calls):
+                    write(thread, call)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        self.assertEqual(errors, [])
+
+    def test_record_uploads(self):
+        def write(thread, call):
+            # Overlapping names so writers replace each other's rows
+            name = f'file-{call % 50}'
+            self.store.record_uploads([(name, call, f'/blobs/{thread}-{call}.enc', 'sum', f'{thread}-{call}',
+                                        None, metadata_store.STATE_PENDING, 1)])
+
+        self.run_writers(write)
+        self.assertEqual(self.store.count(), 50)
+
+    def test_record_chunked_upload(self):
+        def write(thread, call):
+            chunks = [(f'chunk-{call % 7}', 0, 10, f'/blobs/chunk-{call % 7}.enc', 1),
+                      (f'chunk-{thread}', 10, 10, f'/blobs/chunk-{thread}.enc', 1)]
+            self.store.record_chunked_upload(f'file-{call % 20}', 20, 'sum', f'{thread}-{call}', chunks)
+
+        self.run_writers(write)
+        self.assertEqual(self.store.count(), 20)
+        for seq in range(20):
+            self.assertEqual(len(self.store.get_manifest(f'file-{seq}')), 2)
+
+
+class ReusedBlobTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = metadata_store.MetadataStore(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_released_blob_is_not_recorded(self):
+        self.store.record_upload('a', 1, '/blobs/x.enc', 'sum', 'x')
+        # 'b' deduplicates onto x.enc, then 'a' is replaced before 'b' is recorded
+        self.assertEqual(self.store.record_upload('a', 1, '/blobs/y.enc', 'sum', 'y'), ['/blobs/x.enc'])
+        with self.assertRaises(metadata_store.BlobReleased) as released:
+            self.store.record_upload('b', 1, '/blobs/x.enc', 'sum', 'x', reused=['/blobs/x.enc'])
+        self.assertEqual(released.exception.released, {'/blobs/x.enc'})
+        self.assertIsNone(self.store.get('b'))
+
+        self.store.record_upload('c', 1, '/blobs/y.enc', 'sum', 'y', reused=['/blobs/y.enc'])
+        self.assertEqual(self.store.get('c')['local_path'], '/blobs/y.enc')
+
+    def test_released_chunk_is_not_recorded(self):
+        self.store.record_chunked_upload('a', 2, 'sum', 'a', [('x', 0, 2, '/blobs/x.chunk.enc', 1)])
+        self.store.record_upload('a', 1, '/blobs/y.enc', 'sum', 'y')
+        self.assertIsNone(self.store.get_chunk('x'))
+        with self.assertRaises(metadata_store.BlobReleased) as released:
+            self.store.record_chunked_upload('b', 2, 'sum', 'b', [('x', 0, 2, '/blobs/x.chunk.enc', 1)],
+                                             reused=['x'])
+        self.assertEqual(released.exception.released, {'x'})
+        self.assertIsNone(self.store.get('b'))
+
+
+class ListFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = metadata_store.MetadataStore(self.folder)
+        for size, name in enumerate(['a', 'a-b', 'ab', 'b', 'a.x', 'c']):
+            self.store.record_upload(name, size % 3, f'/blobs/{name}.enc', 'sum')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def page_through(self, sort, descending=False, limit=2, **filters):
+        names = []
+        after = None
+        while True:
+            rows = self.store.list_files(sort=sort, descending=descending, after=after, limit=limit, **filters)
+            names += [row['name'] + '.enc' for row in rows]
+            if len(rows) < limit:
+                return names
+            last = rows[-1]
+            after = {'name': (last['name'] + '.enc',),
+                     'size': (last['size'], last['name'] + '.enc')}[sort]
+
+    def test_keyset_pages_follow_listed_names(self):
+        # 'a-b.enc' sorts before 'a.enc' although 'a' sorts before 'a-b'
+        expected = sorted(name + '.enc' for name in ['a', 'a-b', 'ab', 'b', 'a.x', 'c'])
+        self.assertEqual(self.page_through('name'), expected)
+        self.assertEqual(self.page_through('name', descending=True), expected[::-1])
+
+    def test_keyset_pages_by_size(self):
+        rows = self.store.list_files()
+        expected = [name for _, name in sorted((row['size'], row['name'] + '.enc') for row in rows)]
+        self.assertEqual(self.page_through('size', limit=1), expected)
+
+    def test_filters(self):
+        self.assertEqual(self.page_through('name', prefix='a.'), ['a.enc', 'a.x.enc'])
+        self.assertEqual(self.page_through('name', substring='B.E'), ['a-b.enc', 'ab.enc', 'b.enc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,5 @@
+"""WSGI entry point for servers that expect a module-level `app` (uWSGI, waitress, mod_wsgi)"""
+
+from File_transfer import create_app
+
+app = create_app()